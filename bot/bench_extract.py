@@ -0,0 +1,185 @@
+import re
+import time
+import random
+import argparse
+import multiprocessing
+import extract
+
+
+# Бенчмарк поиска email и телефонов: выражения bot.py и max_bot.py,
+# обычный re.findall по всему тексту против extract.Extractor на одних и тех же корпусах.
+# Запуск: python bench_extract.py [--sizes 1K,1M,50M] [--corpora realistic,adv_dots] [--legacy-limit 10]
+
+PATTERNS = {
+    'bot.py email': extract.EMAIL,
+    'bot.py phone': extract.PHONE,
+    'max_bot.py email': extract.EMAIL_RFC,
+    'max_bot.py phone': extract.PHONE_FULL,
+}
+
+WORDS = ['Привет', 'сервер', 'запрос', 'ответ', 'error', 'timeout', 'user', 'GET', '/api/v1/items', '200',
+         'connection', 'reset', 'по', 'и', 'в', 'не', 'id=42', 'status:', 'ok', '2024-03-01T03:12:45']
+EMAILS = ['ivan.petrov@mail.ru', 'support@example.com', 'a.b-c+tag@sub.domain.org', 'USER_1@Test.IO']
+PHONES = ['+7 (912) 345-67-89', '8 800 555 35 35', '89123456789', '+7-912-345-67-89', '8(912)3456789']
+
+
+def realistic(size, rng):
+    # Строки лога с редкими адресами и номерами
+    parts = []
+    length = 0
+    while length < size:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 15))]
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words)), rng.choice(EMAILS))
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words)), rng.choice(PHONES))
+        line = ' '.join(words) + '\n'
+        parts.append(line)
+        length += len(line)
+    return ''.join(parts)[:size]
+
+
+def csv(size, rng):
+    parts = ['id,name,email,phone\n']
+    length = len(parts[0])
+    i = 0
+    while length < size:
+        i += 1
+        line = f"{i},Иван Петров,{rng.choice(EMAILS)},{rng.choice(PHONES)}\n"
+        parts.append(line)
+        length += len(line)
+    return ''.join(parts)[:size]
+
+
+def repeat(unit, prefix=''):
+    def corpus(size, rng):
+        return (prefix + unit * (size // len(unit) + 1))[:size]
+    return corpus
+
+
+CORPORA = {
+    'realistic': realistic,
+    'csv': csv,
+    # Граница слова перед каждой буквой и ни одного '@': \b[...]+@ в bot.py проходит хвост от каждой позиции
+    'adv_dots': repeat('a.'),
+    # Одна длинная локальная часть и '@' без домена в самом конце
+    'adv_local': lambda size, rng: 'a' * (size - 1) + '@',
+    # Якорь через символ
+    'adv_at': repeat('a@'),
+    # Домен из дефисов и букв без точки: [A-Za-z0-9-]*[A-Za-z0-9] в max_bot.py перебирает все разбиения
+    'adv_domain': repeat('a-', prefix='x@'),
+    # Бесконечная последовательность цифр '8'
+    'adv_digits': repeat('8'),
+    'adv_phone_seps': repeat('8 ('),
+}
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 * 1024}
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    if value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def format_size(size):
+    if size >= SIZE_UNITS['M']:
+        return f"{size / SIZE_UNITS['M']:g}M"
+    if size >= SIZE_UNITS['K']:
+        return f"{size / SIZE_UNITS['K']:g}K"
+    return str(size)
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def _legacy_worker(pattern, text, connection):
+    connection.send(timed(re.compile(pattern).findall, text))
+
+
+def timed_legacy(pattern, text, limit):
+    # re.findall нельзя прервать, поэтому он выполняется в отдельном процессе и убивается по таймауту.
+    # Возвращает (matches, seconds) или None, если не уложился в limit
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('fork').Process(target=_legacy_worker, args=(pattern, text, sender))
+    process.start()
+    try:
+        if receiver.poll(limit):
+            return receiver.recv()
+        return None
+    finally:
+        process.kill()
+        process.join()
+
+
+def throughput(size, seconds):
+    return f"{size / SIZE_UNITS['M'] / seconds:9.1f} MB/s" if seconds > 0 else '        - MB/s'
+
+
+def message_latency(extractor, text, runs):
+    # Задержка на одно сообщение Telegram (до 4096 символов): медиана и худший случай
+    sample = text[:4096]
+    legacy = re.compile(extractor.regex.pattern)
+    results = {}
+    for name, function in (('legacy', lambda: legacy.findall(sample)),
+                           ('engine', lambda: extractor.scan(sample, None, None))):
+        times = sorted(timed(function)[1] for _ in range(runs))
+        results[name] = (times[len(times) // 2], times[-1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Regex extraction benchmark')
+    parser.add_argument('--sizes', default='1K,64K,1M,10M,50M')
+    parser.add_argument('--corpora', default=','.join(CORPORA))
+    parser.add_argument('--patterns', default=','.join(PATTERNS))
+    parser.add_argument('--legacy-limit', type=float, default=10.0,
+                        help='kill re.findall after this many seconds and skip larger sizes')
+    parser.add_argument('--runs', type=int, default=200, help='runs for per-message latency')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    corpora = args.corpora.split(',')
+    patterns = args.patterns.split(',')
+
+    print(f"{'corpus':<16}{'size':>6}  {'pattern':<18}{'legacy':>10} {'':>14}  {'engine':>10} {'':>14}  matches")
+    for corpus in corpora:
+        slow = set()
+        for size in sizes:
+            text = CORPORA[corpus](size, random.Random(args.seed))
+            for name in patterns:
+                extractor = PATTERNS[name]
+                result, engine_time = timed(extractor.scan, text, None, None)
+                if name in slow:
+                    legacy_column = f"{'skipped':>10} {'':>14}"
+                    same = ''
+                else:
+                    legacy = timed_legacy(extractor.regex.pattern, text, args.legacy_limit)
+                    if legacy is None:
+                        slow.add(name)
+                        legacy_column = f"{'>' + format(args.legacy_limit, 'g') + 's':>10} {'':>14}"
+                        same = ''
+                    else:
+                        legacy, legacy_time = legacy
+                        legacy_column = f"{legacy_time:9.4f}s {throughput(size, legacy_time)}"
+                        same = ' (same)' if legacy == result.matches else ' (DIFFERENT)'
+                print(f"{corpus:<16}{format_size(size):>6}  {name:<18}{legacy_column}  "
+                      f"{engine_time:9.4f}s {throughput(size, engine_time)}  {len(result.matches)}{same}")
+
+    print()
+    print('Per-message latency (4096 chars), median / worst:')
+    for corpus in corpora:
+        text = CORPORA[corpus](4096, random.Random(args.seed))
+        for name in patterns:
+            latency = message_latency(PATTERNS[name], text, args.runs)
+            print(f"{corpus:<16}{name:<18}legacy {latency['legacy'][0] * 1e6:9.1f} / {latency['legacy'][1] * 1e6:9.1f} us"
+                  f"   engine {latency['engine'][0] * 1e6:9.1f} / {latency['engine'][1] * 1e6:9.1f} us")
+
+
+if __name__ == '__main__':
+    main()
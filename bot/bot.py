@@ -1,19 +1,39 @@
 import os
 import re
-import paramiko
-import psycopg2
 import logging
-import subprocess
+import logsetup
+import asyncio
+from datetime import datetime, timedelta, timezone
+import cache
+import extract
+import documents
+import normalize
+import packages
+import limits
+import delivery
+import fleet
+import metrics
+import webhook
+import ssh_client
+import postgres
+import replog
+import sampler
+import state
+import sysinfo
 from dotenv import load_dotenv
-from telegram import Update
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
 
 
-logging.basicConfig(filename='bot.log', level=logging.DEBUG, format=' %(asctime)s - %(name)s - %(levelname)s - %(message)s', encoding="utf-8")
 logger = logging.getLogger(__name__)
 
 load_dotenv()
+# Запись в файл идет в фоновом потоке, см. logsetup
+logsetup.setup('bot.log', logging.DEBUG, ' %(asctime)s - %(name)s - %(levelname)s - %(message)s')
 TOKEN = os.getenv('TOKEN')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+# Сколько найденных в файле значений показывать в сообщении, остальные - во вложении
+DOC_PREVIEW = int(os.getenv('DOC_PREVIEW', '20'))
 HOST = os.getenv('RM_HOST')
 SSH_PORT = os.getenv('RM_PORT')
 SSH_USER = os.getenv('RM_USER')
@@ -24,490 +44,815 @@ DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_DATABASE')
 DB_HOST = os.getenv("DB_HOST")
+DB_REPL_HOST = os.getenv('DB_REPL_HOST')
+DB_REPL_PORT = os.getenv('DB_REPL_PORT')
 
 
-def connect_db():
-    try:
-        connection = psycopg2.connect(
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME
-        )
-        logger.info("Connected to PostgreSQL database successfully")
-        logger.info(f"user={DB_USER}, password={DB_PASSWORD} host={DB_HOST}, port={DB_PORT}, database={DB_NAME}")
-        return connection
-    except Exception as e:
-        logger.error(f"Error connecting to the database: {str(e)}", exc_info=True)
-        raise
+def get_db_pool():
+    return postgres.get_pool(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME)
+
+def get_db_router():
+    # Запросы только на чтение идут через router.read(...) - на реплику, если она не отстала
+    return postgres.get_router(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, DB_REPL_HOST, DB_REPL_PORT)
 
 # Функция для выполнения SQL-запросов
-def execute_sql_query(query, connection=None):
+async def execute_sql_query(query, *params):
     try:
-        needs_closing = 0
-        if not connection:
-            connection = connect_db()
-            needs_closing = 1
-        cursor = connection.cursor()
-        cursor.execute(query)
-        try:
-            c = cursor.fetchall()
-        except:
-            c = None
-        connection.commit()
+        async with get_db_pool().connection() as connection:
+            c = await connection.fetch(query, *params)
         logger.info("SQL query executed successfully")
         return c
     except Exception as e:
         logger.error(f"Error executing SQL query: {str(e)}", exc_info=True)
-        connection.rollback()
         raise
-    finally:
-        if cursor:
-            cursor.close()
-        if needs_closing:
-            connection.close()
 
-def start(update: Update, context):
+async def start(update: Update, context):
     user = update.effective_user
-    update.message.reply_text(f'Привет {user.full_name}!\nСписок команд доступен в /help')
+    await update.message.reply_text(f'Привет {user.full_name}!\nСписок команд доступен в /help')
 
-def helpCommand(update: Update, context):
+async def helpCommand(update: Update, context):
     logger.debug("Answering help command")
     command_list = ['start', 'help', 'find_email', 'find_phone_number', 'get_repl_logs',
-                    'get_emails', 'get_phone_numbers', 'verify_password', 'get_release',
+                    'get_emails', 'get_phone_numbers', 'lookup <value>', 'verify_password', 'get_release',
                     'get_uname', 'get_uptime', 'get_df', 'get_free', 'get_mpstat',
-                    'get_w', 'get_auths', 'get_critical', 'get_ps', 'get_ss', 'get_apt_list',
-                    'get_apt_list <package_name>', 'get_services' ]
+                    'get_w', 'get_status', 'get_auths', 'get_critical', 'get_ps', 'get_ss', 'get_apt_list',
+                    'get_apt_list <query>', 'get_services', 'get_df <host|group|all>', 'get_df --over 80%',
+                    'get_ps --top 10 --by cpu|mem|rss|pid', 'get_ss --state established --port 22', 'hosts',
+                    'history <free|cpu|df|load> [6h]', 'refresh',
+                    'refresh <command>', 'stats' ]
     command_list_str = "\n".join(['/'+x for x in command_list])
-    update.message.reply_text(f'Доступные команды:\n{command_list_str}')
+    await update.message.reply_text(f'Доступные команды:\n{command_list_str}')
 
-def verifyPasswordCommand(update: Update, context):
+async def verifyPasswordCommand(update: Update, context):
     logger.debug("Answering verify_password command")
-    update.message.reply_text('Введите пароль для проверки сложности: ')
+    await update.message.reply_text('Введите пароль для проверки сложности: ')
     return 'verifyPassword'
 
-def verifyPassword(update: Update, context):
+PASSWORD_REGEX = re.compile(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$')
+
+async def verifyPassword(update: Update, context):
     password = update.message.text
     logger.debug(f"Recieved password to test: {password}")
-    if re.match(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$', password):
-        update.message.reply_text('Пароль сложный')
+    if PASSWORD_REGEX.match(password):
+        await update.message.reply_text('Пароль сложный')
         logger.debug("Password is strong")
     else:
-        update.message.reply_text('Пароль простой')
+        await update.message.reply_text('Пароль простой')
         logger.debug("Password is weak")
     return ConversationHandler.END # Завершаем работу обработчика диалога
 
-def findEmailsCommand(update: Update, context):
+async def findEmailsCommand(update: Update, context):
     logger.debug("Answering find_emails command")
-    update.message.reply_text('Введите текст для поиска email адресов: ')
+    await update.message.reply_text('Введите текст для поиска email адресов или отправьте файл: ')
     return 'findEmails'
 
-def findEmails(update: Update, context):
+async def findEmails(update: Update, context):
     user_input = update.message.text
     logger.debug(f"Recieved text to search for emails: {user_input}")
-    email_regex = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
-    email_list = email_regex.findall(user_input)
+    result = extract.EMAIL.scan(user_input)
+    email_list = result.matches
     logger.debug(f"Emails found: {email_list}")
+    if result.truncated:
+        await update.message.reply_text(extract.describe_truncation(result))
     if not email_list:
-        update.message.reply_text('Email адреса не найдены')
+        await update.message.reply_text('Email адреса не найдены')
         return ConversationHandler.END
    
     else:
         emails = '\n'.join([str(i + 1) + '. ' + x for i, x in enumerate(email_list)])
-        update.message.reply_text(emails)
+        await delivery.send_text(update, emails, 'emails.txt')
         # Предложение записи найденных email адресов в базу данных
-        update.message.reply_text("Хотите сохранить найденные email адреса в базе данных? (Да/Нет)")
+        await update.message.reply_text("Хотите сохранить найденные email адреса в базе данных? (Да/Нет)")
         context.user_data["email_list"] = email_list
         return "confirm_email_save"
     
-def confirm_email_save(update: Update, context):
+@limits.limited('local')
+async def findEmailsDocument(update: Update, context):
+    document = update.message.document
+    logger.debug(f"Recieved document to search for emails: {document.file_name} ({document.file_size} bytes)")
+    try:
+        await update.message.reply_text('Файл получен, идет поиск email адресов...')
+        scan = await documents.scan_document(await document.get_file(), extract.EMAIL)
+    except Exception as e:
+        await update.message.reply_text(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while scanning document for emails", exc_info=True)
+        return ConversationHandler.END
+    if not scan.results:
+        await update.message.reply_text(f"{documents.describe(scan)}\nEmail адреса не найдены")
+        return ConversationHandler.END
+    preview = '\n'.join([str(i + 1) + '. ' + x for i, x in enumerate(scan.results[:DOC_PREVIEW])])
+    await update.message.reply_text(f"{documents.describe(scan)}\n\n{preview}")
+    await update.message.reply_document(documents.results_file(scan.results), filename='emails.txt')
+    await update.message.reply_text("Хотите сохранить найденные email адреса в базе данных? (Да/Нет)")
+    context.user_data["email_list"] = scan.results
+    return "confirm_email_save"
+
+@limits.limited('db')
+async def confirm_email_save(update: Update, context):
     response = update.message.text.lower()
-    email_list = context.user_data["email_list"]
-    if response == "да":
-        connection = connect_db()
-        query = "INSERT INTO email_table (email) VALUES ('"
-        query += "'), ('".join(email_list) + "');"
-        msg = execute_sql_query(query, connection=connection)
-        connection.close()
-        update.message.reply_text("Email адреса успешно сохранены в базе данных.")
+    # Результаты поиска больше не нужны: убираем их из user_data при любом ответе
+    email_list = context.user_data.pop("email_list", [])
+    if response == "да" and not email_list:
+        await update.message.reply_text("Результаты поиска устарели, повторите /find_email")
+    elif response == "да":
+        try:
+            emails = normalize.normalize_all(email_list, normalize.email)
+            inserted = await postgres.bulk_insert(get_db_pool(), 'email_table', 'email', emails)
+            await update.message.reply_text(f"Email адреса успешно сохранены в базе данных. "
+                                            f"Новых: {inserted}, уже были в базе: {len(emails) - inserted}.")
+        except Exception as e:
+            await update.message.reply_text(f"An error occurred: {str(e)}")
+            logger.error("Error occurred while saving emails", exc_info=True)
     else:
-        update.message.reply_text("Email адреса не были сохранены в базе данных.")
+        await update.message.reply_text("Email адреса не были сохранены в базе данных.")
     return ConversationHandler.END
 
-def findPhoneNumbersCommand(update: Update, context):
+async def findPhoneNumbersCommand(update: Update, context):
     logger.debug("Answering find_phone_number command")
-    update.message.reply_text('Введите текст для поиска телефонных номеров: ')
+    await update.message.reply_text('Введите текст для поиска телефонных номеров или отправьте файл: ')
     return 'findPhoneNumbers'
 
-def findPhoneNumbers (update: Update, context):
+async def findPhoneNumbers (update: Update, context):
     user_input = update.message.text # Получаем текст, содержащий(или нет) номера телефонов
     logger.debug(f"Recieved text to search for phone numbers: {user_input}")
-    phoneNumRegex = re.compile(r'(?:\+7|\b8)(?:[ -]?\(?)(\d{3})(?:\)?)(?:[ -]?)(\d{3})(?:[ -]?)(\d{2})(?:[ -]?)(\d{2}\b)')
-    
-
-    phoneNumberList = phoneNumRegex.findall(user_input) # Ищем номера телефонов
+    result = extract.PHONE.scan(user_input)
+    phoneNumberList = result.matches # Ищем номера телефонов
+    if result.truncated:
+        await update.message.reply_text(extract.describe_truncation(result))
 
     if not phoneNumberList: # Обрабатываем случай, когда номеров телефонов нет
-        update.message.reply_text('Телефонные номера не найдены')
+        await update.message.reply_text('Телефонные номера не найдены')
         return ConversationHandler.END # Завершаем выполнение функции
 
     phoneNumbers = '' # Создаем строку, в которую будем записывать номера телефонов
     for i in range(len(phoneNumberList)):
         phoneNumbers += f'{i+1}. {" ".join(phoneNumberList[i])}\n' # Записываем очередной номер
 
-    update.message.reply_text(phoneNumbers) # Отправляем сообщение пользователю
+    await delivery.send_text(update, phoneNumbers, 'phone_numbers.txt') # Отправляем сообщение пользователю
 
-    update.message.reply_text("Хотите сохранить найденные номера телефонов в базе данных? (Да/Нет)")
+    await update.message.reply_text("Хотите сохранить найденные номера телефонов в базе данных? (Да/Нет)")
     context.user_data["phoneNumberList"] = phoneNumberList
     return "confirm_phone_save"
      
 
-def confirm_phone_save(update: Update, context):
+@limits.limited('local')
+async def findPhoneNumbersDocument(update: Update, context):
+    document = update.message.document
+    logger.debug(f"Recieved document to search for phone numbers: {document.file_name} ({document.file_size} bytes)")
+    try:
+        await update.message.reply_text('Файл получен, идет поиск телефонных номеров...')
+        scan = await documents.scan_document(await document.get_file(), extract.PHONE)
+    except Exception as e:
+        await update.message.reply_text(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while scanning document for phone numbers", exc_info=True)
+        return ConversationHandler.END
+    if not scan.results:
+        await update.message.reply_text(f"{documents.describe(scan)}\nТелефонные номера не найдены")
+        return ConversationHandler.END
+    phoneNumbers = [" ".join(phoneNumber) for phoneNumber in scan.results]
+    preview = '\n'.join([str(i + 1) + '. ' + x for i, x in enumerate(phoneNumbers[:DOC_PREVIEW])])
+    await update.message.reply_text(f"{documents.describe(scan)}\n\n{preview}")
+    await update.message.reply_document(documents.results_file(phoneNumbers), filename='phone_numbers.txt')
+    await update.message.reply_text("Хотите сохранить найденные номера телефонов в базе данных? (Да/Нет)")
+    context.user_data["phoneNumberList"] = scan.results
+    return "confirm_phone_save"
+
+@limits.limited('db')
+async def confirm_phone_save(update: Update, context):
     response = update.message.text.lower()
-    phoneNumberList = context.user_data["phoneNumberList"]
+    phoneNumberList = context.user_data.pop("phoneNumberList", [])
     phoneNumbers = []
     for i in range(len(phoneNumberList)):
         phoneNumbers.append(" ".join(phoneNumberList[i]))
-    if response == "да":
-        connection = connect_db()
-        query = "INSERT INTO phone_table (phone) VALUES ('"
-        query += "'), ('".join(phoneNumbers) + "');"
-        msg = execute_sql_query(query, connection=connection)
-        connection.close()
-        update.message.reply_text("Номера телефонов успешно сохранены в базе данных.")
+    if response == "да" and not phoneNumbers:
+        await update.message.reply_text("Результаты поиска устарели, повторите /find_phone_number")
+    elif response == "да":
+        try:
+            phoneNumbers = normalize.normalize_all(phoneNumbers, normalize.phone) # Приводим к E.164
+            inserted = await postgres.bulk_insert(get_db_pool(), 'phone_table', 'phone_number', phoneNumbers)
+            await update.message.reply_text(f"Номера телефонов успешно сохранены в базе данных. "
+                                            f"Новых: {inserted}, уже были в базе: {len(phoneNumbers) - inserted}.")
+        except Exception as e:
+            await update.message.reply_text(f"An error occurred: {str(e)}")
+            logger.error("Error occurred while saving phone numbers", exc_info=True)
     else:
-        update.message.reply_text("Номера телефонов не были сохранены в базе данных.")
+        await update.message.reply_text("Номера телефонов не были сохранены в базе данных.")
     return ConversationHandler.END 
 
-def connect_ssh():
-    try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(HOST, port=SSH_PORT, username=SSH_USER, password=SSH_PASSWORD)
-        logger.info("SSH connection established successfully")
-        return client
-    except Exception as e:
-        logger.error(f"Error connecting to SSH: {str(e)}", exc_info=True)
-        raise
-
-def execute_ssh_command(client, command):
+async def execute_ssh_command(command):
     try:
         logger.debug(f"executing SSH command: {command}")
-        stdin, stdout, stderr = client.exec_command(command)
-        output = stdout.read().decode()
-        return output
+        session = ssh_client.get_session(HOST, SSH_PORT, SSH_USER, SSH_PASSWORD)
+        result = await session.exec_stream(command)
+        if result.stderr:
+            logger.debug(f"SSH command {command} wrote to stderr: {result.stderr.strip()}")
+        return result.stdout + result.notice()
     except Exception as e:
         logger.error(f"Error executing SSH command: {str(e)}", exc_info=True)
         raise
 
-def get_repl_logs(update, context):
+async def stream_ssh_command(update, command, filename='output.txt'):
+    # Вывод (stdout и stderr в порядке поступления) отправляется по мере получения, а не после завершения команды
+    logger.debug(f"streaming SSH command: {command}")
+    session = ssh_client.get_session(HOST, SSH_PORT, SSH_USER, SSH_PASSWORD)
+    stream = delivery.Stream(update, filename)
+    result = await session.exec_stream(command, stream.write)
+    await stream.write(result.notice())
+    await stream.close()
+
+async def execute_cached_ssh_command(command):
+    # Редко меняющиеся выводы берутся из кэша, к ответу дописывается возраст записи
+    output, age = await cache.ssh_cache.get_or_load((HOST, command), lambda: execute_ssh_command(command),
+                                              cache.ttl_for(command))
+    if age is not None:
+        logger.debug(f"SSH command served from cache: {command}")
+    return cache.format_age(output, age)
+
+# Фоновый опрос хоста: /get_free и /get_df отвечают по последнему образцу, /history - по накопленным данным
+SAMPLER = sampler.Sampler(HOST, SSH_PORT, SSH_USER, SSH_PASSWORD, pool=get_db_pool, router=get_db_router)
+
+async def execute_view(view, args):
+    # Вывод команды в компактном виде с параметрами вида --top 10 (проверены в fleet.multi_host).
+    # Фильтры передаются в команду на хосте; свежий образец фонового опроса фильтруется локально
+    positional, options = view.parse_args(args)
+    sample = SAMPLER.latest(view.command())
+    if sample is not None:
+        logger.debug(f"{view.name} served from the latest sample")
+        return sampler.format_sample(view.render(sample[0], options), sample[1])
+    return view.render(await execute_ssh_command(view.command(options)), options)
+
+# Последние 80 строк про репликацию с соседними строками, как grep repl -B 1 -A 1 | tail -n 80
+REPL_LOG = replog.LogTail(os.getenv('REPL_LOG_PATH', '/var/log/postgresql/postgresql-15-main.log'), 'repl', 80,
+                          context=1, state_path=os.getenv('REPL_LOG_STATE', 'repl_log_state.json'))
+
+# События репликации в памяти: фоновая задача следит за логом и разбирает строки по мере появления
+REPL_EVENTS = replog.EventStore(int(os.getenv('REPL_EVENTS_SIZE', '10000')))
+REPL_WATCHER = replog.LogWatcher(REPL_LOG.path, REPL_EVENTS, interval=float(os.getenv('REPL_WATCH_INTERVAL', '1')),
+                                 backfill=int(os.getenv('REPL_WATCH_BACKFILL', str(10 * 1024 * 1024))))
+REPL_LEVELS = ('DEBUG5', 'DEBUG4', 'DEBUG3', 'DEBUG2', 'DEBUG1', 'INFO', 'NOTICE', 'WARNING',
+               'ERROR', 'LOG', 'FATAL', 'PANIC', 'DETAIL', 'HINT', 'STATEMENT', 'CONTEXT')
+
+def parse_since(value):
+    # 30m, 2h, 1d - относительно текущего времени; 03:00 - сегодня (или вчера, если еще не наступило);
+    # 2024-03-01T03:00 - точное время. Время вводится местное, а replog.parse_event приводит время записей
+    # лога к UTC, поэтому результат - наивное время UTC
+    now = datetime.now(timezone.utc)
+    match = re.fullmatch(r'(\d+)([smhd])', value)
+    if match:
+        seconds = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+        return (now - timedelta(seconds=int(match.group(1)) * seconds)).replace(tzinfo=None)
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', value)
+    if match:
+        local_now = now.astimezone()
+        since = local_now.replace(hour=int(match.group(1)), minute=int(match.group(2)), second=0, microsecond=0)
+        if since > local_now:
+            since -= timedelta(days=1)
+    else:
+        since = datetime.fromisoformat(value)
+        if since.tzinfo is None:
+            # Без явного смещения - местное время
+            since = since.astimezone()
+    return since.astimezone(timezone.utc).replace(tzinfo=None)
+
+def parse_repl_filters(args):
+    # /get_repl_logs since=03:00 level=ERROR,FATAL slot=replication_slot grep=START limit=20
+    query = {'limit': 20}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        if not sep or not value:
+            raise ValueError(f"ожидается ключ=значение, получено: {arg}")
+        if key == 'since':
+            query['since'] = parse_since(value)
+        elif key == 'level':
+            levels = value.upper().split(',')
+            unknown = [level for level in levels if level not in REPL_LEVELS]
+            if unknown:
+                raise ValueError(f"неизвестный уровень: {', '.join(unknown)}")
+            query['levels'] = levels
+        elif key == 'limit':
+            query['limit'] = max(1, min(int(value), REPL_EVENTS.capacity))
+        elif key == 'slot':
+            query['slot'] = value
+        elif key == 'grep':
+            query['text'] = value
+        else:
+            raise ValueError(f"неизвестный фильтр: {key}")
+    return query
+
+@limits.limited('local')
+async def get_repl_logs(update, context):
     try:
-        command = "cat /var/log/postgresql/postgresql-15-main.log | grep repl -B 1 -A 1| tail -n 80"
-        
-        logs = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        logs = logs.stdout
-        # Split the response into chunks
-        chunk_size = 4096  # Adjust the chunk size as needed
-        chunks = [logs[i:i+chunk_size] for i in range(0, len(logs), chunk_size)]
-
-        # Send each chunk as a separate message
-        for chunk in chunks:
-            update.message.reply_text(chunk)
+        if context.args:
+            # С фильтрами отвечаем из памяти, без чтения файла
+            try:
+                query = parse_repl_filters(context.args)
+            except ValueError as e:
+                await update.message.reply_text(f"Неверный фильтр: {str(e)}\n"
+                                                "Пример: /get_repl_logs since=03:00 level=ERROR limit=20")
+                return
+            logs = '\n'.join(str(event) for event in REPL_EVENTS.query(**query))
+        else:
+            logs = await asyncio.to_thread(REPL_LOG.read)
+        if not logs:
+            await update.message.reply_text("Записи о репликации не найдены")
+            return
+        await delivery.send_text(update, logs, 'repl_logs.txt')
         
-        logger.info("Retrieved information about installed packages")
+        logger.info("Retrieved replication logs")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
-        logger.error("Error occurred while retrieving information about installed packages", exc_info=True)
-    finally:
-        if client:
-            client.close()
+        await update.message.reply_text(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while retrieving replication logs", exc_info=True)
+
+# Таблицы, которые можно листать кнопками: ключ callback_data -> (таблица, колонка)
+PAGED_TABLES = {'emails': ('email_table', 'email'), 'phones': ('phone_table', 'phone_number')}
+MESSAGE_LIMIT = 4096
+
+async def render_table_page(kind, after_id=None, before_id=None):
+    table, column = PAGED_TABLES[kind]
+    rows, has_prev, has_next = await get_db_router().read(postgres.fetch_page, table, column, after_id, before_id)
+    # Строки не разрезаются: если страница не влезает в сообщение, остаток уходит на следующую
+    lines = []
+    length = 0
+    for i, row in enumerate(rows):
+        line = f"{row[0]}. {row[1]}"
+        if lines and length + len(line) + 1 > MESSAGE_LIMIT:
+            rows = rows[:i]
+            has_next = True
+            break
+        lines.append(line)
+        length += len(line) + 1
+    buttons = []
+    if rows and has_prev:
+        buttons.append(InlineKeyboardButton("<<", callback_data=f"{kind}:prev:{rows[0][0]}"))
+    if rows and has_next:
+        buttons.append(InlineKeyboardButton(">>", callback_data=f"{kind}:next:{rows[-1][0]}"))
+    markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return '\n'.join(lines) or "Записей нет", markup
+
+# Куда смотреть при /lookup: тип значения -> (таблица, колонка)
+LOOKUP_TABLES = {'email': ('email_table', 'email'), 'phone': ('phone_table', 'phone_number')}
+
+@limits.limited('db')
+async def lookup(update, context):
+    # /lookup <email или телефон> - есть ли значение в базе, поиск по уникальному индексу
+    value = ' '.join(context.args)
+    detected = normalize.detect(value) if value else None
+    if detected is None:
+        await update.message.reply_text("Использование: /lookup <email или номер телефона>")
+        return
+    kind, canonical = detected
+    try:
+        row_id = await get_db_router().read(postgres.find_id, *LOOKUP_TABLES[kind], canonical)
+        if row_id is None:
+            await update.message.reply_text(f"{canonical} не найден в базе данных")
+        else:
+            await update.message.reply_text(f"{canonical} есть в базе данных (id {row_id})")
+        logger.info(f"Looked up {kind} {canonical}")
+    except Exception as e:
+        await update.message.reply_text(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while looking up value", exc_info=True)
 
-def get_emails(update, context):
-    
-    msg = execute_sql_query("SELECT * from email_table;")
-    msg = [str(i[0]) + ". " + str(i[1]) for i in msg]
-    msg = '\n'.join(msg)
-    # Split the response into chunks
-    chunk_size = 4096  # Adjust the chunk size as needed
-    chunks = [msg[i:i+chunk_size] for i in range(0, len(msg), chunk_size)]
-
-    # Send each chunk as a separate message
-    for chunk in chunks:
-        update.message.reply_text(chunk)
-    
-    logger.info("Retrieved email_table table")
+@limits.limited('db')
+async def get_emails(update, context):
+    try:
+        text, markup = await render_table_page('emails')
+        await update.message.reply_text(text, reply_markup=markup)
+        logger.info("Retrieved email_table table")
+    except Exception as e:
+        await update.message.reply_text(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while retrieving email_table table", exc_info=True)
 
-def get_phone_numbers(update, context):
-    
-    msg = execute_sql_query("SELECT * from phone_table;")
-    msg = [str(i[0]) + ". " + str(i[1]) for i in msg]
-    msg = '\n'.join(msg)
-    # Split the response into chunks
-    chunk_size = 4096  # Adjust the chunk size as needed
-    chunks = [msg[i:i+chunk_size] for i in range(0, len(msg), chunk_size)]
-
-    # Send each chunk as a separate message
-    for chunk in chunks:
-        update.message.reply_text(chunk)
-    
-    logger.info("Retrieved phone numbers table")
+@limits.limited('db')
+async def get_phone_numbers(update, context):
+    try:
+        text, markup = await render_table_page('phones')
+        await update.message.reply_text(text, reply_markup=markup)
+        logger.info("Retrieved phone numbers table")
+    except Exception as e:
+        await update.message.reply_text(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while retrieving phone numbers table", exc_info=True)
+
+@limits.limited('db')
+async def table_page_callback(update, context):
+    query = update.callback_query
+    kind, direction, key = query.data.split(':')
+    try:
+        if direction == 'next':
+            text, markup = await render_table_page(kind, after_id=int(key))
+        else:
+            text, markup = await render_table_page(kind, before_id=int(key))
+        await query.answer()
+        await query.edit_message_text(text, reply_markup=markup)
+    except Exception as e:
+        await query.answer(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while paging table", exc_info=True)
 
-def get_release(update, context):
+@limits.limited('ssh')
+@fleet.multi_host('lsb_release -a')
+async def get_release(update, context):
     try:
-        client = connect_ssh()
-        release = execute_ssh_command(client, 'lsb_release -a')
-        update.message.reply_text(release)
+        release = await execute_cached_ssh_command('lsb_release -a')
+        await delivery.send_text(update, release)
         logger.info("Retrieved information about the system release")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving information about the system release", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_uname(update, context):
+@limits.limited('ssh')
+@fleet.multi_host('uname -a')
+async def get_uname(update, context):
     try:
-        client = connect_ssh()
-        uname = execute_ssh_command(client, 'uname -a')
-        update.message.reply_text(uname)
+        uname = await execute_cached_ssh_command('uname -a')
+        await delivery.send_text(update, uname)
         logger.info("Retrieved system information")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving system information", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_uptime(update, context):
+@limits.limited('ssh')
+@fleet.multi_host('uptime')
+async def get_uptime(update, context):
     try:
-        client = connect_ssh()
-        uptime = execute_ssh_command(client, 'uptime')
-        update.message.reply_text(uptime)
+        await stream_ssh_command(update, 'uptime')
         logger.info("Retrieved system uptime information")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving system uptime information", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_df(update, context):
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.DF)
+async def get_df(update, context):
     try:
-        client = connect_ssh()
-        df = execute_ssh_command(client, 'df')
-        update.message.reply_text(df)
+        df = await execute_view(sysinfo.DF, context.args)
+        await delivery.send_text(update, df)
         logger.info("Retrieved file system information")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving file system information", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_free(update, context):
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.FREE)
+async def get_free(update, context):
     try:
-        client = connect_ssh()
-        free = execute_ssh_command(client, 'free')
-        update.message.reply_text(free)
+        free = await execute_view(sysinfo.FREE, context.args)
+        await delivery.send_text(update, free)
         logger.info("Retrieved memory usage information")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving memory usage information", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_mpstat(update, context):
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.MPSTAT)
+async def get_mpstat(update, context):
     try:
-        client = connect_ssh()
-        mpstat = execute_ssh_command(client, 'mpstat')
-        update.message.reply_text(mpstat)
+        mpstat = await execute_view(sysinfo.MPSTAT, context.args)
+        await delivery.send_text(update, mpstat)
         logger.info("Retrieved mpstat information")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving mpstat information", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_w(update, context):
+@limits.limited('ssh')
+@fleet.multi_host('w')
+async def get_w(update, context):
     try:
-        client = connect_ssh()
-        w = execute_ssh_command(client, 'w')
-        update.message.reply_text(w)
+        await stream_ssh_command(update, 'w')
         logger.info("Retrieved information about active users")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving information about active users", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_auths(update, context):
+@limits.limited('ssh')
+@fleet.multi_host('last -n 10')
+async def get_auths(update, context):
     try:
-        client = connect_ssh()
-        auths = execute_ssh_command(client, 'last -n 10')
-        update.message.reply_text(auths)
+        await stream_ssh_command(update, 'last -n 10')
         logger.info("Retrieved information about recent logins")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving information about recent logins", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_critical(update, context):
+@limits.limited('ssh')
+@fleet.multi_host('tail -n 5 /var/log/syslog')
+async def get_critical(update, context):
     try:
-        client = connect_ssh()
-        critical = execute_ssh_command(client, 'tail -n 5 /var/log/syslog')
-        update.message.reply_text(critical)
+        await stream_ssh_command(update, 'tail -n 5 /var/log/syslog')
         logger.info("Retrieved information about recent critical events")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving information about recent critical events", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_ps(update, context):
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.PS)
+async def get_ps(update, context):
     try:
-        client = connect_ssh()
-        ps = execute_ssh_command(client, 'ps aux')
-        # Split the response into chunks
-        chunk_size = 4096  # Adjust the chunk size as needed
-        chunks = [ps[i:i+chunk_size] for i in range(0, len(ps), chunk_size)]
-
-        # Send each chunk as a separate message
-        for chunk in chunks:
-            update.message.reply_text(chunk)
+        ps = await execute_view(sysinfo.PS, context.args)
+        await delivery.send_text(update, ps, 'ps.txt')
         logger.info("Retrieved information about running processes")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving information about running processes", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_ss(update, context):
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.SS)
+async def get_ss(update, context):
     try:
-        client = connect_ssh()
-        ss = execute_ssh_command(client, 'ss -tuln')
-        update.message.reply_text(ss)
+        ss = await execute_view(sysinfo.SS, context.args)
+        await delivery.send_text(update, ss)
         logger.info("Retrieved information about used ports")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving information about used ports", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_apt_list(update, context):
+# Пробы для /get_status: выполняются параллельно, общее время - как у самой медленной
+STATUS_PROBES = {
+    'uptime': 'uptime',
+    'free': 'free -h',
+    'df': 'df -h',
+    'mpstat': 'mpstat',
+    'ss': 'ss -tuln',
+}
+
+@limits.limited('ssh')
+async def get_status(update, context):
     try:
-        client = connect_ssh()
-        if context.args:
-            package_name = ' '.join(context.args)
-            apt_list = execute_ssh_command(client, f'apt show {package_name}')
-        else:
-            apt_list = execute_ssh_command(client, 'apt list --installed')
-
-        # Split the response into chunks
-        chunk_size = 4096  # Adjust the chunk size as needed
-        chunks = [apt_list[i:i+chunk_size] for i in range(0, len(apt_list), chunk_size)]
-
-        # Send each chunk as a separate message
-        for chunk in chunks:
-            update.message.reply_text(chunk)
-        
-        logger.info("Retrieved information about installed packages")
+        session = ssh_client.get_session(HOST, SSH_PORT, SSH_USER, SSH_PASSWORD)
+        results = await ssh_client.exec_parallel(session, STATUS_PROBES, timeout=30)
+        sections = []
+        for name, result in results.items():
+            if isinstance(result, Exception):
+                output = f"error: {str(result)}"
+                logger.error(f"Status probe {name} failed: {str(result)}")
+            else:
+                output = result[0].decode().strip()
+            sections.append(f"[{name}]\n{output}")
+        status = '\n\n'.join(sections)
+
+        await delivery.send_text(update, status, 'status.txt')
+        logger.info("Retrieved host status")
+    except Exception as e:
+        await update.message.reply_text(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while retrieving host status", exc_info=True)
+
+# Каталог пакетов хоста в памяти: /get_apt_list ищет по нему, к хосту - только проверка, не изменилась ли база dpkg
+PACKAGES = packages.Catalog(HOST, SSH_PORT, SSH_USER, SSH_PASSWORD)
+
+@limits.limited('ssh')
+async def get_apt_list(update, context):
+    # /get_apt_list - все установленные пакеты, /get_apt_list <запрос> - поиск по имени
+    # (точное совпадение, префикс, подстрока), по страницам
+    query = packages.parse_query(context.args)
+    if query is None:
+        await update.message.reply_text(f"Слишком длинный запрос, не больше {packages.MAX_QUERY_BYTES} байт")
+        return
+    try:
+        await PACKAGES.refresh()
+        package = PACKAGES.packages.get(query)
+        if package is not None:
+            await delivery.send_text(update, packages.describe(package))
+            if len(PACKAGES.search(query)) == 1:
+                return
+        text, markup = packages.render_page(PACKAGES, query)
+        await update.message.reply_text(text, reply_markup=markup)
+        logger.info(f"Searched installed packages for {query!r}")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving information about installed packages", exc_info=True)
-    finally:
-        if client:
-            client.close()
 
-def get_services(update, context):
+async def package_page_callback(update, context):
+    query = update.callback_query
+    _, offset, search = query.data.split(':', 2)
     try:
-        client = connect_ssh()
-        services = execute_ssh_command(client, 'service --status-all')
-        update.message.reply_text(services)
+        # Листание идет по каталогу в памяти, без обращения к хосту
+        text, markup = packages.render_page(PACKAGES, search, int(offset))
+        await query.answer()
+        await query.edit_message_text(text, reply_markup=markup)
+    except Exception as e:
+        await query.answer(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while paging packages", exc_info=True)
+
+@limits.limited('ssh')
+@fleet.multi_host('service --status-all')
+async def get_services(update, context):
+    try:
+        services = await execute_cached_ssh_command('service --status-all')
+        await delivery.send_text(update, services)
         logger.info("Retrieved information about running services")
     except Exception as e:
-        update.message.reply_text(f"An error occurred: {str(e)}")
+        await update.message.reply_text(f"An error occurred: {str(e)}")
         logger.error("Error occurred while retrieving information about running services", exc_info=True)
-    finally:
-        if client:
-            client.close()
-
 
 
-def echo(update: Update, context):
-    update.message.reply_text(f"Unknown command {update.message.text} !\n\nTry /help")
 
+@limits.limited('db')
+async def get_history(update, context):
+    # /history free 6h - min/avg/max за период по данным фонового опроса, без обращения к хосту
+    if not context.args or context.args[0] not in sampler.GROUPS or len(context.args) > 2:
+        await update.message.reply_text(f"Использование: /history <{'|'.join(sampler.GROUPS)}> [период, например 6h]")
+        return
+    group = context.args[0]
+    window = context.args[1] if len(context.args) > 1 else '1h'
+    try:
+        seconds = sampler.parse_window(window)
+    except ValueError as e:
+        await update.message.reply_text(f"Ошибка: {str(e)}")
+        return
+    try:
+        totals = await SAMPLER.history(group, seconds)
+        await delivery.send_text(update, sampler.format_history(group, window, totals), 'history.txt')
+        logger.info(f"Retrieved {group} history for {window}")
+    except Exception as e:
+        await update.message.reply_text(f"An error occurred: {str(e)}")
+        logger.error("Error occurred while retrieving metrics history", exc_info=True)
+
+
+async def get_stats(update, context):
+    lines = ['SSH:']
+    for host, stats in ssh_client.get_stats().items():
+        lines.append(f"{host}: reused={stats['reused']}, connects={stats['connects']}, "
+                     f"reconnects={stats['reconnects']}, commands={stats['commands']}, errors={stats['errors']}, "
+                     f"truncated={stats['truncated']}, timeouts={stats['timeouts']}")
+    lines.append('PostgreSQL:')
+    for database, stats in postgres.get_stats().items():
+        lines.append(f"{database}: in_use={stats['in_use']}/{stats['max']}, idle={stats['idle']}, "
+                     f"max_in_use={stats['max_in_use']}, checkouts={stats['checkouts']}, waits={stats['waits']}, "
+                     f"timeouts={stats['timeouts']}, created={stats['created']}, recycled={stats['recycled']}, "
+                     f"broken={stats['broken']}")
+    lines.append('Replication routing:')
+    for route, stats in postgres.get_router_stats().items():
+        lag = f"{stats['lag']:.1f}s" if stats['lag'] is not None else 'unknown'
+        lines.append(f"{route}: replica_ok={stats['replica_ok']}, lag={lag}/{stats['max_lag']:g}s, "
+                     f"replica_reads={stats['replica_reads']}, primary_reads={stats['primary_reads']}, "
+                     f"fallbacks={stats['fallbacks']}, check_errors={stats['check_errors']}")
+    stats = cache.ssh_cache.get_stats()
+    lines.append(f"Cache: size={stats['size']}/{stats['max']}, hits={stats['hits']}, misses={stats['misses']}, "
+                 f"expired={stats['expired']}, evictions={stats['evictions']}, coalesced={stats['coalesced']}")
+    lines.append(f"Replication events: {len(REPL_EVENTS)}/{REPL_EVENTS.capacity}")
+    lines.append('Limits:')
+    for backend, stats in limits.get_stats().items():
+        lines.append(f"{backend}: active={stats['active']}/{stats['limit']}, waiting={stats['waiting']}/{stats['queue_size']}, "
+                     f"max_waiting={stats['max_waiting']}, queued={stats['queued']}, rejected={stats['rejected']}, "
+                     f"wait_avg={stats['wait_avg']:.3f}s, wait_max={stats['wait_max']:.3f}s")
+    stats = SAMPLER.get_stats()
+    lines.append(f"Sampler: samples={stats['samples']}, errors={stats['errors']}, "
+                 f"buffered={stats['buffered']}/{stats['capacity']}, series={stats['series']}, "
+                 f"rollups={stats['rollups']}, flush_errors={stats['flush_errors']}")
+    stats = logsetup.get_stats()
+    lines.append(f"Logging: queued={stats['queued']}/{stats['max']}, dropped={stats['dropped']}, "
+                 f"sampled_out={stats['sampled_out']}")
+    stats = state.get_stats(context.application)
+    lines.append(f"State ({stats['backend']}): users={stats['users']}/{stats['max_users']}, "
+                 f"user_data={stats['user_data']}, conversations={stats['conversations']}, "
+                 f"evicted_idle={stats['evicted_idle']}, evicted_lru={stats['evicted_lru']}, trimmed={stats['trimmed']}, "
+                 f"writes={stats['writes']}, deletes={stats['deletes']}, write_errors={stats['write_errors']}")
+    stats = PACKAGES.get_stats()
+    lines.append(f"Packages: {stats['packages']}, mtime={stats['mtime']}, checks={stats['checks']}, "
+                 f"refreshes={stats['refreshes']}, errors={stats['errors']}, parse_time={stats['parse_time']:.3f}s")
+    stats = delivery.get_stats()
+    lines.append(f"Delivery: messages={stats['messages']}, documents={stats['documents']}, streamed={stats['streamed']}, "
+                 f"retries={stats['retries']}, waits={stats['waits']}, wait_avg={stats['wait_avg']:.3f}s, chats={stats['chats']}")
+    if webhook.enabled():
+        stats = webhook.get_stats()
+        lines.append(f"Webhook: received={stats['received']}, "
+                     f"queued={context.application.update_queue.qsize()}/{webhook.WEBHOOK_QUEUE}, "
+                     f"rejected_full={stats['rejected_full']}, rejected_secret={stats['rejected_secret']}, "
+                     f"bad_requests={stats['bad_requests']}")
+    await update.message.reply_text('\n'.join(lines))
+    logger.info("Retrieved bot statistics")
+
+
+async def get_hosts(update, context):
+    await delivery.send_text(update, fleet.describe_inventory())
+    logger.info("Listed inventory hosts")
+
+
+async def refresh(update, context):
+    # /refresh - сбросить весь кэш, /refresh <команда> - только записи для команд с этим префиксом
+    prefix = ' '.join(context.args)
+    count = cache.ssh_cache.invalidate(lambda key: key[1].startswith(prefix))
+    await update.message.reply_text(f"Сброшено записей кэша: {count}")
+
+
+async def echo(update: Update, context):
+    await update.message.reply_text(f"Unknown command {update.message.text} !\n\nTry /help")
+
+
+async def on_startup(application):
+    try:
+        await get_db_pool().prefill()
+    except Exception as e:
+        logger.warning(f"Could not prefill database pool: {str(e)}")
+    application.bot_data['repl_watcher'] = asyncio.create_task(REPL_WATCHER.run())
+    application.bot_data['metrics_server'] = await metrics.start_server()
+    if SAMPLER.enabled():
+        application.bot_data['sampler'] = asyncio.create_task(SAMPLER.run())
+    application.bot_data['state_sweeper'] = asyncio.create_task(state.run(application))
+    application.bot_data['packages'] = asyncio.create_task(PACKAGES.preload())
+
+async def on_shutdown(application):
+    for name in ('repl_watcher', 'sampler', 'state_sweeper', 'packages'):
+        task = application.bot_data.get(name)
+        if task is not None:
+            task.cancel()
+    server = application.bot_data.get('metrics_server')
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    ssh_client.close_all()
+    await postgres.close_all()
 
 def main():
-    updater = Updater(TOKEN, use_context=True)
-    dp = updater.dispatcher
-
+    builder = Application.builder().token(TOKEN).post_init(on_startup).post_shutdown(on_shutdown)
+    # Запросы к Bot API замеряются для метрик (фаза telegram_send)
+    builder = builder.request(metrics.TimedRequest(connection_pool_size=256))
+    if TELEGRAM_API_URL:
+        # Собственный Bot API сервер в режиме --local: файлы до 2 ГБ вместо 20 МБ
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot").local_mode(True)
+    # WEBHOOK_URL включает прием обновлений через webhook вместо long polling
+    builder = webhook.configure(builder)
+    # user_data и незавершенные диалоги: ограниченное хранилище в памяти, SQLite или PostgreSQL (STATE_BACKEND)
+    builder = state.configure(builder, 'bot', get_db_pool)
+    application = builder.build()
     logger.info("STARTING PROGRAM")
+
     # Обработка диалога email
     convHandlerFindEmails = ConversationHandler(
     entry_points=[CommandHandler('find_email', findEmailsCommand)],
     states={
-        'findEmails': [MessageHandler(Filters.text & ~Filters.command, findEmails)],
-        'confirm_email_save': [MessageHandler(Filters.text & ~Filters.command, confirm_email_save)],
+        'findEmails': [MessageHandler(filters.TEXT & ~filters.COMMAND, findEmails),
+                       MessageHandler(filters.Document.ALL, findEmailsDocument)],
+        'confirm_email_save': [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_email_save)],
     },
-    fallbacks=[]
+    fallbacks=[],
+    name='find_email',
+    persistent=True
     )
 
     # Обработка диалога phone numbers
     convHandlerFindPhoneNumbers = ConversationHandler(
         entry_points=[CommandHandler('find_phone_number', findPhoneNumbersCommand)],
         states={
-            'findPhoneNumbers': [MessageHandler(Filters.text & ~Filters.command, findPhoneNumbers)],
-            'confirm_phone_save': [MessageHandler(Filters.text & ~Filters.command, confirm_phone_save)],
+            'findPhoneNumbers': [MessageHandler(filters.TEXT & ~filters.COMMAND, findPhoneNumbers),
+                                 MessageHandler(filters.Document.ALL, findPhoneNumbersDocument)],
+            'confirm_phone_save': [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_phone_save)],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name='find_phone_number',
+        persistent=True
     )
 
     # Обработка диалога password
     convHandlerVerifyPassword = ConversationHandler(
     entry_points=[CommandHandler('verify_password', verifyPasswordCommand)],
     states={
-        'verifyPassword': [MessageHandler(Filters.text & ~Filters.command, verifyPassword)],
+        'verifyPassword': [MessageHandler(filters.TEXT & ~filters.COMMAND, verifyPassword)],
     },
-    fallbacks=[]
+    fallbacks=[],
+    name='verify_password',
+    persistent=True
     )
 
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("help", helpCommand))
-    dp.add_handler(convHandlerFindEmails)
-    dp.add_handler(convHandlerVerifyPassword)
-    dp.add_handler(convHandlerFindPhoneNumbers)
-    dp.add_handler(CommandHandler("get_repl_logs", get_repl_logs))
-    dp.add_handler(CommandHandler("get_emails", get_emails))
-    dp.add_handler(CommandHandler("get_phone_numbers", get_phone_numbers))
-
-    dp.add_handler(CommandHandler("get_release", get_release))
-    dp.add_handler(CommandHandler("get_uname", get_uname))
-    dp.add_handler(CommandHandler("get_uptime", get_uptime))
-    dp.add_handler(CommandHandler("get_df", get_df))
-    dp.add_handler(CommandHandler("get_free", get_free))
-    dp.add_handler(CommandHandler("get_mpstat", get_mpstat))
-    dp.add_handler(CommandHandler("get_w", get_w))
-    dp.add_handler(CommandHandler("get_auths", get_auths))
-    dp.add_handler(CommandHandler("get_critical", get_critical))
-    dp.add_handler(CommandHandler("get_ps", get_ps))
-    dp.add_handler(CommandHandler("get_ss", get_ss))
-    dp.add_handler(CommandHandler("get_apt_list", get_apt_list))
-    dp.add_handler(CommandHandler("get_services", get_services))
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", helpCommand))
+    application.add_handler(convHandlerFindEmails)
+    application.add_handler(convHandlerVerifyPassword)
+    application.add_handler(convHandlerFindPhoneNumbers)
+    # Команды, которые ходят по SSH или в БД, выполняются фоновыми задачами (block=False)
+    # и не задерживают обработку сообщений других пользователей
+    application.add_handler(CommandHandler("get_repl_logs", get_repl_logs, block=False))
+    application.add_handler(CommandHandler("get_emails", get_emails, block=False))
+    application.add_handler(CommandHandler("get_phone_numbers", get_phone_numbers, block=False))
+    application.add_handler(CommandHandler("lookup", lookup, block=False))
+    application.add_handler(CallbackQueryHandler(table_page_callback, pattern=r'^(emails|phones):(prev|next):\d+$', block=False))
+    application.add_handler(CallbackQueryHandler(package_page_callback, pattern=r'^packages:\d+:'))
+
+    application.add_handler(CommandHandler("get_release", get_release, block=False))
+    application.add_handler(CommandHandler("get_uname", get_uname, block=False))
+    application.add_handler(CommandHandler("get_uptime", get_uptime, block=False))
+    application.add_handler(CommandHandler("get_df", get_df, block=False))
+    application.add_handler(CommandHandler("get_free", get_free, block=False))
+    application.add_handler(CommandHandler("get_mpstat", get_mpstat, block=False))
+    application.add_handler(CommandHandler("get_w", get_w, block=False))
+    application.add_handler(CommandHandler("get_status", get_status, block=False))
+    application.add_handler(CommandHandler("get_auths", get_auths, block=False))
+    application.add_handler(CommandHandler("get_critical", get_critical, block=False))
+    application.add_handler(CommandHandler("get_ps", get_ps, block=False))
+    application.add_handler(CommandHandler("get_ss", get_ss, block=False))
+    application.add_handler(CommandHandler("get_apt_list", get_apt_list, block=False))
+    application.add_handler(CommandHandler("get_services", get_services, block=False))
+    application.add_handler(CommandHandler("refresh", refresh))
+    application.add_handler(CommandHandler("stats", get_stats))
+    application.add_handler(CommandHandler("hosts", get_hosts))
+    application.add_handler(CommandHandler("history", get_history, block=False))
 
     # Регистрируем обработчик текстовых сообщений
-    dp.add_handler(MessageHandler(Filters.text & ~Filters.command, echo))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
+
+    # Счетчики, задержки и число выполняющихся вызовов для всех обработчиков выше
+    metrics.instrument(application)
+    state.install(application)
 
-    updater.start_polling()
-    updater.idle()
+    webhook.run(application)
 
 if __name__ == '__main__':
     main()
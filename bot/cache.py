@@ -0,0 +1,118 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+SSH_CACHE_SIZE = int(os.getenv('SSH_CACHE_SIZE', '256'))
+
+# Время жизни результата (в секундах) по префиксу команды. Команды, которых здесь нет, не кэшируются
+COMMAND_TTLS = {
+    'lsb_release': 3600,
+    'cat /proc/version': 3600,
+    'uname': 3600,
+    'apt list --installed': 600,
+    'apt show': 600,
+    'dpkg -l': 600,
+    'dpkg -s': 600,
+    'service --status-all': 60,
+    'systemctl list-units': 60,
+}
+
+
+def ttl_for(command):
+    # Самый длинный подходящий префикс, чтобы 'apt show' не перекрывался более общими записями
+    matches = [prefix for prefix in COMMAND_TTLS if command.startswith(prefix)]
+    if not matches:
+        return 0
+    return COMMAND_TTLS[max(matches, key=len)]
+
+
+class TTLCache:
+    # LRU-кэш с ограничением размера и временем жизни для каждой записи
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (value, stored_at, ttl)
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> задача загрузки, которую ждут все одновременные промахи
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'coalesced': 0}
+
+    def get(self, key):
+        # Возвращает (value, age) или None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            value, stored_at, ttl = entry
+            age = time.monotonic() - stored_at
+            if age > ttl:
+                del self._data[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return value, age
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic(), ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    async def get_or_load(self, key, loader, ttl):
+        # loader - корутинная функция. Возвращает (value, age); age равен None, если значение только что получено.
+        # Одновременные промахи по одному ключу ждут одну загрузку, а не вызывают loader каждый
+        if ttl <= 0:
+            return await loader(), None
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = asyncio.ensure_future(self._load(key, loader, ttl))
+            # Ошибка загрузки, которую никто не дождался (все ожидающие отменены), не пишется в лог как потерянная
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        else:
+            self.stats['coalesced'] += 1
+        # Отмена одного ожидающего не прерывает загрузку для остальных
+        return await asyncio.shield(task), None
+
+    async def _load(self, key, loader, ttl):
+        try:
+            value = await loader()
+            self.set(key, value, ttl)
+            return value
+        finally:
+            self._loading.pop(key, None)
+
+    def invalidate(self, predicate=None):
+        with self._lock:
+            keys = [key for key in self._data if predicate is None or predicate(key)]
+            for key in keys:
+                del self._data[key]
+        logger.info(f"Invalidated {len(keys)} cache entries")
+        return len(keys)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update(size=len(self._data), max=self.maxsize)
+            return stats
+
+
+# Результаты удаленных команд, ключ - (host, command)
+ssh_cache = TTLCache(SSH_CACHE_SIZE)
+
+
+def format_age(text, age):
+    if age is None:
+        return text
+    return f"{text.rstrip()}\n\n(из кэша, получено {int(age)} с назад, обновить: /refresh)"
@@ -0,0 +1,194 @@
+import io
+import os
+import gzip
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from telegram.error import RetryAfter
+
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+# Вывод длиннее этого числа символов отправляется одним файлом, а не пачкой сообщений
+DELIVERY_FILE_THRESHOLD = int(os.getenv('DELIVERY_FILE_THRESHOLD', str(4 * MESSAGE_LIMIT)))
+# Файл больше этого размера (в байтах) сжимается gzip
+DELIVERY_GZIP_THRESHOLD = int(os.getenv('DELIVERY_GZIP_THRESHOLD', str(1024 * 1024)))
+# Ограничения Telegram: около 1 сообщения в секунду в личный чат, 20 в минуту в группу и 30 в секунду на бота
+DELIVERY_CHAT_RATE = float(os.getenv('DELIVERY_CHAT_RATE', '1'))
+DELIVERY_CHAT_BURST = int(os.getenv('DELIVERY_CHAT_BURST', '3'))
+DELIVERY_GROUP_RATE = float(os.getenv('DELIVERY_GROUP_RATE', str(20 / 60)))
+DELIVERY_GLOBAL_RATE = float(os.getenv('DELIVERY_GLOBAL_RATE', '30'))
+# Сколько раз повторять отправку после ответа 429 Too Many Requests
+DELIVERY_RETRIES = int(os.getenv('DELIVERY_RETRIES', '3'))
+DELIVERY_MAX_CHATS = int(os.getenv('DELIVERY_MAX_CHATS', '10000'))
+# Вывод долгой команды начинает уходить сообщениями, только если она выполняется дольше DELIVERY_STREAM_DELAY
+# секунд; вывод быстрых команд отправляется целиком, как через send_text
+DELIVERY_STREAM_DELAY = float(os.getenv('DELIVERY_STREAM_DELAY', '2'))
+
+
+class TokenBucket:
+    # rate токенов в секунду, не больше capacity в запасе. Токены резервируются сразу и могут уйти в минус:
+    # отправка ждет, пока ее токен не восстановится, поэтому одновременные отправки встают в очередь по порядку
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        # Возвращает, сколько секунд ждать до отправки
+        self._refill()
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rate)
+
+    def pause(self, seconds):
+        # После 429: следующая отправка - не раньше чем через seconds секунд
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+
+_global = TokenBucket(DELIVERY_GLOBAL_RATE, DELIVERY_GLOBAL_RATE)
+_chats = OrderedDict()  # chat_id -> TokenBucket, давно не писавшие чаты вытесняются
+stats = {'messages': 0, 'documents': 0, 'streamed': 0, 'retries': 0, 'waits': 0, 'wait_total': 0.0}
+
+
+def _chat_bucket(chat_id):
+    bucket = _chats.get(chat_id)
+    if bucket is None:
+        # У групп и каналов id отрицательный
+        if chat_id < 0:
+            bucket = TokenBucket(DELIVERY_GROUP_RATE, DELIVERY_CHAT_BURST)
+        else:
+            bucket = TokenBucket(DELIVERY_CHAT_RATE, DELIVERY_CHAT_BURST)
+        _chats[chat_id] = bucket
+        if len(_chats) > DELIVERY_MAX_CHATS:
+            _chats.popitem(last=False)
+    else:
+        _chats.move_to_end(chat_id)
+    return bucket
+
+
+async def _acquire(chat_id):
+    # Сначала очередь чата, потом общая: пока ждем свой чат, общие токены не занимаем
+    for bucket in (_chat_bucket(chat_id), _global):
+        delay = bucket.reserve()
+        if delay:
+            stats['waits'] += 1
+            stats['wait_total'] += delay
+            await asyncio.sleep(delay)
+
+
+async def _send(chat_id, send):
+    # send - функция без аргументов, возвращающая корутину отправки
+    for attempt in range(DELIVERY_RETRIES + 1):
+        await _acquire(chat_id)
+        try:
+            return await send()
+        except RetryAfter as e:
+            if attempt == DELIVERY_RETRIES:
+                raise
+            stats['retries'] += 1
+            logger.warning(f"Flood control for chat {chat_id}, retrying in {e.retry_after}s")
+            _chat_bucket(chat_id).pause(e.retry_after)
+
+
+def split_text(text, limit=MESSAGE_LIMIT):
+    # Режем по границам строк; строка длиннее limit режется на части
+    chunks = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        if len(current) + len(line) > limit:
+            if current.strip():
+                chunks.append(current.rstrip('\n'))
+            current = ''
+            while len(line) > limit:
+                chunks.append(line[:limit])
+                line = line[limit:]
+        current += line
+    if current.strip():
+        chunks.append(current.rstrip('\n'))
+    return chunks
+
+
+async def _send_document(update, text, filename, caption="Вывод слишком длинный для сообщений и отправлен файлом"):
+    data = text.encode('utf-8')
+    caption = f"{caption} (строк: {len(text.splitlines())})"
+    if len(data) > DELIVERY_GZIP_THRESHOLD:
+        data = await asyncio.to_thread(gzip.compress, data)
+        filename += '.gz'
+    message = update.effective_message
+    await _send(update.effective_chat.id,
+                lambda: message.reply_document(io.BytesIO(data), filename=filename, caption=caption))
+    stats['documents'] += 1
+
+
+async def send_text(update, text, filename='output.txt'):
+    # Ответ произвольной длины: сообщениями не длиннее MESSAGE_LIMIT с соблюдением лимитов Telegram
+    # или одним файлом, если сообщений получилось бы слишком много
+    if not text.strip():
+        text = 'Пустой вывод'
+    if len(text) > DELIVERY_FILE_THRESHOLD:
+        await _send_document(update, text, filename)
+        return
+    await _send_messages(update, text)
+
+
+async def _send_messages(update, text):
+    message = update.effective_message
+    for chunk in split_text(text):
+        await _send(update.effective_chat.id, lambda: message.reply_text(chunk))
+        stats['messages'] += 1
+
+
+class Stream:
+    # Ответ, который пишется частями по мере поступления вывода. Готовые строки уходят сообщениями
+    # не чаще раза в DELIVERY_STREAM_DELAY секунд или сразу, как набралось на целое сообщение, пока всего
+    # отправлено не больше DELIVERY_FILE_THRESHOLD символов. Все, что не ушло, отправляет close()
+    def __init__(self, update, filename='output.txt'):
+        self.update = update
+        self.filename = filename
+        self._pending = ''
+        self._sent = 0  # символов, отправленных сообщениями
+        self._flushed = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def write(self, text):
+        async with self._lock:
+            self._pending += text
+            if time.monotonic() - self._flushed < DELIVERY_STREAM_DELAY and (
+                    not self._sent or len(self._pending) < MESSAGE_LIMIT):
+                return
+            end = self._pending.rfind('\n') + 1
+            # Не поместившийся вывод копится дальше и уйдет файлом
+            if not end or self._sent + end > DELIVERY_FILE_THRESHOLD:
+                return
+            ready, self._pending = self._pending[:end], self._pending[end:]
+            if not self._sent:
+                stats['streamed'] += 1
+            await _send_messages(self.update, ready)
+            self._sent += len(ready)
+            self._flushed = time.monotonic()
+
+    async def close(self):
+        async with self._lock:
+            text, self._pending = self._pending, ''
+            if not self._sent:
+                await send_text(self.update, text, self.filename)
+            elif len(text) > DELIVERY_FILE_THRESHOLD:
+                await _send_document(self.update, text, self.filename, "Продолжение вывода отправлено файлом")
+            elif text.strip():
+                await _send_messages(self.update, text)
+
+
+def get_stats():
+    result = dict(stats)
+    result['chats'] = len(_chats)
+    result['wait_avg'] = result['wait_total'] / result['waits'] if result['waits'] else 0.0
+    return result
@@ -0,0 +1,116 @@
+import io
+import os
+import time
+import codecs
+import asyncio
+import logging
+import httpx
+import state
+import extract
+
+
+logger = logging.getLogger(__name__)
+
+DOC_CHUNK = int(os.getenv('DOC_CHUNK', str(1024 * 1024)))
+DOC_MAX_BYTES = int(os.getenv('DOC_MAX_BYTES', str(512 * 1024 * 1024)))
+DOC_MAX_SECONDS = float(os.getenv('DOC_MAX_SECONDS', '300'))
+# Сколько уникальных значений хранится; дальше считаются только совпадения
+DOC_MAX_RESULTS = int(os.getenv('DOC_MAX_RESULTS', str(state.STATE_MAX_ITEMS)))
+# Найденные значения ждут подтверждения в user_data, а там на пользователя не больше STATE_MAX_ITEMS элементов:
+# больший список вытеснил бы остальные данные пользователя и целиком писался бы в хранилище
+if DOC_MAX_RESULTS > state.STATE_MAX_ITEMS:
+    logger.warning(f"DOC_MAX_RESULTS={DOC_MAX_RESULTS} exceeds STATE_MAX_ITEMS, using {state.STATE_MAX_ITEMS}")
+    DOC_MAX_RESULTS = state.STATE_MAX_ITEMS
+DOC_DOWNLOAD_TIMEOUT = float(os.getenv('DOC_DOWNLOAD_TIMEOUT', '60'))
+
+
+class DocumentScan:
+    __slots__ = ('results', 'total', 'size', 'elapsed', 'reason')
+
+    def __init__(self, results, total, size, elapsed, reason):
+        self.results = results  # уникальные значения в порядке первого появления
+        self.total = total  # всего совпадений, с повторами
+        self.size = size  # сколько байт файла просмотрено
+        self.elapsed = elapsed
+        self.reason = reason  # None, 'size', 'time' или 'results'
+
+
+async def _read_chunks(file):
+    # Файл читается кусками: с диска, если Bot API сервер запущен локально (file_path - путь),
+    # иначе потоком по HTTP, не загружая его в память целиком
+    if os.path.isfile(file.file_path):
+        with open(file.file_path, 'rb') as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, DOC_CHUNK)
+                if not chunk:
+                    return
+                yield chunk
+    else:
+        async with httpx.AsyncClient(timeout=DOC_DOWNLOAD_TIMEOUT) as client:
+            async with client.stream('GET', file.file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(DOC_CHUNK):
+                    yield chunk
+
+
+async def scan_document(file, extractor):
+    # file - telegram.File. Текст декодируется и просматривается по мере чтения,
+    # повторы отбрасываются сразу, поэтому память не зависит от размера файла
+    started = time.monotonic()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    scanner = extract.StreamScanner(extractor)
+    seen = set()
+    results = []
+    total = 0
+    size = 0
+    reason = None
+
+    def consume(matches):
+        nonlocal total, reason
+        total += len(matches)
+        for value in matches:
+            if value in seen:
+                continue
+            if len(results) >= DOC_MAX_RESULTS:
+                reason = 'results'
+                continue
+            seen.add(value)
+            results.append(value)
+
+    chunks = _read_chunks(file)
+    try:
+        async for chunk in chunks:
+            if size + len(chunk) > DOC_MAX_BYTES:
+                chunk = chunk[:DOC_MAX_BYTES - size]
+                reason = 'size'
+            size += len(chunk)
+            # Поиск занимает процессор - выполняем его вне цикла событий
+            consume(await asyncio.to_thread(scanner.feed, decoder.decode(chunk)))
+            if reason == 'size':
+                break
+            if time.monotonic() - started > DOC_MAX_SECONDS:
+                reason = 'time'
+                break
+    finally:
+        await chunks.aclose()
+    consume(scanner.feed(decoder.decode(b'', final=True)) + scanner.finish())
+    elapsed = time.monotonic() - started
+    logger.info(f"Scanned {size} bytes in {elapsed:.3f}s: {total} matches, {len(results)} unique")
+    return DocumentScan(results, total, size, elapsed, reason)
+
+
+def describe(scan):
+    text = (f"Просмотрено {scan.size / 1024 / 1024:.1f} МБ за {scan.elapsed:.1f} с, "
+            f"совпадений: {scan.total}, уникальных: {len(scan.results)}")
+    if scan.reason == 'size':
+        text += f"\nФайл больше {DOC_MAX_BYTES // 1024 // 1024} МБ, просмотрено только начало"
+    elif scan.reason == 'time':
+        text += "\nПоиск остановлен по времени, просмотрено только начало файла"
+    elif scan.reason == 'results':
+        text += f"\nСохранены только первые {DOC_MAX_RESULTS} уникальных значений"
+    return text
+
+
+def results_file(lines):
+    # Полный список результатов отправляется файлом, а не сообщениями
+    return io.BytesIO(('\n'.join(lines) + '\n').encode('utf-8'))
@@ -0,0 +1,235 @@
+import os
+import re
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Бюджет одного поиска: сколько символов текста просматривается и сколько секунд на это отводится
+EXTRACT_MAX_CHARS = int(os.getenv('EXTRACT_MAX_CHARS', str(10 * 1024 * 1024)))
+EXTRACT_MAX_SECONDS = float(os.getenv('EXTRACT_MAX_SECONDS', '2'))
+# Текст просматривается блоками, между блоками проверяется время
+EXTRACT_BLOCK = int(os.getenv('EXTRACT_BLOCK', '65536'))
+
+# Ограничения длины из RFC 5321: локальная часть до 64 символов, домен до 255
+EMAIL_LOCAL_MAX = 64
+EMAIL_DOMAIN_MAX = 255
+# Самый длинный номер вида "+7 (999) 123-45-67" с запасом на соседние символы для \b
+PHONE_MAX = 24
+# Необходимое условие для обоих выражений email: после '@' в пределах домена есть точка и две буквы
+EMAIL_CANDIDATE = r'@(?=[A-Za-z0-9.-]{0,%d}\.[A-Z|a-z]{2})' % (EMAIL_DOMAIN_MAX - 2)
+
+
+class ScanResult:
+    __slots__ = ('matches', 'reason', 'scanned', 'elapsed')
+
+    def __init__(self, matches, reason, scanned, elapsed):
+        self.matches = matches
+        self.reason = reason  # None, 'size' или 'time' - почему поиск остановлен раньше конца текста
+        self.scanned = scanned  # сколько символов просмотрено
+        self.elapsed = elapsed
+
+    @property
+    def truncated(self):
+        return self.reason is not None
+
+
+class Extractor:
+    # Поиск по заранее скомпилированному выражению с гарантией линейного времени.
+    # Встроенный re работает с откатами, поэтому выражение никогда не применяется ко всему тексту:
+    # - с anchor (например '@') выражение запускается только в окне [anchor - before, anchor + after]
+    #   вокруг каждого вхождения якоря, найденного str.find. Окно дополнительно сужается до ближайших
+    #   символов из barrier - они не могут входить в совпадение (кроме самого якоря);
+    # - без якоря текст просматривается блоками, совпадение длиннее after не ищется.
+    # Работа на одно окно ограничена его размером, поэтому общее время растет линейно с длиной текста.
+    # token_start - совпадение может начинаться только сразу после символа из barrier или в начале текста
+    # (как (?<!\S) в выражении max_bot.py): якоря дальше before от начала такого токена пропускаются целиком.
+    # candidate - выражение, которое должно совпасть с якоря и заглядывает не дальше after символов:
+    # якоря, после которых совпадения заведомо нет, пропускаются внутри re, а не по одному в цикле Python
+    def __init__(self, pattern, after, anchor=None, before=0, barrier='', token_start=False, candidate=None):
+        self.regex = re.compile(pattern)
+        self.anchor = anchor
+        self.candidate = re.compile(candidate) if candidate else None
+        self.before = before
+        self.after = after
+        self.barrier = barrier
+        self.token_start = token_start
+        if barrier:
+            # Одно обращение к re вместо find/rfind по каждому символу: последний барьер слева - жадным .*
+            self._last_barrier = re.compile('.*[' + re.escape(barrier) + ']', re.S)
+            self._first_barrier = re.compile('[' + re.escape(barrier) + ']')
+
+    def _value(self, match):
+        # Та же форма результата, что у re.findall
+        if self.regex.groups == 0:
+            return match.group(0)
+        if self.regex.groups == 1:
+            return match.group(1)
+        return match.groups()
+
+    def _window(self, text, at, low, end):
+        # Возвращает (left, right) для поиска вокруг якоря или None, если совпадения здесь быть не может
+        reach = max(0, at - self.before)
+        right = min(end, at + self.after)
+        if not self.barrier:
+            return max(low, reach), right
+        barrier = self._last_barrier.match(text, reach, at)
+        left = barrier.end() if barrier else reach
+        if self.token_start and barrier is None and reach > 0 and text[reach - 1] not in self.barrier:
+            return None
+        if left < low:
+            if self.token_start:
+                return None
+            left = low
+        barrier = self._first_barrier.search(text, at + 1, right)
+        return left, barrier.start() if barrier else right
+
+    def _next_barrier(self, text, at, stop):
+        # Начало следующего токена - первый символ из barrier после at
+        barrier = self._first_barrier.search(text, at, stop)
+        return barrier.start() if barrier else stop
+
+    def _find_anchor(self, text, pos, stop, end):
+        if self.candidate is None:
+            return text.find(self.anchor, pos, stop)
+        # Заглядывание вперед не дальше after, поэтому хватает текста до stop + after
+        match = self.candidate.search(text, pos, min(end, stop + self.after))
+        return match.start() if match is not None and match.start() < stop else -1
+
+    def _scan_anchored(self, text, start, stop, end, last_end, matches):
+        at = self._find_anchor(text, start, stop, end)
+        while at != -1:
+            window = self._window(text, at, last_end, end)
+            if window is None:
+                # До начала токена дальше before - все остальные якоря в нем тоже пропускаем
+                at = self._find_anchor(text, self._next_barrier(text, at, stop), stop, end)
+                continue
+            match = self.regex.search(text, *window)
+            if match is None:
+                at = self._find_anchor(text, at + 1, stop, end)
+                continue
+            if match.start() > at:
+                # Совпадение вокруг следующего якоря могло быть обрезано краем этого окна - ищем от его якоря
+                at = self._find_anchor(text, match.start(), stop, end)
+                continue
+            right = window[1]
+            if match.end() == right < end and text[right] not in self.barrier:
+                # Окно обрезано по after посреди токена: выражение закончилось на искусственном краю,
+                # а в тексте совпадение длиннее допустимого. Такой адрес не возвращаем
+                at = self._find_anchor(text, at + 1, stop, end)
+                continue
+            matches.append(self._value(match))
+            last_end = match.end()
+            at = self._find_anchor(text, max(at + 1, last_end), stop, end)
+        return last_end
+
+    def _scan_block(self, text, start, stop, end, last_end, matches):
+        # Совпадения, которые начинаются в [start, stop); соседний блок виден как контекст
+        for match in self.regex.finditer(text, start, min(end, stop + self.after)):
+            if match.start() >= stop:
+                break
+            matches.append(self._value(match))
+            last_end = match.end()
+        return last_end
+
+    def iter_blocks(self, text, end, deadline=None):
+        # Генератор: ищет блоками и после каждого блока отдает (найденное в блоке, позиция).
+        # Останавливается по deadline, отдавая напоследок None вместо списка
+        pos = last_end = 0
+        scan = self._scan_anchored if self.anchor else self._scan_block
+        while pos < end:
+            if deadline is not None and time.monotonic() > deadline:
+                yield None, pos
+                return
+            stop = min(end, pos + EXTRACT_BLOCK)
+            matches = []
+            last_end = scan(text, pos, stop, end, last_end, matches)
+            pos = max(stop, last_end)
+            yield matches, pos
+
+    def scan(self, text, max_chars=EXTRACT_MAX_CHARS, max_seconds=EXTRACT_MAX_SECONDS):
+        # max_chars/max_seconds = None - без ограничения (для бенчмарка)
+        started = time.monotonic()
+        deadline = started + max_seconds if max_seconds else None
+        end = len(text)
+        reason = None
+        if max_chars and end > max_chars:
+            end = max_chars
+            reason = 'size'
+        matches = []
+        scanned = 0
+        for found, scanned in self.iter_blocks(text, end, deadline):
+            if found is None:
+                reason = 'time'
+                break
+            matches.extend(found)
+        elapsed = time.monotonic() - started
+        if reason:
+            logger.warning(f"Extraction stopped early ({reason}): scanned {scanned} of {len(text)} chars "
+                           f"in {elapsed:.3f}s")
+        return ScanResult(matches, reason, scanned, elapsed)
+
+
+
+class StreamScanner:
+    # Поиск в тексте, который приходит кусками. Новый кусок склеивается с хвостом предыдущего,
+    # и поиск идет только там, где справа уже есть after символов контекста, а остаток ждет следующего куска.
+    # Поэтому совпадения на стыке кусков не теряются и не дублируются, а в памяти держится один кусок
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.scanned = 0  # сколько символов уже просмотрено и отброшено
+        self._scan = extractor._scan_anchored if extractor.anchor else extractor._scan_block
+        self._buffer = ''
+        self._pos = 0
+        self._last_end = 0
+
+    def _search(self, stop):
+        matches = []
+        self._last_end = self._scan(self._buffer, self._pos, stop, len(self._buffer), self._last_end, matches)
+        self._pos = max(stop, self._last_end)
+        return matches
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        stop = len(self._buffer) - self.extractor.after
+        if stop <= self._pos:
+            return []
+        matches = self._search(stop)
+        # Слева оставляем before символов и еще пару для \b и просмотра назад
+        cut = max(0, self._pos - self.extractor.before - 2)
+        self._buffer = self._buffer[cut:]
+        self._pos -= cut
+        self._last_end = max(0, self._last_end - cut)
+        self.scanned += cut
+        return matches
+
+    def finish(self):
+        matches = self._search(len(self._buffer)) if self._pos < len(self._buffer) else []
+        self.scanned += len(self._buffer)
+        self._buffer = ''
+        return matches
+
+# Выражения bot.py
+EMAIL = Extractor(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
+                  anchor='@', before=EMAIL_LOCAL_MAX + 1, after=EMAIL_DOMAIN_MAX + 1, barrier=' \t\r\n@,;:<>()[]"\'',
+                  candidate=EMAIL_CANDIDATE)
+PHONE = Extractor(r'(?:\+7|\b8)(?:[ -]?\(?)(\d{3})(?:\)?)(?:[ -]?)(\d{3})(?:[ -]?)(\d{2})(?:[ -]?)(\d{2}\b)',
+                  after=PHONE_MAX)
+
+# Выражения max_bot.py: адрес по RFC 5322 (в том числе локальная часть в кавычках) и номер целиком
+EMAIL_RFC = Extractor(
+    r'(?<!\S)(?:[A-Za-z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.(?!$)[A-Za-z0-9!#$%&\'*+/=?^_`{|}~-]+)*|'
+    r'"(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])*")@'
+    r'(?:[A-Za-z0-9](?:[A-Za-z0-9-]*[A-Za-z0-9])?\.)+[A-Za-z]{2,}',
+    anchor='@', before=EMAIL_LOCAL_MAX + 3, after=EMAIL_DOMAIN_MAX + 1, barrier=' \t\r\n', token_start=True,
+    candidate=EMAIL_CANDIDATE)
+PHONE_FULL = Extractor(r'((?:\+7|8)[- ]?(?:\(\d{3}\)|\d{3})[- ]?\d{3}[- ]?\d{2}[- ]?\d{2})\b', after=PHONE_MAX)
+
+
+def describe_truncation(result):
+    if result.reason == 'size':
+        return f"Текст слишком большой, просмотрены первые {result.scanned} символов"
+    if result.reason == 'time':
+        return f"Поиск остановлен по времени, просмотрены первые {result.scanned} символов"
+    return ''
@@ -0,0 +1,240 @@
+import time
+import json
+import asyncio
+import argparse
+import itertools
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qsl
+import httpx
+import httpd
+
+
+# Поддельный Bot API для локальной проверки webhook и polling без Telegram.
+# Бот запускается с TELEGRAM_API_URL=http://127.0.0.1:8081 (и WEBHOOK_URL для режима webhook),
+# скрипт рассылает ему обновления от имени users пользователей и меряет время до первого ответа.
+# Запуск: python fake_bot_api.py --users 20 --messages 10 --command /help
+# Несколько экземпляров бота с разными WEBHOOK_URL получают обновления по очереди, как за балансировщиком
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+
+
+class FakeBotAPI:
+    def __init__(self, token, flood_rate=None):
+        self.token = token
+        # Лимит сообщений в секунду на чат, сверх него - ответ 429 с retry_after, как у Telegram
+        self.flood_rate = flood_rate
+        self.webhooks = {}  # url -> secret_token
+        self.sent = []  # (chat_id, method, text)
+        self.stats = {'updates': 0, 'webhook_retries': 0, 'flood_429': 0, 'requests': 0}
+        self._updates = []  # для getUpdates
+        self._updates_changed = None
+        self._waiters = {}  # chat_id -> [(Future, until)] ожидающих ответа
+        self._last_sent = {}  # chat_id -> время последнего сообщения
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._rotation = itertools.count()
+        self._client = None
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8081):
+        self._updates_changed = asyncio.Condition()
+        self._client = httpx.AsyncClient(timeout=30)
+        self.server = await httpd.start_server(self._handle, host, port, max_body=64 * 1024 * 1024)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self._client.aclose()
+
+    def _message(self, chat_id, **fields):
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'}, 'from': BOT_USER}
+        message.update(fields)
+        return message
+
+    @staticmethod
+    def _params(request):
+        content_type = request.headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            parsed = BytesParser(policy=HTTP).parsebytes(
+                f'Content-Type: {content_type}\r\n\r\n'.encode() + request.body)
+            params = {}
+            for part in parsed.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if part.get_filename():
+                    params[name] = part.get_filename()
+                else:
+                    params[name] = part.get_content().strip()
+            return params
+        if content_type.startswith('application/json'):
+            return {key: str(value) for key, value in json.loads(request.body or b'{}').items()}
+        return dict(parse_qsl(request.body.decode()))
+
+    def _reply(self, chat_id, method, text):
+        self.sent.append((chat_id, method, text))
+        waiters = self._waiters.get(chat_id)
+        if not waiters:
+            return
+        # Брошенные по таймауту ожидания убираются, ответ достается первому подходящему
+        waiters[:] = [entry for entry in waiters if not entry[0].done()]
+        for entry in waiters:
+            waiter, until = entry
+            if until is None or until in text.lower():
+                waiters.remove(entry)
+                waiter.set_result(time.monotonic())
+                break
+
+    def _flooded(self, chat_id):
+        if not self.flood_rate:
+            return False
+        now = time.monotonic()
+        if now - self._last_sent.get(chat_id, 0) < 1 / self.flood_rate:
+            self.stats['flood_429'] += 1
+            return True
+        self._last_sent[chat_id] = now
+        return False
+
+    @staticmethod
+    def _ok(result):
+        return httpd.Response(200, json.dumps({'ok': True, 'result': result}), 'application/json')
+
+    async def _handle(self, request):
+        prefix = f'/bot{self.token}/'
+        if not request.path.startswith(prefix):
+            return httpd.Response(404, json.dumps({'ok': False, 'error_code': 404, 'description': 'Not Found'}),
+                                  'application/json')
+        self.stats['requests'] += 1
+        method = request.path[len(prefix):]
+        params = self._params(request)
+        if method == 'getMe':
+            return self._ok(BOT_USER)
+        if method == 'setWebhook':
+            self.webhooks[params['url']] = params.get('secret_token', '')
+            return self._ok(True)
+        if method == 'deleteWebhook':
+            self.webhooks.clear()
+            return self._ok(True)
+        if method == 'getWebhookInfo':
+            return self._ok({'url': next(iter(self.webhooks), ''), 'has_custom_certificate': False,
+                             'pending_update_count': len(self._updates)})
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(int(params.get('offset', 0)), float(params.get('timeout', 0))))
+        if method in ('sendMessage', 'sendDocument', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            if self._flooded(chat_id):
+                return httpd.Response(429, json.dumps({'ok': False, 'error_code': 429,
+                                                       'description': 'Too Many Requests: retry after 1',
+                                                       'parameters': {'retry_after': 1}}), 'application/json')
+            if method == 'sendDocument':
+                self._reply(chat_id, method, params.get('document', ''))
+                return self._ok(self._message(chat_id, document={'file_id': 'f', 'file_unique_id': 'f',
+                                                                 'file_name': params.get('document', '')}))
+            self._reply(chat_id, method, params.get('text', ''))
+            return self._ok(self._message(chat_id, text=params.get('text', '')))
+        # answerCallbackQuery, sendChatAction и прочее
+        return self._ok(True)
+
+    async def _get_updates(self, offset, timeout):
+        async with self._updates_changed:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            if not self._updates and timeout:
+                try:
+                    await asyncio.wait_for(self._updates_changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return list(self._updates)
+
+    def make_update(self, chat_id, text):
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private'},
+                   'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'}, 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    async def push(self, chat_id, text, until=None):
+        # Отправляет обновление боту и возвращает future, который завершится с первым ответом в этот чат
+        # (или с первым, в тексте которого есть until, без учета регистра)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append((waiter, until and until.lower()))
+        update = self.make_update(chat_id, text)
+        self.stats['updates'] += 1
+        if not self.webhooks:
+            async with self._updates_changed:
+                self._updates.append(update)
+                self._updates_changed.notify_all()
+            return waiter
+        urls = list(self.webhooks)
+        url = urls[next(self._rotation) % len(urls)]
+        while True:
+            response = await self._client.post(url, json=update,
+                                               headers={'X-Telegram-Bot-Api-Secret-Token': self.webhooks[url]})
+            if response.status_code == 200:
+                return waiter
+            # Telegram повторяет доставку, пока не получит 2xx
+            self.stats['webhook_retries'] += 1
+            await asyncio.sleep(float(response.headers.get('Retry-After', '1')))
+
+    async def wait_ready(self, timeout=30):
+        # Бот готов, когда зарегистрировал webhook или начал опрашивать getUpdates
+        deadline = time.monotonic() + timeout
+        while not self.webhooks and self.stats['requests'] < 2:
+            if time.monotonic() > deadline:
+                raise TimeoutError('bot did not connect to the fake Bot API')
+            await asyncio.sleep(0.1)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def run_load(api, users, messages, command, timeout):
+    latencies = []
+    failures = 0
+
+    async def user(chat_id):
+        nonlocal failures
+        for _ in range(messages):
+            started = time.monotonic()
+            waiter = await api.push(chat_id, command)
+            try:
+                latencies.append(await asyncio.wait_for(waiter, timeout) - started)
+            except asyncio.TimeoutError:
+                failures += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(user(1000 + i) for i in range(users)))
+    return latencies, failures, time.monotonic() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Fake Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--token', default='123:fake')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--command', default='/help')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--flood-rate', type=float, default=None, help='messages per second per chat before 429')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.token, args.flood_rate)
+    await api.start(args.host, args.port)
+    print(f"Fake Bot API on http://{args.host}:{args.port}, waiting for the bot...")
+    await api.wait_ready()
+    await asyncio.sleep(1)
+    mode = f"webhook ({len(api.webhooks)} instances)" if api.webhooks else 'polling'
+    latencies, failures, elapsed = await run_load(api, args.users, args.messages, args.command, args.timeout)
+    print(f"{mode}: {len(latencies)} replies in {elapsed:.2f}s ({len(latencies) / elapsed:.1f}/s), "
+          f"no reply: {failures}")
+    print(f"latency p50={percentile(latencies, 0.5) * 1000:.1f}ms p95={percentile(latencies, 0.95) * 1000:.1f}ms "
+          f"p99={percentile(latencies, 0.99) * 1000:.1f}ms")
+    print(f"stats: {api.stats}")
+    await api.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
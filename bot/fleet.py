@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import asyncio
+import fnmatch
+import logging
+import functools
+import cache
+import delivery
+import sysinfo
+import ssh_client
+
+
+logger = logging.getLogger(__name__)
+
+# Инвентарь хостов и групп, формат - в inventory.example.json.
+# Хост из RM_HOST/RM_PORT/RM_USER/RM_PASSWORD добавляется под именем default
+INVENTORY_PATH = os.getenv('INVENTORY_PATH', 'inventory.json')
+# Время на один хост (подключение и команда), хосты опрашиваются одновременно
+FLEET_TIMEOUT = float(os.getenv('FLEET_TIMEOUT', '30'))
+FLEET_PARALLEL = int(os.getenv('FLEET_PARALLEL', '64'))
+# Готовые результаты копятся и отправляются не чаще раза в FLEET_FLUSH_INTERVAL секунд
+FLEET_FLUSH_INTERVAL = float(os.getenv('FLEET_FLUSH_INTERVAL', '1'))
+
+
+class Host:
+    __slots__ = ('name', 'host', 'port', 'username', 'password')
+
+    def __init__(self, name, host, port, username, password):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+
+
+class Inventory:
+    def __init__(self, hosts, groups):
+        self.hosts = hosts  # name -> Host
+        self.groups = groups  # name -> [имя хоста, группы или шаблон]
+
+    def _expand(self, target, seen):
+        if target == 'all':
+            return list(self.hosts)
+        if target in self.hosts:
+            return [target]
+        if target in self.groups:
+            if target in seen:
+                return []
+            seen.add(target)
+            names = []
+            for member in self.groups[target]:
+                names += self._expand(member, seen)
+            return names
+        names = fnmatch.filter(self.hosts, target)
+        for group in fnmatch.filter(self.groups, target):
+            names += self._expand(group, seen)
+        if not names:
+            raise ValueError(f"неизвестный хост или группа: {target}")
+        return names
+
+    def resolve(self, targets):
+        # targets - имена хостов и групп, шаблоны (web*) и all, через пробел или запятую
+        names = []
+        for arg in targets:
+            for target in arg.split(','):
+                if target:
+                    names += self._expand(target, set())
+        return [self.hosts[name] for name in dict.fromkeys(names)]
+
+
+def _password(entry, default):
+    # Пароль лучше держать в переменной окружения, а в инвентаре указать только ее имя
+    if 'password' in entry:
+        return entry['password']
+    if 'password_env' in entry:
+        return os.getenv(entry['password_env'])
+    return default
+
+
+def load_inventory(path=INVENTORY_PATH):
+    defaults = {'port': os.getenv('RM_PORT') or 22, 'username': os.getenv('RM_USER'),
+                'password': os.getenv('RM_PASSWORD')}
+    hosts = {}
+    groups = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+        config_defaults = config.get('defaults', {})
+        defaults.update(config_defaults)
+        defaults['password'] = _password(config_defaults, defaults['password'])
+        for name, entry in config.get('hosts', {}).items():
+            # Пароль хоста (явный или из его password_env) важнее любого пароля из defaults
+            password = _password(entry, defaults['password'])
+            entry = dict(defaults, **entry)
+            hosts[name] = Host(name, entry['host'], entry['port'], entry['username'], password)
+        groups = {name: list(members) for name, members in config.get('groups', {}).items()}
+    if os.getenv('RM_HOST') and 'default' not in hosts:
+        hosts['default'] = Host('default', os.getenv('RM_HOST'), defaults['port'], defaults['username'],
+                                defaults['password'])
+    logger.info(f"Loaded inventory: {len(hosts)} hosts, {len(groups)} groups")
+    return Inventory(hosts, groups)
+
+
+inventory = load_inventory()
+
+
+class HostResult:
+    __slots__ = ('host', 'status', 'output', 'elapsed', 'age')
+
+    def __init__(self, host, status, output, elapsed, age=None):
+        self.host = host
+        self.status = status  # ok, exit N, truncated, timeout или error
+        self.output = output
+        self.elapsed = elapsed
+        self.age = age  # возраст записи кэша или None
+
+    def __str__(self):
+        cached = f", из кэша ({int(self.age)} с)" if self.age is not None else ''
+        return f"[{self.host.name}] {self.status}, {self.elapsed:.1f} с{cached}\n{self.output.strip()}"
+
+
+class _Stopped(Exception):
+    # Команда остановлена по таймауту: частичный вывод показывается, но не попадает в кэш
+    def __init__(self, output):
+        super().__init__(output)
+        self.output = output
+
+
+async def _run_on_host(host, command, timeout):
+    async def load():
+        # Вывод ограничен SSH_MAX_OUTPUT и timeout так же, как для одного хоста
+        session = ssh_client.get_session(host.host, host.port, host.username, host.password)
+        result = await session.exec_stream(command, timeout=timeout)
+        if result.timed_out:
+            raise _Stopped(result.output + result.notice())
+        if result.truncated:
+            status = 'truncated'
+        else:
+            status = 'ok' if result.exit_status == 0 else f'exit {result.exit_status}'
+        return result.output + result.notice(), status
+
+    started = time.monotonic()
+    try:
+        # Сама команда останавливается по timeout в exec_stream с частичным выводом,
+        # здесь ограничено еще и подключение к хосту
+        (output, status), age = await asyncio.wait_for(
+            cache.ssh_cache.get_or_load((f'{host.host}:{host.port}', command), load, cache.ttl_for(command)),
+            timeout + ssh_client.SSH_CONNECT_TIMEOUT)
+    except _Stopped as e:
+        return HostResult(host, 'timeout', e.output, time.monotonic() - started)
+    except asyncio.TimeoutError:
+        return HostResult(host, 'timeout', f'нет ответа за {timeout:g} с', time.monotonic() - started)
+    except Exception as e:
+        logger.warning(f"Command {command!r} failed on {host.name}: {str(e)}")
+        return HostResult(host, 'error', str(e) or type(e).__name__, time.monotonic() - started)
+    return HostResult(host, status, output, time.monotonic() - started, age)
+
+
+async def _limited(parallel, coroutine):
+    # Таймаут хоста отсчитывается, только когда до него дошла очередь
+    async with parallel:
+        return await coroutine
+
+
+async def run(hosts, command, timeout=FLEET_TIMEOUT):
+    # Асинхронный генератор: результаты в порядке готовности, общее время - как у самого медленного хоста
+    parallel = asyncio.Semaphore(FLEET_PARALLEL)
+    tasks = [asyncio.ensure_future(_limited(parallel, _run_on_host(host, command, timeout))) for host in hosts]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def summary(results, elapsed):
+    counts = {}
+    for result in results:
+        status = 'exit' if result.status.startswith('exit') else result.status
+        counts[status] = counts.get(status, 0) + 1
+    lines = [f"Итого: {len(results)} хостов за {elapsed:.1f} с - успешно {counts.get('ok', 0)}, "
+             f"с ошибкой {counts.get('exit', 0)}, вывод обрезан {counts.get('truncated', 0)}, "
+             f"таймаут {counts.get('timeout', 0)}, недоступно {counts.get('error', 0)}"]
+    width = max((len(result.host.name) for result in results), default=0)
+    for result in sorted(results, key=lambda result: result.host.name):
+        lines.append(f"{result.host.name.ljust(width)}  {result.status:<9} {result.elapsed:6.1f} с  "
+                     f"{len(result.output.splitlines())} строк")
+    return '\n'.join(lines)
+
+
+async def fan_out(update, targets, command, render=None):
+    # render(output) - компактный вид успешного вывода, как у команды на одном хосте
+    try:
+        hosts = inventory.resolve(targets)
+    except ValueError as e:
+        await update.effective_message.reply_text(f"Ошибка: {str(e)}\nХосты и группы: /hosts")
+        return
+    if not hosts:
+        # all при пустом инвентаре или пустая группа
+        await update.effective_message.reply_text("Ни один хост не подходит под запрос\nХосты и группы: /hosts")
+        return
+    started = time.monotonic()
+    results = []
+    pending = []
+    flushed = started
+    async for result in run(hosts, command):
+        if render is not None and result.status == 'ok':
+            result.output = render(result.output)
+        results.append(result)
+        pending.append(str(result))
+        # Готовые хосты отправляются сразу, но пачками, чтобы не упираться в лимиты Telegram
+        if time.monotonic() - flushed >= FLEET_FLUSH_INTERVAL:
+            await delivery.send_text(update, '\n\n'.join(pending), 'hosts.txt')
+            pending = []
+            flushed = time.monotonic()
+    if pending:
+        await delivery.send_text(update, '\n\n'.join(pending), 'hosts.txt')
+    await delivery.send_text(update, summary(results, time.monotonic() - started))
+    logger.info(f"Ran {command!r} on {len(hosts)} hosts in {time.monotonic() - started:.1f}s")
+
+
+def multi_host(command):
+    # Декоратор системной команды: /get_df без аргументов - как раньше, /get_df web* или /get_df all -
+    # та же команда на всех подходящих хостах инвентаря.
+    # command - строка или sysinfo.View; у View параметры (--over 80%) проверяются здесь и действуют на всех хостах
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            if not isinstance(command, sysinfo.View):
+                if not context.args:
+                    return await handler(update, context)
+                return await fan_out(update, context.args, command)
+            try:
+                targets, options = command.parse_args(context.args)
+            except ValueError as e:
+                await update.effective_message.reply_text(f"Ошибка: {str(e)}")
+                return
+            if not targets:
+                return await handler(update, context)
+            await fan_out(update, targets, command.command(options),
+                          functools.partial(command.render, options=options))
+        return wrapper
+    return decorator
+
+
+def describe_inventory():
+    lines = ['Хосты:']
+    lines += [f"{host.name}: {host.username}@{host.host}:{host.port}" for host in inventory.hosts.values()]
+    if inventory.groups:
+        lines.append('Группы:')
+        lines += [f"{name}: {', '.join(members)}" for name, members in inventory.groups.items()]
+    return '\n'.join(lines)
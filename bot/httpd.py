@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit, parse_qsl
+
+
+logger = logging.getLogger(__name__)
+
+# Минимальный HTTP/1.1 сервер на asyncio для служебных точек (метрики, webhook):
+# только запросы с Content-Length, соединения keep-alive
+HTTP_IDLE_TIMEOUT = 75
+HTTP_READ_TIMEOUT = 10
+HTTP_MAX_HEADERS = 100
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+           411: 'Length Required', 413: 'Payload Too Large', 429: 'Too Many Requests',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class Request:
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers  # имена в нижнем регистре
+        self.body = body
+
+
+class Response:
+    __slots__ = ('status', 'body', 'content_type', 'headers')
+
+    def __init__(self, status=200, body=b'', content_type='text/plain; charset=utf-8', headers=None):
+        self.status = status
+        self.body = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+async def read_request(reader, max_body):
+    # None - клиент закрыл соединение или молчал дольше HTTP_IDLE_TIMEOUT
+    try:
+        line = await asyncio.wait_for(reader.readline(), HTTP_IDLE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise HTTPError(400)
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), HTTP_READ_TIMEOUT)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) >= HTTP_MAX_HEADERS:
+            raise HTTPError(400)
+        name, sep, value = line.decode('latin-1').partition(':')
+        if not sep:
+            raise HTTPError(400)
+        headers[name.strip().lower()] = value.strip()
+    if 'chunked' in headers.get('transfer-encoding', ''):
+        raise HTTPError(411)
+    try:
+        length = int(headers.get('content-length', '0'))
+    except ValueError:
+        raise HTTPError(400)
+    if length > max_body:
+        raise HTTPError(413)
+    body = await asyncio.wait_for(reader.readexactly(length), HTTP_READ_TIMEOUT) if length else b''
+    url = urlsplit(parts[1])
+    return Request(parts[0], url.path, dict(parse_qsl(url.query)), headers, body)
+
+
+def _encode(response, keep_alive):
+    head = [f'HTTP/1.1 {response.status} {REASONS.get(response.status, "")}',
+            f'Content-Type: {response.content_type}',
+            f'Content-Length: {len(response.body)}',
+            'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+    head += [f'{name}: {value}' for name, value in response.headers.items()]
+    return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + response.body
+
+
+class HTTPServer:
+    # handler(request) - корутина, возвращающая Response
+    def __init__(self, handler, max_body):
+        self.handler = handler
+        self.max_body = max_body
+        self._server = None
+        self._connections = {}  # writer -> задача соединения
+
+    async def _serve(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body)
+                except HTTPError as e:
+                    writer.write(_encode(Response(e.status, REASONS.get(e.status, '')), False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                try:
+                    response = await self.handler(request)
+                except Exception:
+                    logger.error(f"Error while handling {request.method} {request.path}", exc_info=True)
+                    response = Response(500, 'Internal Server Error')
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                writer.write(_encode(response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._serve, host, port)
+
+    def close(self):
+        # Закрываем и простаивающие keep-alive соединения, иначе они держатся до HTTP_IDLE_TIMEOUT
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+
+    async def wait_closed(self):
+        await self._server.wait_closed()
+        if self._connections:
+            await asyncio.wait(list(self._connections.values()), timeout=HTTP_READ_TIMEOUT)
+
+
+async def start_server(handler, host, port, max_body=1024 * 1024):
+    server = HTTPServer(handler, max_body)
+    await server.start(host, port)
+    return server
@@ -0,0 +1,129 @@
+import os
+import asyncio
+import logging
+import functools
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class Busy(Exception):
+    pass
+
+
+class Backend:
+    # Ограничение одновременных запросов к одному ресурсу (SSH-хост, БД, локальные процессы)
+    # с ограниченной FIFO-очередью ожидающих
+    def __init__(self, name, limit, queue_size):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self._waiters = deque()
+        self.stats = {'requests': 0, 'queued': 0, 'rejected': 0, 'max_waiting': 0,
+                      'wait_total': 0.0, 'wait_max': 0.0}
+
+    def _release(self):
+        # Слот передается первому живому ожидающему, иначе освобождается
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _position(self, waiter):
+        # Место среди еще ждущих, считая с 1
+        position = 0
+        for other in self._waiters:
+            if not other.done():
+                position += 1
+            if other is waiter:
+                break
+        return position
+
+    @asynccontextmanager
+    async def slot(self, on_queued=None):
+        # on_queued(position) - корутина, вызывается, если запросу пришлось встать в очередь
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.stats['requests'] += 1
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+        else:
+            if len(self._waiters) >= self.queue_size:
+                self.stats['rejected'] += 1
+                raise Busy(self.name)
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            self.stats['queued'] += 1
+            self.stats['max_waiting'] = max(self.stats['max_waiting'], len(self._waiters))
+            try:
+                if on_queued is not None:
+                    try:
+                        await on_queued(self._position(waiter))
+                    except Exception:
+                        logger.warning(f"Could not report queue position for {self.name}", exc_info=True)
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    # Слот уже был передан этому запросу - отдаем его следующему
+                    self._release()
+                else:
+                    # Отмененный запрос (таймаут обработчика, остановка бота) уходит из очереди сразу,
+                    # чтобы не занимать место и не сдвигать позиции остальных
+                    waiter.cancel()
+                    try:
+                        self._waiters.remove(waiter)
+                    except ValueError:
+                        pass
+                raise
+            waited = loop.time() - started
+            self.stats['wait_total'] += waited
+            self.stats['wait_max'] = max(self.stats['wait_max'], waited)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats.update(active=self.active, limit=self.limit, waiting=len(self._waiters), queue_size=self.queue_size)
+        stats['wait_avg'] = stats['wait_total'] / stats['queued'] if stats['queued'] else 0.0
+        return stats
+
+
+backends = {
+    'ssh': Backend('ssh', int(os.getenv('LIMIT_SSH', '8')), int(os.getenv('QUEUE_SSH', '50'))),
+    'db': Backend('db', int(os.getenv('LIMIT_DB', '8')), int(os.getenv('QUEUE_DB', '100'))),
+    'local': Backend('local', int(os.getenv('LIMIT_LOCAL', '2')), int(os.getenv('QUEUE_LOCAL', '20'))),
+}
+
+
+def limited(backend_name):
+    # Декоратор обработчика: не больше limit одновременных вызовов на бэкенд, остальные ждут
+    # в очереди и сразу получают свою позицию, при переполненной очереди запрос отклоняется
+    backend = backends[backend_name]
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            message = update.effective_message
+
+            async def on_queued(position):
+                await message.reply_text(f"Сервер занят, ваша позиция в очереди: {position}")
+
+            try:
+                async with backend.slot(on_queued):
+                    return await handler(update, context)
+            except Busy:
+                logger.warning(f"{backend_name} queue is full, rejecting {handler.__name__}")
+                await message.reply_text("Сервер перегружен, попробуйте позже")
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    return {name: backend.get_stats() for name, backend in backends.items()}
@@ -0,0 +1,503 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import asyncio
+import argparse
+import itertools
+import subprocess
+import tempfile
+import asyncpg
+import asyncssh
+from fake_bot_api import FakeBotAPI, percentile
+
+
+# Нагрузочный прогон bot.py и max_bot.py на локальных заменах Telegram, SSH и PostgreSQL:
+# поддельный Bot API (fake_bot_api.py), SSH-сервер в этом же процессе с заготовленными выводами команд
+# и задержкой, временный кластер PostgreSQL (initdb из PATH или --pg-bin; от root не запускается - тогда --db).
+# Боты запускаются по очереди, каждый со своей чистой базой; users пользователей одновременно проходят
+# все команды из main() бота, включая диалоги поиска с подтверждением, rounds раз в случайном порядке.
+# Запуск: python load_test.py --users 20 --rounds 3 [--ssh-latency 0.05] [--bots bot.py,max_bot.py] [--json out.json]
+# Настройки ботов (STATE_BACKEND, LIMIT_*, SSH_CACHE_SIZE...) берутся из окружения, как при обычном запуске
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+INIT_SQL = os.path.join(BOT_DIR, '..', 'db', 'init.sql')
+TOKEN = '123:load'
+SSH_USER = 'load'
+SSH_PASSWORD = 'load'
+
+# Значения по умолчанию, которые можно переопределить окружением: фоновый опрос создавал бы свою нагрузку на SSH,
+# а лимиты отправки Telegram (1 сообщение в секунду на чат) скрыли бы время работы самого бота
+BOT_DEFAULTS = {
+    'SAMPLER_INTERVAL': '0',
+    'METRICS_PORT': '0',
+    'DELIVERY_CHAT_RATE': '1000',
+    'DELIVERY_CHAT_BURST': '1000',
+    'DELIVERY_GROUP_RATE': '1000',
+    'DELIVERY_GLOBAL_RATE': '100000',
+}
+
+CANNED = {
+    'lsb_release': 'Distributor ID:\tUbuntu\nDescription:\tUbuntu 22.04.4 LTS\nRelease:\t22.04\nCodename:\tjammy\n',
+    'cat /proc/version': 'Linux version 5.15.0-105-generic (buildd@lcy02-amd64-007) (gcc 11.4.0) '
+                         '#115-Ubuntu SMP Mon Apr 15 09:52:04 UTC 2024\n',
+    'uname': 'Linux load-host 5.15.0-105-generic #115-Ubuntu SMP Mon Apr 15 09:52:04 UTC 2024 x86_64 GNU/Linux\n',
+    'uptime': ' 12:00:01 up 12 days,  3:04,  2 users,  load average: 0.52, 0.58, 0.59\n',
+    'df': 'Filesystem     1024-blocks     Used Available Capacity Mounted on\n'
+          '/dev/sda1         81106868 40553434  36430178      53% /\n'
+          '/dev/sda15          106858     6186    100672       6% /boot/efi\n'
+          '/dev/sdb1        515928320 445018112  44679424      91% /var/lib/postgresql\n',
+    'free': '               total        used        free      shared  buff/cache   available\n'
+            'Mem:      8232361984  2147483648  1073741824    52428800  5011136512  5779095552\n'
+            'Swap:     2147479552   104857600  2042621952\n',
+    'mpstat': 'Linux 5.15.0-105-generic (load-host) \t03/01/24 \t_x86_64_\t(2 CPU)\n\n'
+              '12:00:01     CPU    %usr   %nice    %sys %iowait    %irq   %soft  %steal  %guest  %gnice   %idle\n'
+              '12:00:01     all    7.52    0.01    2.31    0.45    0.00    0.12    0.00    0.00    0.00   89.59\n'
+              '12:00:01       0    8.01    0.01    2.40    0.51    0.00    0.20    0.00    0.00    0.00   88.87\n'
+              '12:00:01       1    7.03    0.01    2.22    0.39    0.00    0.04    0.00    0.00    0.00   90.31\n',
+    'w': ' 12:00:01 up 12 days,  3:04,  2 users,  load average: 0.52, 0.58, 0.59\n'
+         'USER     TTY      FROM             LOGIN@   IDLE   JCPU   PCPU WHAT\n'
+         'admin    pts/0    10.0.0.5         09:12    1:02m  0.05s  0.05s -bash\n',
+    'last': 'admin    pts/0        10.0.0.5         Fri Mar  1 09:12   still logged in\n'
+            'admin    pts/1        10.0.0.7         Thu Feb 29 18:40 - 19:02  (00:22)\n\nwtmp begins Thu Feb  1 00:00:01 2024\n',
+    'tail -n 5 /var/log/syslog': 'Mar  1 11:59:01 load-host CRON[1234]: (root) CMD (command -v debian-sa1 > /dev/null)\n',
+    'journalctl': '-- No entries --\n',
+    'ps': '      1 root                               0.0  0.1  11904 systemd\n'
+          '    812 postgres                           2.5  1.6 135232 postgres\n'
+          '   1201 admin                              0.7  0.4  32768 python3\n',
+    'ss -s': 'Total: 212\nTCP:   14 (estab 5, closed 2, orphaned 0, timewait 2)\n',
+    'ss': 'Netid State  Recv-Q Send-Q Local Address:Port  Peer Address:Port Process\n'
+          'tcp   LISTEN 0      128          0.0.0.0:22         0.0.0.0:*\n'
+          'tcp   LISTEN 0      244          0.0.0.0:5432       0.0.0.0:*\n'
+          'tcp   ESTAB  0      0           10.0.0.2:22        10.0.0.5:51234\n',
+    # packages.Catalog: время изменения базы dpkg и сама база
+    'm=$(stat -c %Y /var/lib/dpkg/status)': '1709290000\n' + ''.join(
+        f'Package: package-{i}\nStatus: install ok installed\nSection: utils\nInstalled-Size: {100 + i}\n'
+        f'Architecture: amd64\nVersion: 1.{i}.0-1\nDescription: load test package {i}\n long description\n\n'
+        for i in range(200)),
+    'service --status-all': ' [ + ]  cron\n [ + ]  postgresql\n [ + ]  ssh\n [ - ]  ufw\n',
+    'systemctl list-units': '  UNIT              LOAD   ACTIVE SUB     DESCRIPTION\n'
+                            '  cron.service      loaded active running Regular background program processing daemon\n'
+                            '  ssh.service       loaded active running OpenBSD Secure Shell server\n',
+}
+
+REPL_LOG = ('2024-03-01 11:59:01.123 UTC [812] LOG:  replication connection authorized: user=replication_user\n'
+            '2024-03-01 11:59:01.456 UTC [812] LOG:  started streaming WAL from primary at 0/3000000 on timeline 1\n')
+
+
+def canned_output(command):
+    # Самый длинный подходящий префикс, как в cache.ttl_for; фильтры "| head" и awk не выполняются
+    if command.startswith('LC_ALL=C '):
+        command = command[len('LC_ALL=C '):]
+    matches = [prefix for prefix in CANNED if command.startswith(prefix)]
+    if not matches:
+        return None
+    return CANNED[max(matches, key=len)]
+
+
+def _phone(n):
+    return f'Звоните +7 (9{n % 100:02d}) {n // 100 % 1000:03d}-{n // 100000 % 100:02d}-{n // 10 ** 7 % 100:02d}'
+
+
+# Шаги сценария: (текст, признак завершения шага). Признак - часть текста ответа без учета регистра,
+# None - первый ответ. Текст может быть функцией от уникального номера, чтобы найденные значения были новыми
+SCENARIOS = {
+    'start': [('/start', None)],
+    'help': [('/help', None)],
+    'find_email': [('/find_email', 'введите текст'),
+                   (lambda n: f'Пишите на load{n}@example.com', 'да/нет'),
+                   ('да', 'успешно сохранены')],
+    'find_phone_number': [('/find_phone_number', 'введите текст'), (_phone, 'да/нет'), ('да', 'успешно сохранены')],
+    'verify_password': [('/verify_password', 'введите пароль'), (lambda n: f'Load-Test-{n}a', None)],
+    'get_repl_logs': [('/get_repl_logs', None)],
+    'get_emails': [('/get_emails', None)],
+    'get_phone_numbers': [('/get_phone_numbers', None)],
+    'lookup': [('/lookup test1@example.com', None)],
+    'get_release': [('/get_release', None)],
+    'get_uname': [('/get_uname', None)],
+    'get_uptime': [('/get_uptime', None)],
+    'get_df': [('/get_df', None)],
+    'get_free': [('/get_free', None)],
+    'get_mpstat': [('/get_mpstat', None)],
+    'get_w': [('/get_w', None)],
+    'get_status': [('/get_status', None)],
+    'get_auths': [('/get_auths', None)],
+    'get_critical': [('/get_critical', None)],
+    'get_ps': [('/get_ps', None)],
+    'get_ss': [('/get_ss', None)],
+    'get_apt_list': [('/get_apt_list ackage-1', None)],
+    'get_services': [('/get_services', None)],
+    'refresh': [('/refresh', None)],
+    'stats': [('/stats', None)],
+    'hosts': [('/hosts', None)],
+    'history': [('/history free', None)],
+    'text': [('просто текст', None)],
+}
+
+# Отличия диалогов max_bot.py
+OVERRIDES = {
+    'max_bot.py': {'get_apt_list': [('/get_apt_list', 'введите 1'), ('1', None)]},
+}
+
+
+def registered_commands(script):
+    # Команды, которые бот регистрирует в main(), - из исходного текста, без запуска
+    with open(os.path.join(BOT_DIR, script), encoding='utf-8') as f:
+        return set(re.findall(r'CommandHandler\(\s*["\'](\w+)["\']', f.read()))
+
+
+def scenarios_for(script):
+    commands = registered_commands(script)
+    missing = commands - set(SCENARIOS)
+    if missing:
+        print(f"warning: no scenario for {', '.join(sorted(missing))}")
+    scenarios = {name: steps for name, steps in SCENARIOS.items() if name in commands or name == 'text'}
+    scenarios.update(OVERRIDES.get(script, {}))
+    return scenarios
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Сервер на asyncssh, а не на paramiko: paramiko убран из requirements.txt, а asyncssh уже нужен боту
+class _SSHServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return username == SSH_USER and password == SSH_PASSWORD
+
+
+class FakeSSH:
+    # SSH-сервер с заготовленными выводами; каждая команда отвечает через latency ± jitter секунд
+    def __init__(self, latency, jitter):
+        self.latency = latency
+        self.jitter = jitter
+        self.stats = {'connections': 0, 'commands': 0}
+        self.unknown = set()
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncssh.create_server(
+            self._connection, '127.0.0.1', 0, server_host_keys=[asyncssh.generate_private_key('ssh-ed25519')],
+            process_factory=self._process, encoding=None)
+        self.port = self.server.get_port()
+
+    def _connection(self):
+        self.stats['connections'] += 1
+        return _SSHServer()
+
+    async def _process(self, process):
+        self.stats['commands'] += 1
+        command = process.command or ''
+        output = canned_output(command)
+        await asyncio.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+        if output is None:
+            self.unknown.add(command)
+            process.stderr.write(f'{command.split()[0] if command else "sh"}: command not found\n'.encode())
+            process.exit(127)
+            return
+        process.stdout.write(output.encode())
+        process.exit(0)
+
+    def stop(self):
+        self.server.close()
+
+
+def schema():
+    # init.sql без настройки репликации: пользователь, pg_hba.conf и слот здесь не нужны
+    with open(INIT_SQL, encoding='utf-8') as f:
+        statements = f.read().split(';\n')
+    skip = ('replication', 'hba', 'pg_reload_conf')
+    return ';\n'.join(statement for statement in statements if not any(word in statement for word in skip))
+
+
+class Postgres:
+    def __init__(self, host, port, user, password):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+
+    async def _connect(self, database):
+        return await asyncpg.connect(host=self.host, port=self.port, user=self.user, password=self.password,
+                                     database=database)
+
+    async def create_database(self, name):
+        connection = await self._connect('postgres')
+        try:
+            await connection.execute(f'DROP DATABASE IF EXISTS {name}')
+            await connection.execute(f'CREATE DATABASE {name}')
+        finally:
+            await connection.close()
+        connection = await self._connect(name)
+        try:
+            await connection.execute(schema())
+        finally:
+            await connection.close()
+
+    async def drop_database(self, name):
+        connection = await self._connect('postgres')
+        try:
+            await connection.execute(f'DROP DATABASE IF EXISTS {name}')
+        finally:
+            await connection.close()
+
+
+class DisposablePostgres(Postgres):
+    # Кластер во временном каталоге: вход без пароля, только с 127.0.0.1, fsync выключен
+    def __init__(self, pg_bin=None):
+        super().__init__('127.0.0.1', _free_port(), 'postgres', None)
+        self.pg_bin = pg_bin
+        self.directory = None
+
+    def _tool(self, name):
+        path = os.path.join(self.pg_bin, name) if self.pg_bin else shutil.which(name)
+        if not path or not os.path.exists(path):
+            raise SystemExit(f"{name} not found: install PostgreSQL, pass --pg-bin or use --db host:port")
+        return path
+
+    def start(self):
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            raise SystemExit("initdb refuses to run as root: run as a regular user or use --db host:port")
+        self.directory = tempfile.mkdtemp(prefix='load-pg-')
+        data = os.path.join(self.directory, 'data')
+        subprocess.run([self._tool('initdb'), '-D', data, '-U', 'postgres', '-A', 'trust', '--no-sync'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self._tool('pg_ctl'), '-D', data, '-l', os.path.join(self.directory, 'postgres.log'), '-w',
+                        '-o', f'-p {self.port} -c listen_addresses=127.0.0.1 -k {self.directory} -c fsync=off '
+                              f'-c max_connections=300', 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+
+    def stop(self):
+        if self.directory is None:
+            return
+        subprocess.run([self._tool('pg_ctl'), '-D', os.path.join(self.directory, 'data'), '-m', 'immediate', 'stop'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
+
+
+def _usage(pid):
+    # Время процессора (с) и пиковый RSS (байты) процесса; только Linux, иначе None
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open(f'/proc/{pid}/status') as f:
+            peak = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+        return cpu, peak
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+
+class BotRun:
+    def __init__(self, script, api_port, ssh, db, database, directory):
+        self.script = script
+        self.directory = directory
+        self.env = dict(BOT_DEFAULTS)
+        self.env.update(os.environ)
+        self.env.update(
+            TOKEN=TOKEN, TELEGRAM_API_URL=f'http://127.0.0.1:{api_port}', WEBHOOK_URL='',
+            RM_HOST='127.0.0.1', RM_PORT=str(ssh.port), RM_USER=SSH_USER, RM_PASSWORD=SSH_PASSWORD,
+            DB_HOST=db.host, DB_PORT=str(db.port), DB_USER=db.user, DB_PASSWORD=db.password or '',
+            DB_DATABASE=database, DB_REPL_HOST='', DB_REPL_PORT='',
+            REPL_LOG_PATH=os.path.join(directory, 'postgresql.log'),
+            REPL_LOG_STATE=os.path.join(directory, 'repl_log_state.json'),
+            INVENTORY_PATH=os.path.join(directory, 'inventory.json'),
+            STATE_SQLITE_PATH=os.path.join(directory, 'state.db'))
+        self.process = None
+
+    async def start(self):
+        with open(self.env['REPL_LOG_PATH'], 'w') as f:
+            f.write(REPL_LOG)
+        output = open(os.path.join(self.directory, 'output.txt'), 'wb')
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(BOT_DIR, self.script), cwd=self.directory, env=self.env,
+            stdout=output, stderr=subprocess.STDOUT)
+        output.close()
+
+    def usage(self):
+        return _usage(self.process.pid)
+
+    async def stop(self):
+        if self.process.returncode is not None:
+            return
+        self.process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(self.process.wait(), 30)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+async def run_user(api, chat_id, scenarios, rounds, rng, numbers, timeout, think, results):
+    for _ in range(rounds):
+        names = list(scenarios)
+        rng.shuffle(names)
+        for name in names:
+            entry = results.setdefault(name, {'latencies': [], 'steps': [], 'failures': 0})
+            started = time.monotonic()
+            for text, until in scenarios[name]:
+                if callable(text):
+                    text = text(next(numbers))
+                sent = time.monotonic()
+                waiter = await api.push(chat_id, text, until)
+                try:
+                    entry['steps'].append(await asyncio.wait_for(waiter, timeout) - sent)
+                except asyncio.TimeoutError:
+                    entry['failures'] += 1
+                    break
+            else:
+                entry['latencies'].append(time.monotonic() - started)
+            if think:
+                await asyncio.sleep(rng.uniform(0, 2 * think))
+
+
+async def run_bot(script, args, ssh, db, workdir):
+    scenarios = scenarios_for(script)
+    name = os.path.splitext(script)[0]
+    database = f'load_{name}'
+    directory = os.path.join(workdir, name)
+    os.makedirs(directory, exist_ok=True)
+    await db.create_database(database)
+    api = FakeBotAPI(TOKEN)
+    api_port = _free_port()
+    await api.start('127.0.0.1', api_port)
+    bot = BotRun(script, api_port, ssh, db, database, directory)
+    ssh.stats = {'connections': 0, 'commands': 0}
+    await bot.start()
+    try:
+        await api.wait_ready(60)
+        await asyncio.sleep(1)
+        before = bot.usage()
+        results = {}
+        numbers = itertools.count(1)
+        started = time.monotonic()
+        await asyncio.gather(*(run_user(api, 1000 + i, scenarios, args.rounds, random.Random(args.seed + i), numbers,
+                                        args.timeout, args.think, results) for i in range(args.users)))
+        elapsed = time.monotonic() - started
+        after = bot.usage()
+    finally:
+        await bot.stop()
+        await api.stop()
+        await db.drop_database(database)
+    steps = [latency for entry in results.values() for latency in entry['steps']]
+    report = {
+        'elapsed': elapsed,
+        'scenarios': sum(len(entry['latencies']) for entry in results.values()),
+        'steps': len(steps),
+        'failures': sum(entry['failures'] for entry in results.values()),
+        'p50': percentile(steps, 0.5), 'p95': percentile(steps, 0.95), 'p99': percentile(steps, 0.99),
+        'ssh_connections': ssh.stats['connections'], 'ssh_commands': ssh.stats['commands'],
+        'bot_api_requests': api.stats['requests'],
+        'cpu': after[0] - before[0] if before and after else None,
+        'peak_rss': after[1] if after else None,
+        'commands': {command: {'count': len(entry['latencies']), 'failures': entry['failures'],
+                               'p50': percentile(entry['latencies'], 0.5),
+                               'p95': percentile(entry['latencies'], 0.95),
+                               'p99': percentile(entry['latencies'], 0.99)}
+                     for command, entry in sorted(results.items())},
+    }
+    print(f"{script}: {report['scenarios']} scenarios, {report['steps']} replies in {elapsed:.1f}s, "
+          f"failures: {report['failures']} (bot output: {os.path.join(directory, 'output.txt')})")
+    return report
+
+
+def _ms(value):
+    return f'{value * 1000:.0f}'
+
+
+def print_report(reports):
+    scripts = list(reports)
+    width = 16
+    print()
+    print(f"{'':<22}" + ''.join(f'{script:>{width}}' for script in scripts))
+    rows = [
+        ('throughput, replies/s', lambda r: f"{r['steps'] / r['elapsed']:.1f}"),
+        ('scenarios/s', lambda r: f"{r['scenarios'] / r['elapsed']:.1f}"),
+        ('reply p50, ms', lambda r: _ms(r['p50'])),
+        ('reply p95, ms', lambda r: _ms(r['p95'])),
+        ('reply p99, ms', lambda r: _ms(r['p99'])),
+        ('failures', lambda r: str(r['failures'])),
+        ('cpu, s', lambda r: f"{r['cpu']:.1f}" if r['cpu'] is not None else 'n/a'),
+        ('cpu, %', lambda r: f"{100 * r['cpu'] / r['elapsed']:.0f}" if r['cpu'] is not None else 'n/a'),
+        ('peak rss, MB', lambda r: f"{r['peak_rss'] / 2 ** 20:.0f}" if r['peak_rss'] is not None else 'n/a'),
+        ('ssh connections', lambda r: str(r['ssh_connections'])),
+        ('ssh commands', lambda r: str(r['ssh_commands'])),
+        ('bot api requests', lambda r: str(r['bot_api_requests'])),
+    ]
+    for title, value in rows:
+        print(f'{title:<22}' + ''.join(f'{value(reports[script]):>{width}}' for script in scripts))
+    print()
+    print('Scenario latency p50/p95/p99, ms (failures):')
+    commands = sorted({command for report in reports.values() for command in report['commands']})
+    for command in commands:
+        cells = []
+        for script in scripts:
+            entry = reports[script]['commands'].get(command)
+            if entry is None:
+                cells.append('-')
+                continue
+            cell = f"{_ms(entry['p50'])}/{_ms(entry['p95'])}/{_ms(entry['p99'])}"
+            cells.append(cell + (f" ({entry['failures']})" if entry['failures'] else ''))
+        print(f'{command:<22}' + ''.join(f'{cell:>{width + 4}}' for cell in cells))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Load test for bot.py and max_bot.py')
+    parser.add_argument('--bots', default='bot.py,max_bot.py')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=2, help='passes over all scenarios per user')
+    parser.add_argument('--think', type=float, default=0.0, help='mean pause between scenarios, seconds')
+    parser.add_argument('--timeout', type=float, default=30, help='per reply, seconds')
+    parser.add_argument('--ssh-latency', type=float, default=0.05)
+    parser.add_argument('--ssh-jitter', type=float, default=0.02)
+    parser.add_argument('--pg-bin', help='directory with initdb and pg_ctl')
+    parser.add_argument('--db', help='existing PostgreSQL host:port instead of a disposable cluster')
+    parser.add_argument('--db-user', default='postgres')
+    parser.add_argument('--db-password', default=os.getenv('DB_PASSWORD'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    ssh = FakeSSH(args.ssh_latency, args.ssh_jitter)
+    await ssh.start()
+    if args.db:
+        host, _, port = args.db.rpartition(':')
+        db = Postgres(host or '127.0.0.1', int(port), args.db_user, args.db_password)
+    else:
+        db = DisposablePostgres(args.pg_bin)
+        db.start()
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    reports = {}
+    try:
+        for script in args.bots.split(','):
+            reports[script] = await run_bot(script, args, ssh, db, workdir)
+    finally:
+        ssh.stop()
+        if isinstance(db, DisposablePostgres):
+            db.stop()
+    if ssh.unknown:
+        print(f"warning: no canned output for: {', '.join(sorted(ssh.unknown))}")
+    print_report(reports)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'reports': reports}, f, indent=2)
+    print(f"\nBot logs and outputs: {workdir}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+import os
+import re
+import gzip
+import queue
+import atexit
+import shutil
+import logging
+import logging.handlers
+
+
+# Логирование через очередь: обработчик в потоке бота только кладет запись в очередь,
+# форматирование, маскирование и запись в файл (с ротацией и сжатием) идут в отдельном потоке
+LOG_LEVEL = os.getenv('LOG_LEVEL')
+# Уровни отдельных логгеров: LOG_LEVELS=httpx=WARNING,telegram=INFO,asyncssh=WARNING
+LOG_LEVELS = os.getenv('LOG_LEVELS', 'httpx=WARNING,httpcore=WARNING,asyncssh=WARNING')
+# Ротация по размеру (LOG_MAX_BYTES) или по времени (LOG_ROTATE_WHEN=midnight, h, d...), старые файлы сжимаются gzip
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN')
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', '5'))
+LOG_COMPRESS = os.getenv('LOG_COMPRESS', '1') == '1'
+# Записи сверх размера очереди отбрасываются, а не задерживают ответ
+LOG_QUEUE = int(os.getenv('LOG_QUEUE', '10000'))
+# Из DEBUG-записей одного места в коде пишется первая и затем каждая N-я
+LOG_DEBUG_SAMPLE = int(os.getenv('LOG_DEBUG_SAMPLE', '1'))
+# Маскирование email, телефонов, паролей и значений секретных переменных окружения
+LOG_REDACT = os.getenv('LOG_REDACT', '1') == '1'
+SECRET_VARS = ('TOKEN', 'RM_PASSWORD', 'DB_PASSWORD', 'DB_REPL_PASSWORD', 'WEBHOOK_SECRET')
+
+REDACTIONS = (
+    (re.compile(r'\b\d{6,12}:[\w-]{30,}'), '<token>'),
+    (re.compile(r'((?:password|passwd|пароль)[^:=\n]{0,20}[:=]\s*)\S+', re.IGNORECASE), r'\1***'),
+    (re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)*\.[A-Za-z]{2,}\b'), '<email>'),
+    (re.compile(r'(?<![\w+])(?:\+7|8|7)[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}(?!\d)'), '<phone>'),
+)
+
+stats = {'dropped': 0, 'sampled_out': 0}
+_listener = None
+_queue = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # Запись уходит в очередь как есть: сообщение собирается и форматируется уже в потоке записи
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats['dropped'] += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Очередь может быть заполнена: ждем места, а не теряем сигнал остановки
+        self.queue.put(self._sentinel)
+
+
+class _DebugSampler(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self._counts = {}  # (путь, строка) -> число записей
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        count = self._counts.get(key, 0)
+        self._counts[key] = count + 1
+        if count % self.rate:
+            stats['sampled_out'] += 1
+            return False
+        return True
+
+
+class RedactingFormatter(logging.Formatter):
+    # Маскируется готовая строка целиком, включая текст исключения
+    def __init__(self, fmt, secrets=()):
+        super().__init__(fmt)
+        self.secrets = [secret for secret in secrets if secret and len(secret) >= 4]
+
+    def format(self, record):
+        text = super().format(record)
+        for secret in self.secrets:
+            text = text.replace(secret, '***')
+        for pattern, replacement in REDACTIONS:
+            text = pattern.sub(replacement, text)
+        return text
+
+
+def _compress(source, destination):
+    with open(source, 'rb') as f_in, gzip.open(destination, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _file_handler(filename):
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(filename, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS,
+                                                            encoding='utf-8')
+    else:
+        handler = logging.handlers.RotatingFileHandler(filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                                       encoding='utf-8')
+    if LOG_COMPRESS:
+        handler.namer = lambda name: name + '.gz'
+        handler.rotator = _compress
+    return handler
+
+
+def setup(filename, level, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s'):
+    # Вместо logging.basicConfig; вызывается после load_dotenv, чтобы маскировать секреты из .env
+    global _listener, _queue
+    handler = _file_handler(filename)
+    secrets = [os.getenv(name) for name in SECRET_VARS] if LOG_REDACT else []
+    handler.setFormatter(RedactingFormatter(fmt, secrets) if LOG_REDACT else logging.Formatter(fmt))
+    _queue = queue.Queue(LOG_QUEUE)
+    queue_handler = _QueueHandler(_queue)
+    queue_handler.addFilter(_DebugSampler(LOG_DEBUG_SAMPLE))
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL or level)
+    root.addHandler(queue_handler)
+    for entry in filter(None, LOG_LEVELS.split(',')):
+        name, sep, name_level = entry.partition('=')
+        if sep:
+            logging.getLogger(name.strip()).setLevel(name_level.strip().upper())
+    _listener = _QueueListener(_queue, handler, respect_handler_level=True)
+    _listener.start()
+    # Недописанные записи сбрасываются в файл при выходе
+    atexit.register(shutdown)
+
+
+def shutdown():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_stats():
+    result = dict(stats)
+    result.update(queued=_queue.qsize() if _queue is not None else 0, max=LOG_QUEUE)
+    return result
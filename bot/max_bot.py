@@ -1,18 +1,35 @@
 import logging
+import logsetup
 import re
-import paramiko
 import os
-import psycopg2
-import subprocess
-
-from psycopg2 import Error
+import asyncio
+import cache
+import extract
+import documents
+import normalize
+import packages
+import limits
+import delivery
+import fleet
+import metrics
+import webhook
+import ssh_client
+import postgres
+import replog
+import sampler
+import state
+import sysinfo
+
+from asyncpg import PostgresError as Error
 from dotenv import load_dotenv
-from telegram import Update, ForceReply
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler
+from telegram import Update, ForceReply, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
 
 load_dotenv()
 
 token = os.getenv('TOKEN')
+telegramApiUrl = os.getenv('TELEGRAM_API_URL')
+DOC_PREVIEW = int(os.getenv('DOC_PREVIEW', '20'))
 
 RM_HOST = os.getenv('RM_HOST')
 RM_PORT = os.getenv('RM_PORT')
@@ -30,312 +47,607 @@ DB_REPL_HOST = os.getenv('DB_REPL_HOST')
 DB_REPL_PORT = os.getenv('DB_REPL_PORT')
 DB_DATABASE = os.getenv('DB_DATABASE')
 
-# Подключаем логирование
-logging.basicConfig(
-    filename='logfile.txt', format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO, encoding="utf-8"
-)
+# Подключаем логирование: запись в файл идет в фоновом потоке, см. logsetup
+logsetup.setup('logfile.txt', logging.INFO)
 
 logger = logging.getLogger(__name__)
 
 # Инициализируем нужные функции
-def start(update: Update, context):
+async def start(update: Update, context):
     user = update.effective_user
-    update.message.reply_text(f'Привет, {user.full_name}!')
+    await update.message.reply_text(f'Привет, {user.full_name}!')
 
-def helpCommand(update: Update, context):
-    update.message.reply_text('Help!')
+async def helpCommand(update: Update, context):
+    await update.message.reply_text('Help!')
 
-def findEmailsCommand(update: Update, context):
-    update.message.reply_text('Введите текст для поиска email-адресов: ')
+async def findEmailsCommand(update: Update, context):
+    await update.message.reply_text('Введите текст для поиска email-адресов или отправьте файл: ')
     return 'findEmails'
 
-def findPhoneNumbersCommand(update: Update, context):
-    update.message.reply_text('Введите текст для поиска телефонных номеров: ')
+async def findPhoneNumbersCommand(update: Update, context):
+    await update.message.reply_text('Введите текст для поиска телефонных номеров или отправьте файл: ')
     return 'findPhoneNumbers'
 
-def verifyPasswordCommand(update: Update, context):
-    update.message.reply_text('Введите пароль для проверки сложности: ')
+async def verifyPasswordCommand(update: Update, context):
+    await update.message.reply_text('Введите пароль для проверки сложности: ')
     return 'verifyPassword'
 
-def findEmails(update: Update, context):
+async def findEmails(update: Update, context):
     user_input = update.message.text
-    emailRegex = re.compile(
-        r'(?<!\S)(?:[A-Za-z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.(?!$)[A-Za-z0-9!#$%&\'*+/=?^_`{|}~-]+)*|'
-        r'"(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])*")@'
-        r'(?:[A-Za-z0-9](?:[A-Za-z0-9-]*[A-Za-z0-9])?\.)+[A-Za-z]{2,}'
-    )
-    emailList = emailRegex.findall(user_input)
+    result = extract.EMAIL_RFC.scan(user_input)
+    emailList = result.matches
+    if result.truncated:
+        await update.message.reply_text(extract.describe_truncation(result))
 
     if not emailList:
-        update.message.reply_text('Email-адреса не найдены')
+        await update.message.reply_text('Email-адреса не найдены')
         return ConversationHandler.END
 
     emails = ''
     for i, email in enumerate(emailList):
         emails += f'{i+1}. {email}\n'
 
-    update.message.reply_text(emails)
+    await delivery.send_text(update, emails, 'emails.txt')
 
-    update.message.reply_text('Хотите сохранить найденные email-адреса в базе данных? (да/нет)')
+    await update.message.reply_text('Хотите сохранить найденные email-адреса в базе данных? (да/нет)')
     context.user_data['emails'] = emailList
     return 'saveEmails'
 
-def findPhoneNumbers(update: Update, context):
+async def findPhoneNumbers(update: Update, context):
     user_input = update.message.text
-    phoneNumRegex = re.compile(r'((?:\+7|8)[- ]?(?:\(\d{3}\)|\d{3})[- ]?\d{3}[- ]?\d{2}[- ]?\d{2})\b')
-    phoneNumberList = phoneNumRegex.findall(user_input)
+    result = extract.PHONE_FULL.scan(user_input)
+    phoneNumberList = result.matches
+    if result.truncated:
+        await update.message.reply_text(extract.describe_truncation(result))
 
     if not phoneNumberList:
-        update.message.reply_text('Телефонные номера не найдены')
+        await update.message.reply_text('Телефонные номера не найдены')
         return ConversationHandler.END
 
     phoneNumbers = ''
     for i, phoneNumber in enumerate(phoneNumberList):
         phoneNumbers += f'{i+1}. {phoneNumber}\n'
-    update.message.reply_text(phoneNumbers)
+    await delivery.send_text(update, phoneNumbers, 'phone_numbers.txt')
 
-    update.message.reply_text('Хотите сохранить найденные номера телефонов в базе данных? (да/нет)')
+    await update.message.reply_text('Хотите сохранить найденные номера телефонов в базе данных? (да/нет)')
     context.user_data['phone_numbers'] = phoneNumberList
 
     return 'savePhoneNumbers'
 
-def saveEmails(update: Update, context):
-    user_response = update.message.text.lower()
-    emailList = context.user_data.get('emails', [])
+async def scanDocument(update: Update, extractor):
+    # Поиск в присланном файле; None, если файл не удалось прочитать
+    await update.message.reply_text('Файл получен, идет поиск...')
+    try:
+        return await documents.scan_document(await update.message.document.get_file(), extractor)
+    except Exception as error:
+        logging.error("Ошибка при поиске в файле: %s", error)
+        await update.message.reply_text('Не удалось прочитать файл')
+        return None
+
+@limits.limited('local')
+async def findEmailsDocument(update: Update, context):
+    scan = await scanDocument(update, extract.EMAIL_RFC)
+    if scan is None:
+        return ConversationHandler.END
+    if not scan.results:
+        await update.message.reply_text(f'{documents.describe(scan)}\nEmail-адреса не найдены')
+        return ConversationHandler.END
+
+    emails = ''
+    for i, email in enumerate(scan.results[:DOC_PREVIEW]):
+        emails += f'{i+1}. {email}\n'
+    await update.message.reply_text(f'{documents.describe(scan)}\n\n{emails}')
+    await update.message.reply_document(documents.results_file(scan.results), filename='emails.txt')
 
-    if user_response == 'да':
-        for email in enumerate(emailList):
-            db("INSERT INTO email_table (email) VALUES ('" + str(email[1]) + "');", DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE, 'insert')
+    await update.message.reply_text('Хотите сохранить найденные email-адреса в базе данных? (да/нет)')
+    context.user_data['emails'] = scan.results
+    return 'saveEmails'
 
-        update.message.reply_text('Email-адреса успешно сохранены в базе данных')
-    else:
-        update.message.reply_text('Email-адреса не будут сохранены в базе данных')
+@limits.limited('local')
+async def findPhoneNumbersDocument(update: Update, context):
+    scan = await scanDocument(update, extract.PHONE_FULL)
+    if scan is None:
+        return ConversationHandler.END
+    if not scan.results:
+        await update.message.reply_text(f'{documents.describe(scan)}\nТелефонные номера не найдены')
+        return ConversationHandler.END
 
-    return ConversationHandler.END
+    phoneNumbers = ''
+    for i, phoneNumber in enumerate(scan.results[:DOC_PREVIEW]):
+        phoneNumbers += f'{i+1}. {phoneNumber}\n'
+    await update.message.reply_text(f'{documents.describe(scan)}\n\n{phoneNumbers}')
+    await update.message.reply_document(documents.results_file(scan.results), filename='phone_numbers.txt')
 
-def savePhoneNumbers(update: Update, context):
+    await update.message.reply_text('Хотите сохранить найденные номера телефонов в базе данных? (да/нет)')
+    context.user_data['phone_numbers'] = scan.results
+    return 'savePhoneNumbers'
+
+@limits.limited('db')
+async def saveEmails(update: Update, context):
     user_response = update.message.text.lower()
-    phoneNumberList = context.user_data.get('phone_numbers', [])
+    # Результаты поиска больше не нужны: убираем их из user_data при любом ответе
+    emailList = normalize.normalize_all(context.user_data.pop('emails', []), normalize.email)
+
+    if user_response == 'да' and not emailList:
+        await update.message.reply_text('Результаты поиска устарели, повторите /find_email')
+    elif user_response == 'да':
+        inserted = await db_insert('email_table', 'email', emailList)
+        if inserted is not None:
+            await update.message.reply_text(f'Email-адреса успешно сохранены в базе данных (новых: {inserted})')
+        else:
+            await update.message.reply_text('Ошибка при работе с PostgreSQL')
+    else:
+        await update.message.reply_text('Email-адреса не будут сохранены в базе данных')
 
-    if user_response == 'да':
-        for phoneNumber in enumerate(phoneNumberList):
-            db("INSERT INTO phone_table (phone_number) VALUES ('" + str(phoneNumber[1]) + "');", DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE, 'insert')
+    return ConversationHandler.END
 
-        update.message.reply_text('Номера телефонов успешно сохранены в базе данных')
+@limits.limited('db')
+async def savePhoneNumbers(update: Update, context):
+    user_response = update.message.text.lower()
+    # Результаты поиска больше не нужны: убираем их из user_data при любом ответе
+    phoneNumberList = normalize.normalize_all(context.user_data.pop('phone_numbers', []), normalize.phone)
+
+    if user_response == 'да' and not phoneNumberList:
+        await update.message.reply_text('Результаты поиска устарели, повторите /find_phone_number')
+    elif user_response == 'да':
+        inserted = await db_insert('phone_table', 'phone_number', phoneNumberList)
+        if inserted is not None:
+            await update.message.reply_text(f'Номера телефонов успешно сохранены в базе данных (новых: {inserted})')
+        else:
+            await update.message.reply_text('Ошибка при работе с PostgreSQL')
     else:
-        update.message.reply_text('Номера телефонов не будут сохранены в базе данных')
+        await update.message.reply_text('Номера телефонов не будут сохранены в базе данных')
 
     return ConversationHandler.END
 
-def verifyPassword(update: Update, context):
+passwordRegex = re.compile(r'^(?=.*[A-Z])(?=.*[a-z])(?=.*\d)(?=.*[!@#$%^&*()])[A-Za-z\d!@#$%^&*()]{8,}$')
+
+async def verifyPassword(update: Update, context):
     user_input = update.message.text
-    passwordRegex = re.compile(r'^(?=.*[A-Z])(?=.*[a-z])(?=.*\d)(?=.*[!@#$%^&*()])[A-Za-z\d!@#$%^&*()]{8,}$')
     if passwordRegex.match(user_input):
-        update.message.reply_text('Пароль сложный')
+        await update.message.reply_text('Пароль сложный')
     else:
-        update.message.reply_text('Пароль простой')
+        await update.message.reply_text('Пароль простой')
     return ConversationHandler.END
 
-def get_app_list_all(update: Update, context):
-    update.message.reply_text(linux('dpkg -l | head -n 11', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
+# Каталог пакетов хоста в памяти: поиск и листание без обращения к хосту, кроме проверки базы dpkg
+packageCatalog = packages.Catalog(RM_HOST, RM_PORT, RM_USER, RM_PASSWORD)
+
+async def sendPackages(update: Update, query: str):
+    try:
+        await packageCatalog.refresh()
+    except (Exception, Error) as error:
+        logging.error("Ошибка при загрузке списка пакетов: %s", error)
+        await update.message.reply_text('Не удалось установить соединение')
+        return
+    package = packageCatalog.packages.get(query)
+    if package is not None:
+        await delivery.send_text(update, packages.describe(package))
+        if len(packageCatalog.search(query)) == 1:
+            return
+    text, markup = packages.render_page(packageCatalog, query)
+    await update.message.reply_text(text, reply_markup=markup)
+
+@limits.limited('ssh')
+async def get_app_list_all(update: Update, context):
+    await sendPackages(update, '')
     return ConversationHandler.END
 
-def get_app_list_one(update: Update, context):
-    update.message.reply_text('Введите название пакета для поиска информации: ')
+async def get_app_list_one(update: Update, context):
+    await update.message.reply_text('Введите название пакета или его часть: ')
     return 'get_app_info'
 
-def get_app_info(update: Update, context):
-    package_name = update.message.text.strip()
-    app_info = linux(f'dpkg -s {package_name}', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT)
-    update.message.reply_text(app_info)
+async def findPackages(update: Update, words):
+    query = packages.parse_query(words)
+    if query is None:
+        await update.message.reply_text(f'Слишком длинный запрос, не больше {packages.MAX_QUERY_BYTES} байт')
+    else:
+        await sendPackages(update, query)
     return ConversationHandler.END
 
-def get_app_list_command(update: Update, context):
-    update.message.reply_text('Введите 1, если хотите видеть информацию о первых 10 установленных пакетах; введите 2, если хотите видеть информацию о конкретном пакете: ')
+@limits.limited('ssh')
+async def get_app_info(update: Update, context):
+    return await findPackages(update, update.message.text.split())
+
+@limits.limited('ssh')
+async def get_app_list_command(update: Update, context):
+    # /get_apt_list <запрос> - сразу поиск, без вопросов
+    if context.args:
+        return await findPackages(update, context.args)
+    await update.message.reply_text('Введите 1, если хотите видеть список установленных пакетов; введите 2, если хотите найти пакет по названию: ')
     return 'get_app_list_choice'
 
-def get_app_list_choice(update: Update, context):
+async def package_page_button(update: Update, context):
+    query = update.callback_query
+    _, offset, search = query.data.split(':', 2)
+    text, markup = packages.render_page(packageCatalog, search, int(offset))
+    await query.answer()
+    await query.edit_message_text(text, reply_markup=markup)
+
+async def get_app_list_choice(update: Update, context):
     user_input = update.message.text
     if user_input == '1':
-        return get_app_list_all(update, context)
+        return await get_app_list_all(update, context)
     elif user_input == '2':
-        return get_app_list_one(update, context)
-    update.message.reply_text('Неверный ввод')
+        return await get_app_list_one(update, context)
+    await update.message.reply_text('Неверный ввод')
     return ConversationHandler.END
 
-def echo(update: Update, context):
-    update.message.reply_text(update.message.text)
+async def echo(update: Update, context):
+    await update.message.reply_text(update.message.text)
 
-def linux(command: str, host: str, username: str, password: str, port: str):
+async def linux(command: str, host: str, username: str, password: str, port: str):
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(hostname=host, username=username, password=password, port=port)
-        stdin, stdout, stderr = client.exec_command(command)
-        data = stdout.read() + stderr.read()
-        client.close()
-        data = str(data).replace('\\n', '\n').replace('\\t', '\t')[2:-1]
+        # Подключение к хосту общее для всех команд, на каждую команду открывается только новый канал
+        session = ssh_client.get_session(host, port, username, password)
+
+        async def run():
+            # stdout и stderr в порядке поступления, уже декодированные
+            result = await session.exec_stream(command)
+            return result.output + result.notice()
+
+        # Редко меняющиеся выводы (версия, пакеты, службы) берутся из кэша
+        data, age = await cache.ssh_cache.get_or_load((host, command), run, cache.ttl_for(command))
         logging.info("Команда успешно выполнена")
-        return data
+        return cache.format_age(data, age)
     except (Exception, Error) as error:
         logging.error("Ошибка при работе с Linux: %s", error)
         return "Не удалось установить соединение"
 
-def db(command: str, username: str, password: str, host: str, port: str, database: str, type: str):
-    connection = None
-    result = ''
-
+async def streamLinux(update: Update, command: str):
+    # Некэшируемые команды: вывод отправляется по мере поступления, а не после завершения команды
+    stream = delivery.Stream(update)
     try:
-        connection = psycopg2.connect(user=username, password=password, host=host, port=port, database=database)
-        cursor = connection.cursor()
-        cursor.execute(command)
-        if type == 'select':
-            data = cursor.fetchall()
-            for row in data:
-                result += str(row[0]) + '. ' + str(row[1]) + '\n'
-                logging.info("Команда успешно выполнена")
-        elif type == 'insert':
-            connection.commit()
+        session = ssh_client.get_session(RM_HOST, RM_PORT, RM_USER, RM_PASSWORD)
+        result = await session.exec_stream(command, stream.write)
+        await stream.write(result.notice())
         logging.info("Команда успешно выполнена")
-        logging.info(result)
+    except (Exception, Error) as error:
+        logging.error("Ошибка при работе с Linux: %s", error)
+        await stream.write("\nНе удалось установить соединение")
+    await stream.close()
+
+# Фоновый опрос хоста: /get_free и /get_df отвечают по последнему образцу, /history - по накопленным данным
+hostSampler = sampler.Sampler(
+    RM_HOST, RM_PORT, RM_USER, RM_PASSWORD,
+    pool=lambda: postgres.get_pool(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE),
+    router=lambda: postgres.get_router(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE, DB_REPL_HOST, DB_REPL_PORT))
+
+async def viewLinux(view, args):
+    # Компактный вывод с параметрами вида --over 80% (проверены в fleet.multi_host); фильтры по возможности
+    # выполняются на хосте, свежий образец фонового опроса фильтруется локально
+    positional, options = view.parse_args(args)
+    sample = hostSampler.latest(view.command())
+    if sample is not None:
+        return sampler.format_sample(view.render(sample[0], options), sample[1])
+    return view.render(await linux(view.command(options), RM_HOST, RM_USER, RM_PASSWORD, RM_PORT), options)
+
+async def db_insert(table: str, column: str, values: list):
+    # Все значения записываются одним запросом в одной транзакции, повторы пропускаются.
+    # Возвращает число новых строк или None при ошибке
+    try:
+        pool = postgres.get_pool(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE)
+        inserted = await postgres.bulk_insert(pool, table, column, values)
+        logging.info("Команда успешно выполнена")
+        return inserted
     except (Exception, Error) as error:
         logging.error("Ошибка при работе с PostgreSQL: %s", error)
-        return "Ошибка при работе с PostgreSQL"
-    finally:
-        if connection is not None:
-            cursor.close()
-            connection.close()
-        if result:
-            return result
-        return "Ошибка при работе с PostgreSQL"
-
-def get_emails(update: Update, context):
-    update.message.reply_text(db('SELECT * FROM email_table;', DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE, 'select'))
-
-def get_phone_numbers(update: Update, context):
-    update.message.reply_text(db('SELECT * FROM phone_table;', DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE, 'select'))
-
-def get_release(update: Update, context):
-    update.message.reply_text(linux('cat /proc/version', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_uname(update: Update, context):
-    update.message.reply_text(linux('uname -o -n -r -v -p', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_uptime(update: Update, context):
-    update.message.reply_text(linux('uptime', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_df(update: Update, context):
-    update.message.reply_text(linux('df -a -h', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_free(update: Update, context):
-    update.message.reply_text(linux('free -h', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_mpstat(update: Update, context):
-    update.message.reply_text(linux('mpstat -P ALL', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_w(update: Update, context):
-    update.message.reply_text(linux('w', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_auths(update: Update, context):
-    update.message.reply_text(linux('last -n 10', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_critical(update: Update, context):
-    update.message.reply_text(linux('journalctl -p crit -n 5', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_ps(update: Update, context):
-    update.message.reply_text(linux('ps -A | head -n 11', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
+        return None
 
-def get_ss(update: Update, context):
-    update.message.reply_text(linux('ss -s', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
+# Листаемые таблицы: ключ callback_data -> (таблица, колонка)
+pagedTables = {'emails': ('email_table', 'email'), 'phones': ('phone_table', 'phone_number')}
 
-def get_services(update: Update, context):
-    update.message.reply_text(linux('systemctl list-units --type=service | head -n 10', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
-
-def get_repl_logs(update: Update, context): 
+async def db_page(kind: str, after_id=None, before_id=None):
+    table, column = pagedTables[kind]
     try:
-	# docker
-        # command = "cat /var/log/postgresql/postgresql-15-main.log | grep repl | tail -n 20"
-        # ansible 
-        command = "cat /var/log/postgresql/postgresql-14-main.log | grep repl | tail -n 20"
+        # Листание - только чтение, поэтому идет на реплику, пока она не отстала
+        router = postgres.get_router(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE, DB_REPL_HOST, DB_REPL_PORT)
+        rows, has_prev, has_next = await router.read(postgres.fetch_page, table, column, after_id, before_id)
+    except (Exception, Error) as error:
+        logging.error("Ошибка при работе с PostgreSQL: %s", error)
+        return "Ошибка при работе с PostgreSQL", None
 
-        result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        update.message.reply_text(result.stdout, result.stderr)
-    except subprocess.CalledProcessError as e:
-        update.message.reply_text(e.stdout, e.stderr)
+    # Строки не разрезаются: то, что не влезло в сообщение, попадет на следующую страницу
+    result = ''
+    for i, row in enumerate(rows):
+        line = str(row[0]) + '. ' + str(row[1]) + '\n'
+        if result and len(result) + len(line) > 4096:
+            rows = rows[:i]
+            has_next = True
+            break
+        result += line
+
+    buttons = []
+    if rows and has_prev:
+        buttons.append(InlineKeyboardButton('<<', callback_data=f'{kind}:prev:{rows[0][0]}'))
+    if rows and has_next:
+        buttons.append(InlineKeyboardButton('>>', callback_data=f'{kind}:next:{rows[-1][0]}'))
+    return result or 'Записей нет', InlineKeyboardMarkup([buttons]) if buttons else None
+
+lookupTables = {'email': ('email_table', 'email'), 'phone': ('phone_table', 'phone_number')}
+
+@limits.limited('db')
+async def lookup(update: Update, context):
+    # /lookup <email или телефон> - поиск по уникальному индексу
+    detected = normalize.detect(' '.join(context.args)) if context.args else None
+    if detected is None:
+        await update.message.reply_text('Использование: /lookup <email или номер телефона>')
+        return
+    kind, value = detected
+    try:
+        router = postgres.get_router(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE, DB_REPL_HOST, DB_REPL_PORT)
+        rowId = await router.read(postgres.find_id, *lookupTables[kind], value)
+    except (Exception, Error) as error:
+        logging.error("Ошибка при работе с PostgreSQL: %s", error)
+        await update.message.reply_text('Ошибка при работе с PostgreSQL')
+        return
+    if rowId is None:
+        await update.message.reply_text(f'{value} не найден в базе данных')
+    else:
+        await update.message.reply_text(f'{value} есть в базе данных (id {rowId})')
+
+@limits.limited('db')
+async def get_emails(update: Update, context):
+    text, markup = await db_page('emails')
+    await update.message.reply_text(text, reply_markup=markup)
+
+@limits.limited('db')
+async def get_phone_numbers(update: Update, context):
+    text, markup = await db_page('phones')
+    await update.message.reply_text(text, reply_markup=markup)
+
+@limits.limited('db')
+async def db_page_button(update: Update, context):
+    query = update.callback_query
+    kind, direction, key = query.data.split(':')
+    if direction == 'next':
+        text, markup = await db_page(kind, after_id=int(key))
+    else:
+        text, markup = await db_page(kind, before_id=int(key))
+    await query.answer()
+    await query.edit_message_text(text, reply_markup=markup)
+
+@limits.limited('ssh')
+@fleet.multi_host('cat /proc/version')
+async def get_release(update: Update, context):
+    await delivery.send_text(update, await linux('cat /proc/version', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
+
+@limits.limited('ssh')
+@fleet.multi_host('uname -o -n -r -v -p')
+async def get_uname(update: Update, context):
+    await delivery.send_text(update, await linux('uname -o -n -r -v -p', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
+
+@limits.limited('ssh')
+@fleet.multi_host('uptime')
+async def get_uptime(update: Update, context):
+    await streamLinux(update, 'uptime')
+
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.DF)
+async def get_df(update: Update, context):
+    await delivery.send_text(update, await viewLinux(sysinfo.DF, context.args))
+
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.FREE)
+async def get_free(update: Update, context):
+    await delivery.send_text(update, await viewLinux(sysinfo.FREE, context.args))
+
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.MPSTAT)
+async def get_mpstat(update: Update, context):
+    await delivery.send_text(update, await viewLinux(sysinfo.MPSTAT, context.args))
+
+@limits.limited('ssh')
+@fleet.multi_host('w')
+async def get_w(update: Update, context):
+    await streamLinux(update, 'w')
+
+@limits.limited('ssh')
+@fleet.multi_host('last -n 10')
+async def get_auths(update: Update, context):
+    await streamLinux(update, 'last -n 10')
+
+@limits.limited('ssh')
+@fleet.multi_host('journalctl -p crit -n 5')
+async def get_critical(update: Update, context):
+    await streamLinux(update, 'journalctl -p crit -n 5')
+
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.PS)
+async def get_ps(update: Update, context):
+    await delivery.send_text(update, await viewLinux(sysinfo.PS, context.args))
+
+@limits.limited('ssh')
+@fleet.multi_host(sysinfo.SS)
+async def get_ss(update: Update, context):
+    await delivery.send_text(update, await viewLinux(sysinfo.SS, context.args))
+
+@limits.limited('ssh')
+@fleet.multi_host('systemctl list-units --type=service | head -n 10')
+async def get_services(update: Update, context):
+    await delivery.send_text(update, await linux('systemctl list-units --type=service | head -n 10', RM_HOST, RM_USER, RM_PASSWORD, RM_PORT))
+
+@limits.limited('ssh')
+async def get_status(update: Update, context):
+    # uptime, память, диски, процессор и сокеты одним ответом; команды выполняются параллельно
+    probes = {'uptime': 'uptime', 'free': 'free -h', 'df': 'df -h', 'mpstat': 'mpstat -P ALL', 'ss': 'ss -s'}
+    try:
+        session = ssh_client.get_session(RM_HOST, RM_PORT, RM_USER, RM_PASSWORD)
+        results = await ssh_client.exec_parallel(session, probes, timeout=30)
+    except (Exception, Error) as error:
+        logging.error("Ошибка при работе с Linux: %s", error)
+        await update.message.reply_text('Не удалось установить соединение')
+        return
+
+    status = ''
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            logging.error("Ошибка при работе с Linux: %s", result)
+            output = 'Не удалось выполнить команду'
+        else:
+            output = (result[0] + result[1]).decode(errors='replace').strip()
+        status += f'[{name}]\n{output}\n\n'
+    await delivery.send_text(update, status, 'status.txt')
+
+async def get_hosts(update: Update, context):
+    await delivery.send_text(update, fleet.describe_inventory())
+
+async def refresh(update: Update, context):
+    prefix = ' '.join(context.args)
+    count = cache.ssh_cache.invalidate(lambda key: key[1].startswith(prefix))
+    await update.message.reply_text(f'Сброшено записей кэша: {count}')
+
+@limits.limited('db')
+async def get_history(update: Update, context):
+    # /history free 6h - min/avg/max за период по данным фонового опроса, без обращения к хосту
+    if not context.args or context.args[0] not in sampler.GROUPS or len(context.args) > 2:
+        await update.message.reply_text(f"Использование: /history <{'|'.join(sampler.GROUPS)}> [период, например 6h]")
+        return
+    group = context.args[0]
+    window = context.args[1] if len(context.args) > 1 else '1h'
+    try:
+        totals = await hostSampler.history(group, sampler.parse_window(window))
+    except ValueError as error:
+        await update.message.reply_text(f'Ошибка: {error}')
+        return
+    except (Exception, Error) as error:
+        logging.error("Ошибка при чтении истории метрик: %s", error)
+        await update.message.reply_text('Не удалось получить историю метрик')
+        return
+    await delivery.send_text(update, sampler.format_history(group, window, totals), 'history.txt')
+
+# docker: /var/log/postgresql/postgresql-15-main.log
+# ansible: /var/log/postgresql/postgresql-14-main.log
+replLog = replog.LogTail(os.getenv('REPL_LOG_PATH', '/var/log/postgresql/postgresql-14-main.log'), 'repl', 20,
+                         state_path=os.getenv('REPL_LOG_STATE', 'repl_log_state.json'))
+
+@limits.limited('local')
+async def get_repl_logs(update: Update, context): 
+    try:
+        # Лог читается с конца и дальше только по приросту, а не целиком через cat | grep
+        logs = await asyncio.to_thread(replLog.read)
+        await delivery.send_text(update, logs or 'Записи о репликации не найдены', 'repl_logs.txt')
+    except OSError as error:
+        logging.error("Ошибка при чтении лога репликации: %s", error)
+        await update.message.reply_text('Не удалось прочитать лог репликации')
+
+async def on_startup(application):
+    application.bot_data['metrics_server'] = await metrics.start_server()
+    if hostSampler.enabled():
+        application.bot_data['sampler'] = asyncio.create_task(hostSampler.run())
+    application.bot_data['state_sweeper'] = asyncio.create_task(state.run(application))
+    application.bot_data['packages'] = asyncio.create_task(packageCatalog.preload())
+
+async def on_shutdown(application):
+    for name in ('sampler', 'state_sweeper', 'packages'):
+        task = application.bot_data.get(name)
+        if task is not None:
+            task.cancel()
+    server = application.bot_data.get('metrics_server')
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    ssh_client.close_all()
+    await postgres.close_all()
 
 def main():
-    updater = Updater(token, use_context=True)
-
-    # Получаем диспетчер для регистрации обработчиков
-    dp = updater.dispatcher
+    builder = Application.builder().token(token).post_init(on_startup).post_shutdown(on_shutdown)
+    # Запросы к Bot API замеряются для метрик (фаза telegram_send)
+    builder = builder.request(metrics.TimedRequest(connection_pool_size=256))
+    if telegramApiUrl:
+        # Свой Bot API сервер (--local) снимает ограничение в 20 МБ на скачивание файлов
+        builder = builder.base_url(f'{telegramApiUrl}/bot').base_file_url(f'{telegramApiUrl}/file/bot').local_mode(True)
+    # WEBHOOK_URL включает прием обновлений через webhook вместо long polling
+    builder = webhook.configure(builder)
+    # user_data и незавершенные диалоги: ограниченное хранилище в памяти, SQLite или PostgreSQL (STATE_BACKEND)
+    builder = state.configure(builder, 'max_bot', lambda: postgres.get_pool(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE))
+    application = builder.build()
 
     # Обработчики диалога
     convHandlerFindEmails = ConversationHandler(
         entry_points=[CommandHandler('find_email', findEmailsCommand)],
         states={
-            'findEmails': [MessageHandler(Filters.text & ~Filters.command, findEmails)],
-            'saveEmails': [MessageHandler(Filters.text & ~Filters.command, saveEmails)]
+            'findEmails': [MessageHandler(filters.TEXT & ~filters.COMMAND, findEmails),
+                           MessageHandler(filters.Document.ALL, findEmailsDocument)],
+            'saveEmails': [MessageHandler(filters.TEXT & ~filters.COMMAND, saveEmails)]
         },
-        fallbacks=[]
+        fallbacks=[],
+        name='find_email',
+        persistent=True
     )
 
     convHandlerFindPhoneNumbers = ConversationHandler(
         entry_points=[CommandHandler('find_phone_number', findPhoneNumbersCommand)],
         states={
-            'findPhoneNumbers': [MessageHandler(Filters.text & ~Filters.command, findPhoneNumbers)],
-            'savePhoneNumbers':  [MessageHandler(Filters.text & ~Filters.command, savePhoneNumbers)]
+            'findPhoneNumbers': [MessageHandler(filters.TEXT & ~filters.COMMAND, findPhoneNumbers),
+                                 MessageHandler(filters.Document.ALL, findPhoneNumbersDocument)],
+            'savePhoneNumbers':  [MessageHandler(filters.TEXT & ~filters.COMMAND, savePhoneNumbers)]
         },
-        fallbacks=[]
+        fallbacks=[],
+        name='find_phone_number',
+        persistent=True
     )
 
     convHandlerVerifyPassword = ConversationHandler(
         entry_points=[CommandHandler('verify_password', verifyPasswordCommand)],
         states={
-            'verifyPassword': [MessageHandler(Filters.text & ~Filters.command, verifyPassword)],
+            'verifyPassword': [MessageHandler(filters.TEXT & ~filters.COMMAND, verifyPassword)],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name='verify_password',
+        persistent=True
     )
 
     convHandlerAppList = ConversationHandler(
         entry_points=[CommandHandler('get_apt_list', get_app_list_command)],
         states={
-            'get_app_list_choice': [MessageHandler(Filters.text & ~Filters.command, get_app_list_choice)],
-            'get_app_info': [MessageHandler(Filters.text & ~Filters.command, get_app_info)],
+            'get_app_list_choice': [MessageHandler(filters.TEXT & ~filters.COMMAND, get_app_list_choice)],
+            'get_app_info': [MessageHandler(filters.TEXT & ~filters.COMMAND, get_app_info)],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name='get_apt_list',
+        persistent=True
     )
 
-	# Регистрируем обработчики команд
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("get_release", get_release))
-    dp.add_handler(CommandHandler("get_uname", get_uname))
-    dp.add_handler(CommandHandler("get_uptime", get_uptime))
-    dp.add_handler(CommandHandler("get_df", get_df))
-    dp.add_handler(CommandHandler("get_free", get_free))
-    dp.add_handler(CommandHandler("get_mpstat", get_mpstat))
-    dp.add_handler(CommandHandler("get_w", get_w))
-    dp.add_handler(CommandHandler("get_auths", get_auths))
-    dp.add_handler(CommandHandler("get_critical", get_critical))
-    dp.add_handler(CommandHandler("get_ps", get_ps))
-    dp.add_handler(CommandHandler("get_ss", get_ss))
-    dp.add_handler(CommandHandler("get_services", get_services))
-    dp.add_handler(CommandHandler("get_repl_logs", get_repl_logs))
-    dp.add_handler(CommandHandler("get_emails", get_emails))
-    dp.add_handler(CommandHandler("get_phone_numbers", get_phone_numbers))
-    dp.add_handler(CommandHandler("help", helpCommand))
-    dp.add_handler(convHandlerFindEmails)
-    dp.add_handler(convHandlerFindPhoneNumbers)
-    dp.add_handler(convHandlerVerifyPassword)
-    dp.add_handler(convHandlerAppList)
+	# Регистрируем обработчики команд; команды с SSH и БД выполняются фоновыми задачами (block=False)
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("get_release", get_release, block=False))
+    application.add_handler(CommandHandler("get_uname", get_uname, block=False))
+    application.add_handler(CommandHandler("get_uptime", get_uptime, block=False))
+    application.add_handler(CommandHandler("get_df", get_df, block=False))
+    application.add_handler(CommandHandler("get_free", get_free, block=False))
+    application.add_handler(CommandHandler("get_mpstat", get_mpstat, block=False))
+    application.add_handler(CommandHandler("get_w", get_w, block=False))
+    application.add_handler(CommandHandler("get_status", get_status, block=False))
+    application.add_handler(CommandHandler("get_auths", get_auths, block=False))
+    application.add_handler(CommandHandler("get_critical", get_critical, block=False))
+    application.add_handler(CommandHandler("get_ps", get_ps, block=False))
+    application.add_handler(CommandHandler("get_ss", get_ss, block=False))
+    application.add_handler(CommandHandler("get_services", get_services, block=False))
+    application.add_handler(CommandHandler("get_repl_logs", get_repl_logs, block=False))
+    application.add_handler(CommandHandler("get_emails", get_emails, block=False))
+    application.add_handler(CommandHandler("get_phone_numbers", get_phone_numbers, block=False))
+    application.add_handler(CommandHandler("lookup", lookup, block=False))
+    application.add_handler(CallbackQueryHandler(db_page_button, pattern=r'^(emails|phones):(prev|next):\d+$', block=False))
+    application.add_handler(CallbackQueryHandler(package_page_button, pattern=r'^packages:\d+:'))
+    application.add_handler(CommandHandler("help", helpCommand))
+    application.add_handler(CommandHandler("refresh", refresh))
+    application.add_handler(CommandHandler("hosts", get_hosts))
+    application.add_handler(CommandHandler("history", get_history, block=False))
+    application.add_handler(convHandlerFindEmails)
+    application.add_handler(convHandlerFindPhoneNumbers)
+    application.add_handler(convHandlerVerifyPassword)
+    application.add_handler(convHandlerAppList)
 
 	# Регистрируем обработчик текстовых сообщений
-    dp.add_handler(MessageHandler(Filters.text & ~Filters.command, echo))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
 
-	# Запускаем бота
-    updater.start_polling()
+	# Счетчики, задержки и число выполняющихся вызовов для всех обработчиков выше
+    metrics.instrument(application)
+    state.install(application)
 
-	# Останавливаем бота при нажатии Ctrl+C
-    updater.idle()
+	# Запускаем бота, остановка - Ctrl+C
+    webhook.run(application)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,206 @@
+import os
+import time
+import logging
+import functools
+import contextvars
+from bisect import bisect_left
+import httpd
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+
+logger = logging.getLogger(__name__)
+
+# Метрики отдаются по http://METRICS_HOST:METRICS_PORT/metrics в текстовом формате Prometheus;
+# METRICS_PORT=0 отключает сервер, счетчики при этом продолжают собираться
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '8000'))
+
+# Фазы обработки запроса, для каждой - отдельная гистограмма на обработчик
+PHASES = ('ssh_connect', 'ssh_exec', 'db_connect', 'db_query', 'telegram_send')
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    # Фиксированные границы: наблюдение - один bisect и два сложения
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последний - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class HandlerMetrics:
+    __slots__ = ('name', 'requests', 'errors', 'in_flight', 'duration', 'phases')
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.duration = Histogram()
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+
+class _Call:
+    # Текущий вызов обработчика; хранится в contextvar, поэтому фазы из ssh_client и postgres
+    # попадают в метрики того обработчика, в чьей задаче они выполнялись
+    __slots__ = ('handler', 'failed')
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.failed = False
+
+
+_handlers = {}
+# Фазы вне обработчиков: прогрев пула, проверка отставания реплики
+_background = HandlerMetrics('background')
+_current = contextvars.ContextVar('metrics_call', default=None)
+
+
+def get_handler(name):
+    handler = _handlers.get(name)
+    if handler is None:
+        handler = _handlers[name] = HandlerMetrics(name)
+    return handler
+
+
+def observe(phase, seconds):
+    call = _current.get()
+    handler = call.handler if call is not None else _background
+    handler.phases[phase].observe(seconds)
+
+
+class phase:
+    # with metrics.phase('db_query'): ... - время блока записывается в гистограмму фазы
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started)
+
+
+def instrumented(callback):
+    handler = get_handler(callback.__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        call = _Call(handler)
+        token = _current.set(call)
+        handler.requests += 1
+        handler.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except BaseException:
+            call.failed = True
+            raise
+        finally:
+            handler.duration.observe(time.perf_counter() - started)
+            handler.in_flight -= 1
+            if call.failed:
+                handler.errors += 1
+            _current.reset(token)
+    return wrapper
+
+
+class _ErrorFlag(logging.Handler):
+    # Обработчики сами ловят исключения и пишут их в лог с уровнем ERROR - такой вызов тоже считается ошибкой
+    def __init__(self):
+        super().__init__(logging.ERROR)
+
+    def emit(self, record):
+        call = _current.get()
+        if call is not None:
+            call.failed = True
+
+
+def _wrap_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            _wrap_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                _wrap_handlers(state_handlers)
+            _wrap_handlers(handler.fallbacks)
+        else:
+            handler.callback = instrumented(handler.callback)
+
+
+def instrument(application):
+    # Вызывается в main() после регистрации всех обработчиков
+    for handlers in application.handlers.values():
+        _wrap_handlers(handlers)
+    logging.getLogger().addHandler(_ErrorFlag())
+
+
+class TimedRequest(HTTPXRequest):
+    # Запросы к Bot API (кроме getUpdates) - фаза telegram_send
+    async def do_request(self, *args, **kwargs):
+        with phase('telegram_send'):
+            return await super().do_request(*args, **kwargs)
+
+
+def _histogram_lines(name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+    yield f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+    yield f'{name}_sum{{{labels}}} {histogram.sum}'
+    yield f'{name}_count{{{labels}}} {histogram.count}'
+
+
+def render():
+    handlers = sorted(_handlers.values(), key=lambda handler: handler.name)
+    lines = ['# HELP bot_handler_requests_total Handler calls.',
+             '# TYPE bot_handler_requests_total counter']
+    lines += [f'bot_handler_requests_total{{handler="{h.name}"}} {h.requests}' for h in handlers]
+    lines += ['# HELP bot_handler_errors_total Handler calls that raised or logged an error.',
+              '# TYPE bot_handler_errors_total counter']
+    lines += [f'bot_handler_errors_total{{handler="{h.name}"}} {h.errors}' for h in handlers]
+    lines += ['# HELP bot_handler_in_flight Handler calls in progress.',
+              '# TYPE bot_handler_in_flight gauge']
+    lines += [f'bot_handler_in_flight{{handler="{h.name}"}} {h.in_flight}' for h in handlers]
+    lines += ['# HELP bot_handler_duration_seconds Handler latency.',
+              '# TYPE bot_handler_duration_seconds histogram']
+    for h in handlers:
+        lines.extend(_histogram_lines('bot_handler_duration_seconds', f'handler="{h.name}"', h.duration))
+    lines += ['# HELP bot_phase_duration_seconds Time spent in SSH, database and Telegram calls per handler.',
+              '# TYPE bot_phase_duration_seconds histogram']
+    for h in handlers + [_background]:
+        for name, histogram in h.phases.items():
+            # Фазы, которых у обработчика не было, не выводим
+            if histogram.count:
+                lines.extend(_histogram_lines('bot_phase_duration_seconds',
+                                              f'handler="{h.name}",phase="{name}"', histogram))
+    return '\n'.join(lines) + '\n'
+
+
+async def _serve(request):
+    if request.method == 'GET' and request.path == '/metrics':
+        return httpd.Response(200, render(), 'text/plain; version=0.0.4; charset=utf-8')
+    return httpd.Response(404, 'Not found')
+
+
+async def start_server():
+    # Возвращает httpd.HTTPServer или None, если сервер отключен или порт занят
+    if not METRICS_PORT:
+        return None
+    try:
+        server = await httpd.start_server(_serve, METRICS_HOST, METRICS_PORT)
+    except OSError:
+        logger.warning(f"Could not start metrics server on {METRICS_HOST}:{METRICS_PORT}", exc_info=True)
+        return None
+    logger.info(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return server
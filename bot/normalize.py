@@ -0,0 +1,46 @@
+import re
+
+
+# Канонический вид значений перед записью в БД и поиском: одна и та же запись
+# в разном написании должна попадать в одну строку уникального индекса
+
+NON_DIGITS = re.compile(r'\D')
+
+
+def email(value):
+    value = value.strip().lower()
+    return value if '@' in value else None
+
+
+def phone(value):
+    # Российские номера в любом написании (8..., +7..., без кода страны) приводятся к E.164: +7XXXXXXXXXX.
+    # Номера с другим кодом страны принимаются только в виде +<код><номер>
+    if isinstance(value, (tuple, list)):
+        value = ''.join(value)
+    digits = NON_DIGITS.sub('', value)
+    if len(digits) == 10:
+        return '+7' + digits
+    if len(digits) == 11 and digits[0] in '78':
+        return '+7' + digits[1:]
+    if value.strip().startswith('+') and 8 <= len(digits) <= 15 and digits[0] != '0':
+        return '+' + digits
+    return None
+
+
+def normalize_all(values, normalizer):
+    # Канонические значения без повторов, в порядке первого появления; нераспознанные отбрасываются
+    result = {}
+    for value in values:
+        canonical = normalizer(value)
+        if canonical is not None:
+            result.setdefault(canonical, None)
+    return list(result)
+
+
+def detect(value):
+    # Для /lookup: ('email' | 'phone', каноническое значение) или None
+    if '@' in value:
+        canonical = email(value)
+        return ('email', canonical) if canonical else None
+    canonical = phone(value)
+    return ('phone', canonical) if canonical else None
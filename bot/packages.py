@@ -0,0 +1,224 @@
+import os
+import time
+import shlex
+import bisect
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import ssh_client
+
+
+logger = logging.getLogger(__name__)
+
+# Каталог установленных пакетов строится по базе dpkg хоста и хранится в памяти: поиск по имени
+# не обращается к хосту. Файл перечитывается, только когда у него меняется время изменения
+PACKAGES_STATUS_PATH = os.getenv('PACKAGES_STATUS_PATH', '/var/lib/dpkg/status')
+# Время изменения проверяется не чаще раза в PACKAGES_CHECK_INTERVAL секунд
+PACKAGES_CHECK_INTERVAL = float(os.getenv('PACKAGES_CHECK_INTERVAL', '60'))
+PACKAGES_PAGE_SIZE = int(os.getenv('PACKAGES_PAGE_SIZE', '30'))
+# Запрос передается в callback_data кнопок листания целиком, а она не длиннее 64 байт
+MAX_QUERY_BYTES = 40
+
+
+class Package:
+    __slots__ = ('name', 'version', 'architecture', 'section', 'installed_size', 'maintainer', 'description')
+
+    def __init__(self, name, version, architecture, section, installed_size, maintainer, description):
+        self.name = name
+        self.version = version
+        self.architecture = architecture
+        self.section = section
+        self.installed_size = installed_size  # КиБ или None
+        self.maintainer = maintainer
+        self.description = description
+
+    @property
+    def summary(self):
+        return self.description.split('\n', 1)[0]
+
+
+def _paragraphs(text):
+    # Записи разделены пустой строкой, строки продолжения начинаются с пробела
+    fields = {}
+    key = None
+    for line in text.splitlines():
+        if not line.strip():
+            if fields:
+                yield fields
+            fields = {}
+            key = None
+        elif line[0] in ' \t':
+            if key is not None:
+                fields[key] += '\n' + ('' if line.strip() == '.' else line.strip())
+        else:
+            key, _, value = line.partition(':')
+            fields[key] = value.strip()
+    if fields:
+        yield fields
+
+
+def parse_status(text):
+    # Только установленные пакеты; пакеты нескольких архитектур (libc6:i386) получают суффикс архитектуры
+    entries = []
+    for fields in _paragraphs(text):
+        if 'Package' not in fields or fields.get('Status', '').split()[-1:] != ['installed']:
+            continue
+        size = fields.get('Installed-Size', '')
+        entries.append(Package(fields['Package'], fields.get('Version', ''), fields.get('Architecture', ''),
+                               fields.get('Section', ''), int(size) if size.isdigit() else None,
+                               fields.get('Maintainer', ''), fields.get('Description', '')))
+    counts = {}
+    for package in entries:
+        counts[package.name] = counts.get(package.name, 0) + 1
+    packages = {}
+    for package in entries:
+        if counts[package.name] > 1:
+            package.name = f'{package.name}:{package.architecture}'
+        packages[package.name] = package
+    return packages
+
+
+class Catalog:
+    def __init__(self, host, port, username, password, path=PACKAGES_STATUS_PATH):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.path = path
+        self.packages = {}  # имя -> Package
+        self.mtime = None  # время изменения файла на хосте, по которому построен каталог
+        self.checked = None  # когда время изменения проверялось (monotonic)
+        self._names = []  # имена по алфавиту: поиск по префиксу - bisect
+        self._text = ''  # имена через \n: поиск подстроки - str.find по одной строке
+        self._offsets = []  # начало каждого имени в _text
+        self._lock = None
+        self.stats = {'checks': 0, 'refreshes': 0, 'errors': 0, 'parse_time': 0.0}
+
+    def _index(self, packages):
+        names = sorted(packages)
+        offsets = []
+        position = 0
+        for name in names:
+            offsets.append(position)
+            position += len(name) + 1
+        self.packages = packages
+        self._names = names
+        self._text = '\n'.join(names)
+        self._offsets = offsets
+
+    async def refresh(self, force=False):
+        # Вызывается перед каждым поиском; к хосту обращается не чаще раза в PACKAGES_CHECK_INTERVAL
+        if self._lock is None:
+            # Примитивы asyncio создаются внутри работающего цикла событий
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not force and self.checked is not None and time.monotonic() - self.checked < PACKAGES_CHECK_INTERVAL:
+                return
+            # Один запрос: время изменения и сам файл, только если оно не совпало с известным
+            path = shlex.quote(self.path)
+            command = (f'm=$(stat -c %Y {path}) && echo "$m" && '
+                       f'if [ "$m" != {shlex.quote(self.mtime or "")} ]; then cat {path}; fi')
+            try:
+                session = ssh_client.get_session(self.host, self.port, self.username, self.password)
+                stdout, stderr, exit_status = await session.exec_command(command)
+                if exit_status != 0:
+                    raise RuntimeError(stderr.decode(errors='replace').strip() or f'exit status {exit_status}')
+            except Exception as e:
+                self.stats['errors'] += 1
+                if not self.packages:
+                    raise
+                # Хост недоступен - отвечаем по уже загруженному каталогу и проверим снова через интервал
+                self.checked = time.monotonic()
+                logger.warning(f"Could not check package database, serving cached catalog: {str(e)}")
+                return
+            self.checked = time.monotonic()
+            self.stats['checks'] += 1
+            mtime, _, status = stdout.decode(errors='replace').partition('\n')
+            mtime = mtime.strip()
+            if mtime == self.mtime:
+                return
+            started = time.perf_counter()
+            packages = await asyncio.to_thread(parse_status, status)
+            self._index(packages)
+            self.mtime = mtime
+            self.stats['refreshes'] += 1
+            self.stats['parse_time'] = time.perf_counter() - started
+            logger.info(f"Package catalog refreshed: {len(packages)} packages in {self.stats['parse_time']:.3f}s")
+
+    async def preload(self):
+        # Для on_startup: первый поиск не ждет загрузки каталога
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"Could not load package catalog: {str(e)}")
+
+    def search(self, query):
+        # Точное совпадение, за ним остальные имена с этим префиксом, затем имена, содержащие запрос
+        query = query.lower()
+        if not query:
+            return list(self._names)
+        index = bisect.bisect_left(self._names, query)
+        matches = []
+        while index < len(self._names) and self._names[index].startswith(query):
+            matches.append(self._names[index])
+            index += 1
+        seen = set(matches)
+        position = self._text.find(query)
+        while position != -1:
+            index = bisect.bisect_right(self._offsets, position) - 1
+            name = self._names[index]
+            if name not in seen:
+                seen.add(name)
+                matches.append(name)
+            position = self._text.find(query, self._offsets[index] + len(name))
+        return matches
+
+    def get_stats(self):
+        result = dict(self.stats)
+        result.update(packages=len(self.packages), mtime=self.mtime)
+        return result
+
+
+def format_size(kib):
+    if kib is None:
+        return '-'
+    if kib >= 1024 * 1024:
+        return f'{kib / 1024 / 1024:.1f} ГиБ'
+    if kib >= 1024:
+        return f'{kib / 1024:.1f} МиБ'
+    return f'{kib} КиБ'
+
+
+def describe(package):
+    return (f"Пакет: {package.name}\nВерсия: {package.version}\nАрхитектура: {package.architecture}\n"
+            f"Раздел: {package.section or '-'}\nРазмер: {format_size(package.installed_size)}\n"
+            f"Сопровождающий: {package.maintainer or '-'}\n\n{package.description}")
+
+
+def render_page(catalog, query, offset=0):
+    # Возвращает (текст, клавиатура); кнопки несут смещение и сам запрос: packages:<смещение>:<запрос>
+    names = catalog.search(query)
+    if not names:
+        return f"Пакеты по запросу «{query}» не найдены", None
+    offset = max(0, min(offset, (len(names) - 1) // PACKAGES_PAGE_SIZE * PACKAGES_PAGE_SIZE))
+    pages = (len(names) - 1) // PACKAGES_PAGE_SIZE + 1
+    title = f"Пакеты по запросу «{query}»" if query else "Установленные пакеты"
+    lines = [f"{title}: {len(names)}, страница {offset // PACKAGES_PAGE_SIZE + 1}/{pages}"]
+    for name in names[offset:offset + PACKAGES_PAGE_SIZE]:
+        package = catalog.packages[name]
+        summary = package.summary if len(package.summary) <= 60 else package.summary[:57] + '...'
+        lines.append(f"{name} {package.version} - {summary}")
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton('<<', callback_data=f'packages:{offset - PACKAGES_PAGE_SIZE}:{query}'))
+    if offset + PACKAGES_PAGE_SIZE < len(names):
+        buttons.append(InlineKeyboardButton('>>', callback_data=f'packages:{offset + PACKAGES_PAGE_SIZE}:{query}'))
+    return '\n'.join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def parse_query(args):
+    # Возвращает запрос или None, если он не помещается в кнопки листания
+    query = ' '.join(args).strip().lower()
+    if len(query.encode()) > MAX_QUERY_BYTES:
+        return None
+    return query
@@ -0,0 +1,387 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import asyncpg
+import metrics
+from contextlib import asynccontextmanager
+
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+# Соединение, простоявшее в пуле дольше этого времени, проверяется запросом SELECT 1
+DB_POOL_PING_IDLE = float(os.getenv('DB_POOL_PING_IDLE', '10'))
+# Начиная с такого количества строк вставка идет через COPY FROM STDIN вместо INSERT ... VALUES
+DB_COPY_THRESHOLD = int(os.getenv('DB_COPY_THRESHOLD', '1000'))
+DB_PAGE_SIZE = int(os.getenv('DB_PAGE_SIZE', '50'))
+DB_STREAM_BATCH = int(os.getenv('DB_STREAM_BATCH', '500'))
+DB_CONNECT_TIMEOUT = float(os.getenv('DB_CONNECT_TIMEOUT', '10'))
+# Чтение уходит на реплику, пока она отстает от primary не больше чем на DB_REPL_MAX_LAG секунд
+DB_REPL_MAX_LAG = float(os.getenv('DB_REPL_MAX_LAG', '10'))
+DB_REPL_CHECK_INTERVAL = float(os.getenv('DB_REPL_CHECK_INTERVAL', '5'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Ограниченный пул соединений с PostgreSQL, общий для всех обработчиков
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, recycle=DB_POOL_RECYCLE,
+                 timeout=DB_POOL_TIMEOUT, **dsn):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.recycle = recycle
+        self.timeout = timeout
+        self.dsn = dsn
+        self._idle = []  # (connection, created_at, returned_at)
+        self._created = {}  # id(connection) -> created_at
+        self._size = 0
+        self._cond = None
+        self.stats = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'created': 0,
+                      'recycled': 0, 'broken': 0, 'max_in_use': 0}
+
+    async def _connect(self):
+        with metrics.phase('db_connect'):
+            connection = await asyncpg.connect(timeout=DB_CONNECT_TIMEOUT, **self.dsn)
+        self._created[id(connection)] = time.monotonic()
+        self.stats['created'] += 1
+        logger.info("Connected to PostgreSQL database successfully")
+        return connection
+
+    def _discard(self, connection):
+        # Вызывается под self._cond
+        self._created.pop(id(connection), None)
+        self._size -= 1
+        self._cond.notify()
+        # Закрытия не ждем: соединение могло оборваться или остаться посреди запроса
+        connection.terminate()
+
+    async def _is_healthy(self, connection, created_at, returned_at):
+        now = time.monotonic()
+        if connection.is_closed():
+            self.stats['broken'] += 1
+            return False
+        if now - created_at > self.recycle:
+            self.stats['recycled'] += 1
+            return False
+        if now - returned_at > DB_POOL_PING_IDLE:
+            try:
+                await connection.execute('SELECT 1')
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError):
+                self.stats['broken'] += 1
+                return False
+        return True
+
+    async def getconn(self):
+        if self._cond is None:
+            # Примитивы asyncio создаются внутри работающего цикла событий
+            self._cond = asyncio.Condition()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            async with self._cond:
+                if not self._idle and self._size >= self.maxconn:
+                    self.stats['waits'] += 1
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError
+                        await asyncio.wait_for(self._cond.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        self.stats['timeouts'] += 1
+                        raise PoolTimeout(f"no free database connection within {self.timeout}s "
+                                          f"(pool size {self.maxconn})")
+                if self._idle:
+                    connection, created_at, returned_at = self._idle.pop()
+                else:
+                    connection = None
+                    self._size += 1
+                self._checked_out()
+
+            if connection is None:
+                try:
+                    return await self._connect()
+                except BaseException:
+                    async with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            try:
+                healthy = await self._is_healthy(connection, created_at, returned_at)
+            except BaseException:
+                async with self._cond:
+                    self._discard(connection)
+                raise
+            if healthy:
+                return connection
+            # Соединение устарело или оборвалось - выбрасываем его и берем следующее
+            async with self._cond:
+                self._discard(connection)
+                self.stats['checkouts'] -= 1
+
+    def _checked_out(self):
+        self.stats['checkouts'] += 1
+        in_use = self._size - len(self._idle)
+        if in_use > self.stats['max_in_use']:
+            self.stats['max_in_use'] = in_use
+
+    async def putconn(self, connection, broken=False):
+        if not broken and not connection.is_closed() and connection.is_in_transaction():
+            try:
+                await connection.execute('ROLLBACK')
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError):
+                broken = True
+        async with self._cond:
+            created_at = self._created.get(id(connection), 0)
+            if broken or connection.is_closed() or time.monotonic() - created_at > self.recycle:
+                self._discard(connection)
+            else:
+                self._idle.append((connection, created_at, time.monotonic()))
+                self._cond.notify()
+
+    @asynccontextmanager
+    async def connection(self):
+        connection = await self.getconn()
+        broken = False
+        # db_query - сколько соединение было занято запросами, без ожидания пула и подключения
+        started = time.perf_counter()
+        try:
+            yield connection
+        except (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError, asyncio.CancelledError):
+            # Оборванное или прерванное посреди запроса соединение не переиспользуем
+            broken = True
+            raise
+        finally:
+            metrics.observe('db_query', time.perf_counter() - started)
+            # finally, а не except Exception: генератор stream_rows может быть закрыт на середине
+            await self.putconn(connection, broken=broken)
+
+    async def prefill(self):
+        # Заранее открываем minconn соединений, чтобы первые запросы не платили за подключение
+        connections = [await self.getconn() for _ in range(self.minconn)]
+        for connection in connections:
+            await self.putconn(connection)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats.update(size=self._size, idle=len(self._idle), in_use=self._size - len(self._idle),
+                     max=self.maxconn)
+        return stats
+
+    async def closeall(self):
+        if self._cond is None:
+            return
+        async with self._cond:
+            for connection, _, _ in self._idle:
+                self._created.pop(id(connection), None)
+                self._size -= 1
+                await connection.close()
+            self._idle.clear()
+
+
+def _ident(name):
+    # Имена таблиц и колонок - константы из кода, но экранируем их как идентификаторы
+    return '"' + name.replace('"', '""') + '"'
+
+
+async def bulk_insert(pool, table, column, values):
+    # Все значения уходят одним запросом в одной транзакции, значения передаются параметрами.
+    # Повторы пропускаются по уникальному индексу (ON CONFLICT DO NOTHING), поэтому повторное
+    # сохранение тех же данных ничего не меняет. Возвращает число действительно добавленных строк
+    if not values:
+        return 0
+    async with pool.connection() as connection:
+        async with connection.transaction():
+            if len(values) >= DB_COPY_THRESHOLD:
+                # COPY не умеет ON CONFLICT: грузим во временную таблицу и переносим оттуда
+                await connection.execute('CREATE TEMP TABLE bulk_values (value text) ON COMMIT DROP')
+                await connection.copy_records_to_table('bulk_values', records=[(str(value),) for value in values])
+                status = await connection.execute(f'INSERT INTO {_ident(table)} ({_ident(column)}) '
+                                                  f'SELECT DISTINCT value FROM bulk_values ON CONFLICT DO NOTHING')
+            else:
+                # Один параметр-массив вместо N строк VALUES: один запрос и один план
+                status = await connection.execute(f'INSERT INTO {_ident(table)} ({_ident(column)}) '
+                                                  f'SELECT DISTINCT unnest($1::text[]) ON CONFLICT DO NOTHING',
+                                                  [str(value) for value in values])
+    # Статус команды: 'INSERT 0 <число строк>'
+    inserted = int(status.split()[-1])
+    logger.info(f"Inserted {inserted} of {len(values)} rows into {table}")
+    return inserted
+
+
+async def find_id(pool, table, column, value):
+    # Точный поиск по уникальному индексу: id строки или None
+    async with pool.connection() as connection:
+        return await connection.fetchval(f'SELECT id FROM {_ident(table)} WHERE {_ident(column)} = $1', value)
+
+
+async def stream_rows(pool, query, *args, batch_size=DB_STREAM_BATCH):
+    # Серверный курсор: строки приходят пачками по batch_size, а не все сразу
+    async with pool.connection() as connection:
+        async with connection.transaction():
+            async for row in connection.cursor(query, *args, prefetch=batch_size):
+                yield row
+
+
+async def fetch_page(pool, table, column, after_id=None, before_id=None, limit=DB_PAGE_SIZE):
+    # Keyset-пагинация по id: каждая страница - один короткий запрос по первичному ключу,
+    # стоимость не зависит от номера страницы и размера таблицы
+    # Возвращает (rows, has_prev, has_next)
+    table = _ident(table)
+    column = _ident(column)
+    if before_id is not None:
+        query = f'SELECT id, {column} FROM {table} WHERE id < $1 ORDER BY id DESC LIMIT $2'
+        rows = [row async for row in stream_rows(pool, query, before_id, limit + 1, batch_size=limit + 1)]
+        has_prev = len(rows) > limit
+        rows = rows[:limit][::-1]
+        return rows, has_prev, True
+    if after_id is None:
+        query = f'SELECT id, {column} FROM {table} ORDER BY id LIMIT $1'
+        args = (limit + 1,)
+    else:
+        query = f'SELECT id, {column} FROM {table} WHERE id > $1 ORDER BY id LIMIT $2'
+        args = (after_id, limit + 1)
+    rows = [row async for row in stream_rows(pool, query, *args, batch_size=limit + 1)]
+    return rows[:limit], after_id is not None, len(rows) > limit
+
+
+# Ошибки, после которых реплика считается недоступной и запрос повторяется на primary
+REPLICA_ERRORS = (asyncpg.PostgresConnectionError, asyncpg.CannotConnectNowError, asyncpg.InterfaceError,
+                  OSError, asyncio.TimeoutError, PoolTimeout)
+
+LAG_QUERY = """
+SELECT pg_is_in_recovery(),
+       CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+"""
+
+
+class ReadRouter:
+    # Запись всегда идет в primary, чтение - на потоковую реплику, если она доступна и отстает
+    # не больше max_lag секунд. Состояние реплики проверяется фоновой задачей не чаще раза в
+    # check_interval секунд, запросы чтения проверку не ждут: пока о реплике ничего не известно
+    # или она отстала/недоступна, чтение идет в primary
+    def __init__(self, primary, replica=None, max_lag=DB_REPL_MAX_LAG, check_interval=DB_REPL_CHECK_INTERVAL):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self.replica_ok = False
+        self._checked_at = None
+        self._check_task = None
+        self.stats = {'replica_reads': 0, 'primary_reads': 0, 'fallbacks': 0, 'checks': 0, 'check_errors': 0}
+
+    async def _check(self):
+        self.stats['checks'] += 1
+        try:
+            async with self.replica.connection() as connection:
+                in_recovery, lag = await asyncio.wait_for(connection.fetchrow(LAG_QUERY), DB_CONNECT_TIMEOUT)
+            self.lag = float(lag)
+            ok = in_recovery and self.lag <= self.max_lag
+            if not ok:
+                logger.warning(f"Replica lag {self.lag:.1f}s (in recovery: {in_recovery}), reading from primary")
+        except Exception as e:
+            self.stats['check_errors'] += 1
+            self.lag = None
+            ok = False
+            logger.warning(f"Replica is unavailable, reading from primary: {str(e)}")
+        if ok and not self.replica_ok:
+            logger.info("Reading from replica")
+        self.replica_ok = ok
+        self._checked_at = time.monotonic()
+
+    def _schedule_check(self):
+        due = self._checked_at is None or time.monotonic() - self._checked_at > self.check_interval
+        if due and (self._check_task is None or self._check_task.done()):
+            self._check_task = asyncio.create_task(self._check())
+
+    def read_pool(self):
+        if self.replica is None:
+            return self.primary
+        self._schedule_check()
+        return self.replica if self.replica_ok else self.primary
+
+    async def read(self, function, *args, **kwargs):
+        # function(pool, *args) - корутина только для чтения, например fetch_page или find_id
+        pool = self.read_pool()
+        if pool is self.primary:
+            self.stats['primary_reads'] += 1
+            return await function(pool, *args, **kwargs)
+        try:
+            result = await function(pool, *args, **kwargs)
+            self.stats['replica_reads'] += 1
+            return result
+        except REPLICA_ERRORS as e:
+            # Реплика упала между проверками - помечаем ее недоступной и повторяем на primary
+            logger.warning(f"Read from replica failed, retrying on primary: {str(e)}")
+            self.replica_ok = False
+            self._checked_at = time.monotonic()
+            self.stats['fallbacks'] += 1
+            self.stats['primary_reads'] += 1
+            return await function(self.primary, *args, **kwargs)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats.update(replica_ok=self.replica_ok, lag=self.lag, max_lag=self.max_lag)
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(user, password, host, port, database):
+    key = (host, str(port), database, user)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.dsn['password'] != password:
+            pool = _pools[key] = ConnectionPool(user=user, password=password, host=host,
+                                                port=int(port) if port else None, database=database)
+        return pool
+
+
+_routers = {}
+
+
+def get_router(user, password, host, port, database, repl_host=None, repl_port=None):
+    # Маршрутизатор для пары primary/реплика; без repl_host все запросы идут в primary.
+    # Физическая реплика - копия primary, поэтому пользователь и пароль те же
+    key = (host, str(port), database, user, repl_host, str(repl_port))
+    primary = get_pool(user, password, host, port, database)
+    replica = get_pool(user, password, repl_host, repl_port, database) if repl_host else None
+    with _pools_lock:
+        router = _routers.get(key)
+        if router is None or router.primary is not primary or router.replica is not replica:
+            router = _routers[key] = ReadRouter(primary, replica)
+        return router
+
+
+def get_router_stats():
+    with _pools_lock:
+        return {f"{r.primary.dsn['host']} -> {r.replica.dsn['host'] if r.replica else '-'}": r.get_stats()
+                for r in _routers.values()}
+
+
+def get_stats():
+    with _pools_lock:
+        return {f"{p.dsn['user']}@{p.dsn['host']}:{p.dsn['port']}/{p.dsn['database']}": p.get_stats()
+                for p in _pools.values()}
+
+
+async def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        for router in _routers.values():
+            if router._check_task is not None:
+                router._check_task.cancel()
+        _routers.clear()
+    for pool in pools:
+        await pool.closeall()
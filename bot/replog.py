@@ -0,0 +1,320 @@
+import os
+import re
+import json
+import heapq
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+
+logger = logging.getLogger(__name__)
+
+REPL_LOG_BLOCK = int(os.getenv('REPL_LOG_BLOCK', '65536'))
+# Часовой пояс лога (log_timezone PostgreSQL) для строк, где он записан аббревиатурой (MSK, CET) или не записан:
+# IANA-имя, например Europe/Moscow; без настройки - пояс, в котором запущен бот. UTC, GMT и смещения (+03)
+# берутся из самой строки. Время событий приводится к UTC
+REPL_LOG_TZ = os.getenv('REPL_LOG_TZ')
+_log_zone = ZoneInfo(REPL_LOG_TZ) if REPL_LOG_TZ else None
+
+
+class LogTail:
+    # Последние max_lines строк лога, совпадающих с pattern, с context строками до и после
+    # (как grep pattern -B context -A context | tail -n max_lines).
+    # Первый раз файл читается блоками с конца, дальше - только новые байты от сохраненного смещения,
+    # поэтому стоимость зависит от размера ответа и прироста лога, а не от размера файла
+    def __init__(self, path, pattern, max_lines, context=0, state_path=None):
+        self.path = path
+        self.pattern = pattern.encode()
+        self.max_lines = max_lines
+        self.context = context
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = self._load_state()
+
+    def _empty_state(self, inode=None):
+        # lines - готовый вывод; prev - последние context строк до текущей позиции;
+        # after - сколько строк после совпадения еще нужно вывести; last_emitted - номер последней выведенной строки
+        return {'inode': inode, 'offset': 0, 'lineno': 0, 'lines': [], 'prev': [], 'after': 0, 'last_emitted': None}
+
+    def _load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                logger.warning(f"Could not load log tail state from {self.state_path}", exc_info=True)
+        return self._empty_state()
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _emit(self, lineno, line):
+        state = self._state
+        # Разделитель между несмежными группами, как у grep с контекстом
+        if self.context and state['lines'] and state['last_emitted'] is not None and lineno > state['last_emitted'] + 1:
+            state['lines'].append('--')
+        state['lines'].append(line)
+        state['last_emitted'] = lineno
+
+    def _feed(self, raw_lines):
+        state = self._state
+        for raw in raw_lines:
+            state['lineno'] += 1
+            lineno = state['lineno']
+            line = raw.decode('utf-8', errors='replace')
+            if self.pattern in raw:
+                first = lineno - len(state['prev'])
+                for i, before in enumerate(state['prev']):
+                    if state['last_emitted'] is None or first + i > state['last_emitted']:
+                        self._emit(first + i, before)
+                self._emit(lineno, line)
+                state['after'] = self.context
+            elif state['after'] > 0:
+                self._emit(lineno, line)
+                state['after'] -= 1
+            if self.context:
+                state['prev'] = (state['prev'] + [line])[-self.context:]
+        # Хранится только хвост вывода
+        state['lines'] = state['lines'][-self.max_lines:]
+
+    def _read_backwards(self, f, end):
+        # Читаем блоки с конца, пока не наберется max_lines совпадений (каждое дает хотя бы одну строку вывода)
+        # плюс context строк перед самым ранним из них
+        position = end
+        buffer = b''
+        lines = []
+        matches = 0
+        while position > 0:
+            size = min(REPL_LOG_BLOCK, position)
+            position -= size
+            f.seek(position)
+            buffer = f.read(size) + buffer
+            parts = buffer.split(b'\n')
+            # Первая часть может быть неполной строкой, если мы не дошли до начала файла
+            buffer = parts.pop(0) if position > 0 else b''
+            for raw in reversed(parts):
+                lines.append(raw)
+                if self.pattern in raw:
+                    matches += 1
+            if matches >= self.max_lines and len(lines) - self._last_match_index(lines) > self.context:
+                break
+        lines.reverse()
+        return lines
+
+    def _last_match_index(self, reversed_lines):
+        for i in range(len(reversed_lines) - 1, -1, -1):
+            if self.pattern in reversed_lines[i]:
+                return i
+        return len(reversed_lines)
+
+    def read(self):
+        with self._lock:
+            stat = os.stat(self.path)
+            state = self._state
+            with open(self.path, 'rb') as f:
+                if state['inode'] != stat.st_ino or stat.st_size < state['offset']:
+                    # Первый запуск, ротация или усечение лога - строим хвост заново, читая с конца
+                    if state['inode'] is not None:
+                        logger.info(f"{self.path} was rotated or truncated, rescanning")
+                    self._state = state = self._empty_state(stat.st_ino)
+                    f.seek(0, os.SEEK_END)
+                    end = f.tell()
+                    data_end = end
+                    # Последняя строка может быть еще не дописана - ее прочитаем в следующий раз
+                    if end:
+                        f.seek(end - 1)
+                        if f.read(1) != b'\n':
+                            data_end = self._last_newline(f, end)
+                    self._feed(self._read_backwards(f, data_end)[:-1] if data_end else [])
+                    state['offset'] = data_end
+                elif stat.st_size > state['offset']:
+                    f.seek(state['offset'])
+                    data = f.read(stat.st_size - state['offset'])
+                    complete = data.rfind(b'\n') + 1
+                    self._feed(data[:complete].split(b'\n')[:-1])
+                    state['offset'] += complete
+            self._save_state()
+            return '\n'.join(state['lines'])
+
+    def _last_newline(self, f, end):
+        position = end
+        while position > 0:
+            size = min(REPL_LOG_BLOCK, position)
+            position -= size
+            f.seek(position)
+            index = f.read(size).rfind(b'\n')
+            if index >= 0:
+                return position + index + 1
+        return 0
+
+
+# Строка лога PostgreSQL с префиксом по умолчанию (log_line_prefix = '%m [%p] '),
+# например: 2024-03-01 03:12:45.123 UTC [57] LOG:  received replication command: IDENTIFY_SYSTEM
+LOG_LINE_REGEX = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?:\.\d+)?(?: (\S+))? \[(\d+)\] (?:\S+@\S+ )?([A-Z0-9]+):\s+(.*)$')
+OFFSET_REGEX = re.compile(r'([+-])(\d{2}):?(\d{2})?')
+SLOT_REGEX = re.compile(r'(?:SLOT|slot) "?([\w.-]+)"?')
+REPL_MARKERS = ('repl', 'walsender', 'wal receiver', 'streaming WAL', 'START_REPLICATION', 'IDENTIFY_SYSTEM')
+
+
+class ReplicationEvent:
+    __slots__ = ('seq', 'timestamp', 'level', 'pid', 'slot', 'message')
+
+    def __init__(self, timestamp, level, pid, slot, message):
+        self.seq = None
+        self.timestamp = timestamp
+        self.level = level
+        self.pid = pid
+        self.slot = slot
+        self.message = message
+
+    def __str__(self):
+        slot = f' slot={self.slot}' if self.slot else ''
+        return f"{self.timestamp:%Y-%m-%d %H:%M:%S} UTC {self.level} [{self.pid}]{slot} {self.message}"
+
+
+def to_utc(timestamp, zone):
+    # Наивное время из лога в наивное UTC; zone - обозначение пояса из строки или None
+    if zone in ('UTC', 'GMT'):
+        return timestamp
+    offset = OFFSET_REGEX.fullmatch(zone or '')
+    if offset is not None:
+        sign, hours, minutes = offset.groups()
+        delta = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        return timestamp - delta if sign == '+' else timestamp + delta
+    if _log_zone is not None:
+        timestamp = timestamp.replace(tzinfo=_log_zone)
+    # Без tzinfo astimezone считает время местным
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def parse_event(line):
+    # Возвращает ReplicationEvent или None, если строка не про репликацию или не разбирается
+    if not any(marker in line for marker in REPL_MARKERS):
+        return None
+    match = LOG_LINE_REGEX.match(line)
+    if match is None:
+        return None
+    timestamp, zone, pid, level, message = match.groups()
+    slot = SLOT_REGEX.search(message)
+    return ReplicationEvent(to_utc(datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S'), zone), level, int(pid),
+                            slot.group(1) if slot else None, message)
+
+
+class EventStore:
+    # Кольцевой буфер фиксированного размера с индексами по времени и по уровню.
+    # События хранятся по возрастанию seq; время - бинарным поиском, уровень - очередью seq на каждый уровень
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._events = [None] * capacity
+        self._first = 0  # seq самого старого события в буфере
+        self._next = 0  # seq следующего события
+        self._by_level = {}  # level -> deque(seq)
+
+    def __len__(self):
+        return self._next - self._first
+
+    def add(self, event):
+        if self._next - self._first == self.capacity:
+            self._first += 1
+        event.seq = self._next
+        self._events[self._next % self.capacity] = event
+        self._next += 1
+        index = self._by_level.setdefault(event.level, deque())
+        index.append(event.seq)
+        self._trim(index)
+
+    def _trim(self, index):
+        while index and index[0] < self._first:
+            index.popleft()
+
+    def _seq_since(self, since):
+        low, high = self._first, self._next
+        while low < high:
+            middle = (low + high) // 2
+            if self._events[middle % self.capacity].timestamp < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, since=None, levels=None, slot=None, text=None, limit=20):
+        start = self._seq_since(since) if since else self._first
+        if levels:
+            indexes = [self._by_level.get(level, ()) for level in levels]
+            for index in indexes:
+                self._trim(index)
+            candidates = heapq.merge(*(reversed(index) for index in indexes), reverse=True)
+        else:
+            candidates = range(self._next - 1, start - 1, -1)
+        result = []
+        for seq in candidates:
+            if seq < start or len(result) >= limit:
+                break
+            event = self._events[seq % self.capacity]
+            if slot and event.slot != slot:
+                continue
+            if text and text not in event.message:
+                continue
+            result.append(event)
+        result.reverse()
+        return result
+
+
+class LogWatcher:
+    # Фоновая задача: следит за логом, как tail -F, и складывает события репликации в EventStore
+    def __init__(self, path, store, interval=1.0, backfill=0):
+        self.path = path
+        self.store = store
+        self.interval = interval
+        self.backfill = backfill
+        self._inode = None
+        self._offset = 0
+
+    def _read_new_lines(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            if self._inode is None:
+                # При старте подхватываем конец существующего лога, а не весь файл
+                self._offset = max(0, stat.st_size - self.backfill)
+            else:
+                logger.info(f"{self.path} was rotated or truncated, following the new file")
+                self._offset = 0
+            self._inode = stat.st_ino
+            skip_partial = self._offset > 0
+        else:
+            skip_partial = False
+        if stat.st_size == self._offset:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(stat.st_size - self._offset)
+        start = data.find(b'\n') + 1 if skip_partial else 0
+        complete = data.rfind(b'\n') + 1
+        self._offset += complete
+        if complete <= start:
+            return []
+        return [parse_event(line.decode('utf-8', errors='replace'))
+                for line in data[start:complete].split(b'\n')[:-1]]
+
+    async def run(self):
+        while True:
+            try:
+                events = await asyncio.to_thread(self._read_new_lines)
+                for event in events:
+                    if event is not None:
+                        self.store.add(event)
+            except Exception:
+                logger.error(f"Error while following {self.path}", exc_info=True)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,347 @@
+import os
+import re
+import math
+import time
+import asyncio
+import logging
+from array import array
+from datetime import datetime, timezone
+import sysinfo
+import ssh_client
+
+
+logger = logging.getLogger(__name__)
+
+# Фоновый опрос хоста: раз в SAMPLER_INTERVAL секунд одной командой по общему SSH-подключению
+# снимаются free и df (в том же виде, что у /get_free и /get_df), /proc/stat и /proc/loadavg. SAMPLER_INTERVAL=0 отключает опрос
+SAMPLER_INTERVAL = float(os.getenv('SAMPLER_INTERVAL', '15'))
+# Размер кольцевого буфера в образцах: 5760 - сутки при опросе раз в 15 секунд
+SAMPLER_CAPACITY = int(os.getenv('SAMPLER_CAPACITY', '5760'))
+# Завершенные интервалы по SAMPLER_ROLLUP секунд сворачиваются в min/avg/max и пишутся в host_metrics
+SAMPLER_ROLLUP = int(os.getenv('SAMPLER_ROLLUP', '300'))
+# Образец старше этого считается устаревшим, и команда выполняется на хосте как раньше
+SAMPLER_MAX_AGE = float(os.getenv('SAMPLER_MAX_AGE', str(3 * SAMPLER_INTERVAL)))
+SAMPLER_TIMEOUT = float(os.getenv('SAMPLER_TIMEOUT', '10'))
+
+NAN = float('nan')
+SEPARATOR = '@@sample@@'
+
+# Группы метрик для /history: имя группы -> префиксы метрик
+GROUPS = {
+    'free': ('mem_', 'swap_'),
+    'mem': ('mem_', 'swap_'),
+    'cpu': ('cpu_',),
+    'mpstat': ('cpu_',),
+    'df': ('disk_',),
+    'disk': ('disk_',),
+    'load': ('load',),
+    'uptime': ('load',),
+}
+BYTE_METRICS = ('mem_total', 'mem_used', 'mem_available', 'swap_used', 'disk_used')
+
+WINDOW_REGEX = re.compile(r'(\d+)([smhd])')
+
+
+def free_metrics(text):
+    memory = sysinfo.FREE.parse(text)
+    values = {'mem_total': memory.total, 'mem_used': memory.used, 'mem_available': memory.available,
+              'mem_used_pct': memory.percent}
+    if memory.swap_total:
+        values['swap_used'] = memory.swap_used
+        values['swap_used_pct'] = memory.swap_percent
+    return values
+
+
+def df_metrics(text):
+    values = {}
+    for fs in sysinfo.DF.parse(text):
+        values[f'disk_used_pct:{fs.mount}'] = fs.percent
+        values[f'disk_used:{fs.mount}'] = fs.used
+    return values
+
+
+def parse_cpu(line, previous):
+    # Строка cpu из /proc/stat - счетчики с момента загрузки; проценты считаются по разнице с прошлым образцом.
+    # Возвращает (values, counters)
+    counters = [int(value) for value in line.split()[1:9]]
+    counters += [0] * (8 - len(counters))
+    if previous is None:
+        return {}, counters
+    user, nice, system, idle, iowait, irq, softirq, steal = (now - before for now, before in zip(counters, previous))
+    total = user + nice + system + idle + iowait + irq + softirq + steal
+    if total <= 0:
+        return {}, counters
+    values = {'cpu_user_pct': (user + nice) / total * 100, 'cpu_system_pct': (system + irq + softirq) / total * 100,
+              'cpu_iowait_pct': iowait / total * 100, 'cpu_steal_pct': steal / total * 100,
+              'cpu_idle_pct': idle / total * 100}
+    values['cpu_busy_pct'] = 100 - values['cpu_idle_pct'] - values['cpu_iowait_pct']
+    return values, counters
+
+
+def parse_loadavg(line):
+    load1, load5, load15 = (float(value) for value in line.split()[:3])
+    return {'load1': load1, 'load5': load5, 'load15': load15}
+
+
+def parse_window(value):
+    # 30m, 6h, 7d -> секунды
+    match = WINDOW_REGEX.fullmatch(value)
+    if match is None:
+        raise ValueError(f"ожидается период вида 30m, 6h или 7d, получено: {value}")
+    return int(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+
+class RingBuffer:
+    # Временные ряды фиксированной длины: общий массив отметок времени и по массиву double на метрику.
+    # Образцы хранятся по возрастанию seq, ячейка образца - seq % capacity; пропуски - NaN
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', [0.0]) * capacity
+        self.series = {}  # name -> array('d')
+        self._first = 0  # seq самого старого образца в буфере
+        self._next = 0  # seq следующего образца
+
+    def __len__(self):
+        return self._next - self._first
+
+    def append(self, timestamp, values):
+        if self._next - self._first == self.capacity:
+            self._first += 1
+        index = self._next % self.capacity
+        self.timestamps[index] = timestamp
+        for name, column in self.series.items():
+            column[index] = values.get(name, NAN)
+        for name in values.keys() - self.series.keys():
+            column = self.series[name] = array('d', [NAN]) * self.capacity
+            column[index] = values[name]
+        self._next += 1
+
+    def oldest(self):
+        return self.timestamps[self._first % self.capacity] if len(self) else None
+
+    def latest(self):
+        # (timestamp, {name: value}) последнего образца или None
+        if not len(self):
+            return None
+        index = (self._next - 1) % self.capacity
+        values = {name: column[index] for name, column in self.series.items() if not math.isnan(column[index])}
+        return self.timestamps[index], values
+
+    def _seq_since(self, since):
+        low, high = self._first, self._next
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[middle % self.capacity] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def names(self, prefixes):
+        return [name for name in self.series if name.startswith(prefixes)]
+
+    def aggregate(self, name, since, until):
+        # (min, sum, max, count) значений метрики с отметками в [since, until)
+        column = self.series.get(name)
+        low, total, high, count = math.inf, 0.0, -math.inf, 0
+        if column is None:
+            return low, total, high, count
+        for seq in range(self._seq_since(since), self._next):
+            index = seq % self.capacity
+            if self.timestamps[index] >= until:
+                break
+            value = column[index]
+            if math.isnan(value):
+                continue
+            low = min(low, value)
+            high = max(high, value)
+            total += value
+            count += 1
+        return low, total, high, count
+
+
+async def write_rollups(pool, rows):
+    # rows: (host, metric, bucket, min, avg, max, samples). Один запрос с параметрами-массивами, как в bulk_insert;
+    # повторная запись интервала заменяет его
+    columns = list(zip(*rows))
+    async with pool.connection() as connection:
+        await connection.execute(
+            'INSERT INTO host_metrics (host, metric, bucket, min, avg, max, samples) '
+            'SELECT * FROM unnest($1::text[], $2::text[], $3::timestamptz[], $4::float8[], $5::float8[], '
+            '$6::float8[], $7::int[]) '
+            'ON CONFLICT (host, metric, bucket) DO UPDATE SET min = EXCLUDED.min, avg = EXCLUDED.avg, '
+            'max = EXCLUDED.max, samples = EXCLUDED.samples', *columns)
+
+
+async def read_rollups(pool, host, prefixes, since, until):
+    # Свертки метрик с заданными префиксами за [since, until): metric, min, sum, max, samples
+    async with pool.connection() as connection:
+        return await connection.fetch(
+            'SELECT metric, min(min), sum(avg * samples), max(max), sum(samples) FROM host_metrics '
+            'WHERE host = $1 AND metric LIKE ANY($2::text[]) AND bucket >= $3 AND bucket < $4 GROUP BY metric',
+            host, [prefix + '%' for prefix in prefixes], since, until)
+
+
+def _datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def format_value(name, value):
+    base = name.partition(':')[0]
+    if base.endswith('_pct'):
+        return f'{value:.1f}%'
+    if base in BYTE_METRICS:
+        return sysinfo.format_bytes(value)
+    return f'{value:.2f}'
+
+
+class Sampler:
+    # pool и router - функции без аргументов, возвращающие пул primary и маршрутизатор чтения
+    # (пулы создаются лениво); без них свертки в PostgreSQL не пишутся и история - только из буфера
+    def __init__(self, host, port, username, password, pool=None, router=None,
+                 interval=SAMPLER_INTERVAL, capacity=SAMPLER_CAPACITY, rollup=SAMPLER_ROLLUP):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.free_command = sysinfo.FREE.command()
+        self.df_command = sysinfo.DF.command()
+        self.pool = pool
+        self.router = router
+        self.interval = interval
+        self.rollup = rollup
+        self.buffer = RingBuffer(capacity)
+        self.outputs = {}  # команда -> (вывод, время образца)
+        self.flushed_until = None  # свертки до этого момента уже записаны в PostgreSQL
+        self._cpu = None
+        self.stats = {'samples': 0, 'errors': 0, 'rollups': 0, 'flush_errors': 0}
+
+    def enabled(self):
+        return self.interval > 0 and bool(self.host)
+
+    def _command(self):
+        return (f'{self.free_command}; echo {SEPARATOR}; {self.df_command}; echo {SEPARATOR}; '
+                f'head -n 1 /proc/stat; cat /proc/loadavg')
+
+    async def sample(self):
+        session = ssh_client.get_session(self.host, self.port, self.username, self.password)
+        stdout, stderr, exit_status = await session.exec_command(self._command(), timeout=SAMPLER_TIMEOUT)
+        now = time.time()
+        free, df, proc = stdout.decode(errors='replace').split(SEPARATOR + '\n', 2)
+        self.outputs[self.free_command] = (free, now)
+        self.outputs[self.df_command] = (df, now)
+        values = {}
+        # Ошибка разбора одной команды не должна терять остальные метрики образца
+        for parser, text in ((free_metrics, free), (df_metrics, df), (parse_loadavg, proc.splitlines()[-1])):
+            try:
+                values.update(parser(text))
+            except (ValueError, IndexError, KeyError, ZeroDivisionError):
+                logger.warning(f"Could not parse output for {parser.__name__} from {self.host}", exc_info=True)
+        try:
+            cpu, self._cpu = parse_cpu(proc.splitlines()[0], self._cpu)
+            values.update(cpu)
+        except (ValueError, IndexError):
+            logger.warning(f"Could not parse /proc/stat from {self.host}", exc_info=True)
+        self.buffer.append(now, values)
+        self.stats['samples'] += 1
+
+    def latest(self, command):
+        # Последний вывод команды и его возраст, если опрос ее снимает и образец свежий, иначе None
+        output = self.outputs.get(command)
+        if output is None:
+            return None
+        age = time.time() - output[1]
+        return (output[0], age) if age <= SAMPLER_MAX_AGE else None
+
+    async def flush(self):
+        # Завершенные интервалы по rollup секунд сворачиваются в min/avg/max и одним запросом пишутся в PostgreSQL.
+        # Если запись не удалась, интервалы остаются в буфере и пишутся со следующей попыткой
+        oldest = self.buffer.oldest()
+        if self.pool is None or oldest is None:
+            return
+        end = time.time() // self.rollup * self.rollup
+        start = max(self.flushed_until or 0, oldest // self.rollup * self.rollup)
+        if end <= start:
+            return
+        rows = []
+        for bucket in range(int(start), int(end), self.rollup):
+            for name in self.buffer.series:
+                low, total, high, count = self.buffer.aggregate(name, bucket, bucket + self.rollup)
+                if count:
+                    rows.append((self.host, name, _datetime(bucket), low, total / count, high, count))
+        if rows:
+            try:
+                await write_rollups(self.pool(), rows)
+            except Exception as e:
+                self.stats['flush_errors'] += 1
+                logger.warning(f"Could not write host metric rollups: {str(e)}")
+                return
+            self.stats['rollups'] += len(rows)
+        self.flushed_until = end
+
+    async def run(self):
+        logger.info(f"Sampling {self.host} every {self.interval:g}s")
+        while True:
+            started = time.monotonic()
+            try:
+                await self.sample()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.warning(f"Could not sample {self.host}: {str(e)}")
+            await self.flush()
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    async def history(self, group, seconds):
+        # {metric: (min, avg, max, samples)} за последние seconds секунд. Записанные интервалы берутся
+        # из host_metrics (через реплику, если она есть), еще не записанный хвост - из буфера
+        prefixes = GROUPS[group]
+        now = time.time()
+        since = now - seconds
+        totals = {}
+        split = since
+        # После перезапуска буфер пуст, а все, что старше его начала, уже лежит в host_metrics
+        oldest = self.buffer.oldest()
+        written = self.flushed_until or (oldest // self.rollup * self.rollup if oldest is not None else now)
+        if self.router is not None and since < written:
+            try:
+                # Интервал, в который попадает since, берется целиком
+                rows = await self.router().read(read_rollups, self.host, prefixes,
+                                                _datetime(since // self.rollup * self.rollup), _datetime(written))
+            except Exception as e:
+                logger.warning(f"Could not read host metric rollups, using in-memory samples only: {str(e)}")
+            else:
+                split = written
+                for metric, low, total, high, count in rows:
+                    totals[metric] = [low, total, high, count]
+        for name in self.buffer.names(prefixes):
+            low, total, high, count = self.buffer.aggregate(name, split, now + 1)
+            if not count:
+                continue
+            if name in totals:
+                current = totals[name]
+                totals[name] = [min(current[0], low), current[1] + total, max(current[2], high), current[3] + count]
+            else:
+                totals[name] = [low, total, high, count]
+        return {name: (low, total / count, high, count) for name, (low, total, high, count) in totals.items()}
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats.update(buffered=len(self.buffer), capacity=self.buffer.capacity, series=len(self.buffer.series))
+        return stats
+
+
+def format_history(group, window, totals):
+    if not totals:
+        return f"Нет данных {group} за {window}"
+    samples = max(count for low, avg, high, count in totals.values())
+    lines = [f"{group} за {window} (образцов: {samples}): min / avg / max"]
+    width = max(len(name) for name in totals)
+    for name in sorted(totals):
+        low, avg, high, count = totals[name]
+        lines.append(f"{name.ljust(width)}  {format_value(name, low)} / {format_value(name, avg)} / "
+                     f"{format_value(name, high)}")
+    return '\n'.join(lines)
+
+
+def format_sample(output, age):
+    return f"{output.rstrip()}\n\n(фоновый опрос, получено {int(age)} с назад)"
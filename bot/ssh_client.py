@@ -0,0 +1,248 @@
+import os
+import time
+import codecs
+import asyncio
+import logging
+import threading
+import asyncssh
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+SSH_KEEPALIVE = int(os.getenv('SSH_KEEPALIVE', '30'))
+SSH_MAX_CHANNELS = int(os.getenv('SSH_MAX_CHANNELS', '8'))
+SSH_CONNECT_TIMEOUT = float(os.getenv('SSH_CONNECT_TIMEOUT', '10'))
+# Ограничения exec_stream: больше SSH_MAX_OUTPUT байт (stdout и stderr вместе) или дольше SSH_TIMEOUT секунд
+# команда не выполняется - удаленный процесс завершается, собранная часть вывода возвращается с пометкой
+SSH_MAX_OUTPUT = int(os.getenv('SSH_MAX_OUTPUT', str(4 * 1024 * 1024)))
+SSH_TIMEOUT = float(os.getenv('SSH_TIMEOUT', '60'))
+SSH_CHUNK_SIZE = int(os.getenv('SSH_CHUNK_SIZE', str(64 * 1024)))
+# Сжатие транспорта (zlib после авторизации) выгодно на медленных каналах и длинных выводах;
+# SSH_COMPRESSION=0 отключает его для быстрой сети, где оно только тратит процессор
+SSH_COMPRESSION = os.getenv('SSH_COMPRESSION', '1') == '1'
+
+
+class _Client(asyncssh.SSHClient):
+    # Помечает подключение мертвым, как только транспорт закрылся
+    closed = False
+
+    def connection_lost(self, exc):
+        self.closed = True
+
+
+class StreamResult:
+    # Результат exec_stream: выводы уже декодированы, output - stdout и stderr в порядке поступления
+    __slots__ = ('stdout', 'stderr', 'output', 'exit_status', 'size', 'truncated', 'timed_out', 'limit', 'timeout')
+
+    def __init__(self, stdout, stderr, output, exit_status, size, truncated, timed_out, limit, timeout):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.output = output
+        self.exit_status = exit_status  # None, если процесс был остановлен
+        self.size = size  # получено байт
+        self.truncated = truncated
+        self.timed_out = timed_out
+        self.limit = limit
+        self.timeout = timeout
+
+    def notice(self):
+        # Пометка для пользователя, дописывается к выводу
+        if self.timed_out:
+            return f"\n[Команда остановлена: не завершилась за {self.timeout:g} с]"
+        if self.truncated:
+            return f"\n[Вывод обрезан: больше {self.limit} байт, команда остановлена]"
+        return ''
+
+
+class SSHSession:
+    # Долгоживущее подключение к одному хосту. Каждая команда открывает свой канал
+    # поверх общего транспорта, поэтому рукопожатие и авторизация выполняются один раз
+    def __init__(self, host, port, username, password):
+        self.host = host
+        self.port = int(port) if port else 22
+        self.username = username
+        self.password = password
+        self._conn = None
+        self._client = None
+        self._lock = None
+        self._channels = None
+        self.stats = {'connects': 0, 'reconnects': 0, 'reused': 0, 'commands': 0, 'errors': 0,
+                      'truncated': 0, 'timeouts': 0}
+
+    def _is_alive(self):
+        return self._conn is not None and not self._client.closed
+
+    async def _connect(self):
+        with metrics.phase('ssh_connect'):
+            self._conn, self._client = await asyncssh.create_connection(
+                _Client, self.host, port=self.port, username=self.username, password=self.password,
+                known_hosts=None, client_keys=None, agent_path=None,
+                connect_timeout=SSH_CONNECT_TIMEOUT, login_timeout=SSH_CONNECT_TIMEOUT,
+                keepalive_interval=SSH_KEEPALIVE,
+                compression_algs=('zlib@openssh.com', 'zlib', 'none') if SSH_COMPRESSION else 'none')
+        self.stats['connects'] += 1
+        logger.info(f"SSH connection to {self.host}:{self.port} established")
+
+    async def _get_connection(self):
+        if self._lock is None:
+            # Примитивы asyncio создаются внутри работающего цикла событий
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._is_alive():
+                self.stats['reused'] += 1
+            else:
+                if self._conn is not None:
+                    # Транспорт умер (обрыв, рестарт sshd) - переподключаемся
+                    self._conn.close()
+                    self._conn = None
+                    self.stats['reconnects'] += 1
+                    logger.warning(f"SSH connection to {self.host}:{self.port} lost, reconnecting")
+                await self._connect()
+            return self._conn
+
+    def _drop(self, conn):
+        if self._conn is conn:
+            self._client.closed = True
+
+    async def _open_process(self, command):
+        # Если транспорт оборвался между проверкой и открытием канала, пробуем еще раз на новом.
+        # Возвращает процесс и момент открытия канала: время подключения в ssh_exec не входит
+        for attempt in range(2):
+            conn = await self._get_connection()
+            started = time.perf_counter()
+            try:
+                return await conn.create_process(command, encoding=None), started
+            except (asyncssh.ChannelOpenError, asyncssh.ConnectionLost, ConnectionError):
+                if attempt:
+                    raise
+                self._drop(conn)
+
+    def _get_channels(self):
+        if self._channels is None:
+            # sshd по умолчанию разрешает 10 сессий на подключение (MaxSessions)
+            self._channels = asyncio.Semaphore(SSH_MAX_CHANNELS)
+        return self._channels
+
+    async def exec_command(self, command, timeout=None):
+        async with self._get_channels():
+            try:
+                process, started = await self._open_process(command)
+                try:
+                    result = await process.wait(timeout=timeout)
+                finally:
+                    process.close()
+                    metrics.observe('ssh_exec', time.perf_counter() - started)
+            except Exception:
+                self.stats['errors'] += 1
+                raise
+            self.stats['commands'] += 1
+            return result.stdout, result.stderr, result.exit_status
+
+    async def exec_stream(self, command, on_output=None, limit=SSH_MAX_OUTPUT, timeout=SSH_TIMEOUT):
+        # stdout и stderr читаются одновременно блоками по SSH_CHUNK_SIZE, поэтому команда не встает,
+        # заполнив окно канала одного из потоков. on_output - корутинная функция, получает текст по мере
+        # поступления. При превышении limit байт или timeout секунд (вместе с временем on_output)
+        # удаленный процесс завершается, а собранная часть вывода возвращается
+        parts = {'stdout': [], 'stderr': [], 'output': []}
+        state = {'size': 0, 'truncated': False}
+
+        async def pump(stream, name, process):
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while not state['truncated']:
+                data = await stream.read(SSH_CHUNK_SIZE)
+                if data and state['size'] + len(data) > limit:
+                    data = data[:limit - state['size']]
+                    state['truncated'] = True
+                state['size'] += len(data)
+                text = decoder.decode(data, final=not data or state['truncated'])
+                if text:
+                    parts[name].append(text)
+                    parts['output'].append(text)
+                    if on_output is not None:
+                        await on_output(text)
+                if not data:
+                    return
+            # Лимит превышен: второй поток больше не читаем, процесс останавливаем
+            _stop(process)
+
+        async def collect(process):
+            await asyncio.gather(pump(process.stdout, 'stdout', process), pump(process.stderr, 'stderr', process))
+            if not state['truncated']:
+                await process.wait()
+
+        async with self._get_channels():
+            timed_out = False
+            try:
+                process, started = await self._open_process(command)
+                try:
+                    await asyncio.wait_for(collect(process), timeout)
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    _stop(process)
+                finally:
+                    process.close()
+                    metrics.observe('ssh_exec', time.perf_counter() - started)
+            except Exception:
+                self.stats['errors'] += 1
+                raise
+            self.stats['commands'] += 1
+            if timed_out or state['truncated']:
+                self.stats['timeouts' if timed_out else 'truncated'] += 1
+                logger.warning(f"SSH command {command!r} on {self.host} stopped: "
+                               f"{'timeout' if timed_out else 'output limit'}, {state['size']} bytes received")
+            exit_status = None if timed_out or state['truncated'] else process.exit_status
+            return StreamResult(''.join(parts['stdout']), ''.join(parts['stderr']), ''.join(parts['output']),
+                                exit_status, state['size'], state['truncated'], timed_out, limit, timeout)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def _stop(process):
+    # Сигнал доходит, только если sshd его поддерживает (OpenSSH 7.9+). Закрытие канала отключает процесс
+    # от вывода в любом случае: при следующей записи он получит SIGPIPE
+    try:
+        process.kill()
+    except (OSError, asyncssh.Error):
+        pass
+    process.close()
+
+
+async def exec_parallel(session, commands, timeout=None):
+    # Выполняет команды одновременно в отдельных каналах одного подключения.
+    # commands: {name: command}; результат: {name: (stdout, stderr, exit_status) или исключение}
+    results = await asyncio.gather(*(session.exec_command(command, timeout) for command in commands.values()),
+                                   return_exceptions=True)
+    return dict(zip(commands, results))
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(host, port, username, password):
+    key = (host, str(port), username)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None or session.password != password:
+            if session is not None:
+                # Пароль сменился: старое подключение больше не нужно, не держим его с keepalive до выхода
+                session.close()
+            session = _sessions[key] = SSHSession(host, port, username, password)
+        return session
+
+
+def get_stats():
+    # Статистика по всем хостам: сколько раз подключение переиспользовано и сколько раз установлено заново
+    with _sessions_lock:
+        return {f"{s.username}@{s.host}:{s.port}": dict(s.stats) for s in _sessions.values()}
+
+
+def close_all():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,398 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from telegram import Update
+from telegram.ext import BasePersistence, ContextTypes, ConversationHandler, PersistenceInput, TypeHandler
+
+
+logger = logging.getLogger(__name__)
+
+# Где хранятся user_data и состояния диалогов (найденные адреса, ожидающие ответа Да/Нет):
+# memory - только в памяти процесса, sqlite - файл STATE_SQLITE_PATH, postgres - таблица bot_state в базе бота.
+# При sqlite и postgres незавершенные диалоги переживают перезапуск
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+STATE_SQLITE_PATH = os.getenv('STATE_SQLITE_PATH', 'state.db')
+# Данные пользователя, который не писал боту STATE_TTL секунд, удаляются вместе с его диалогами.
+# Пользователей с данными не больше STATE_MAX_USERS: при превышении вытесняется давно неактивный
+STATE_TTL = float(os.getenv('STATE_TTL', '3600'))
+STATE_MAX_USERS = int(os.getenv('STATE_MAX_USERS', '10000'))
+# Ограничение на одного пользователя: число элементов во всех значениях user_data,
+# при превышении удаляются самые старые ключи
+STATE_MAX_ITEMS = int(os.getenv('STATE_MAX_ITEMS', '20000'))
+# Как часто изменения записываются в хранилище и как часто ищутся неактивные пользователи
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '5'))
+STATE_SWEEP_INTERVAL = float(os.getenv('STATE_SWEEP_INTERVAL', '60'))
+# Сериализованные значения длиннее этого сжимаются zlib
+STATE_COMPRESS_OVER = 512
+
+stats = {'evicted_idle': 0, 'evicted_lru': 0, 'trimmed': 0, 'writes': 0, 'deletes': 0, 'unchanged': 0,
+         'write_errors': 0}
+
+
+def _items(value):
+    return len(value) if isinstance(value, (list, tuple, set, dict)) else 1
+
+
+class UserData(dict):
+    # user_data с ограничением размера: записанный ключ становится последним,
+    # при превышении STATE_MAX_ITEMS удаляются самые старые (кроме только что записанного)
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        self.pop(key, None)
+        super().__setitem__(key, value)
+        size = sum(_items(item) for item in self.values())
+        while size > STATE_MAX_ITEMS and len(self) > 1:
+            size -= _items(self.pop(next(iter(self))))
+            stats['trimmed'] += 1
+
+
+def dumps(value):
+    # Компактный JSON, длинные значения дополнительно сжимаются; первый байт - формат
+    data = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode()
+    if len(data) > STATE_COMPRESS_OVER:
+        return b'z' + zlib.compress(data)
+    return b'j' + data
+
+
+def loads(blob):
+    blob = bytes(blob)
+    data = zlib.decompress(blob[1:]) if blob[:1] == b'z' else blob[1:]
+    return json.loads(data)
+
+
+class MemoryStore:
+    # Данные живут только в приложении; хранилище нужно, чтобы PTB регулярно очищал свои
+    # списки измененных пользователей (без persistence они растут с каждым новым пользователем)
+    durable = False
+
+    async def load(self, kind):
+        return {}
+
+    async def write(self, changes):
+        pass
+
+    async def close(self):
+        pass
+
+
+class PostgresStore:
+    durable = True
+
+    def __init__(self, pool):
+        self.pool = pool  # функция без аргументов, возвращающая пул
+
+    async def load(self, kind):
+        async with self.pool().connection() as connection:
+            # Записи старше STATE_TTL (бот долго был выключен) не загружаются
+            await connection.execute("DELETE FROM bot_state WHERE kind = $1 AND updated_at < now() - make_interval(secs => $2)",
+                                     kind, STATE_TTL)
+            rows = await connection.fetch("SELECT key, data FROM bot_state WHERE kind = $1", kind)
+        return {row['key']: row['data'] for row in rows}
+
+    async def write(self, changes):
+        # changes: (kind, key) -> данные или None (удалить); все изменения - одной транзакцией
+        upserts = [(kind, key, data) for (kind, key), data in changes.items() if data is not None]
+        deletes = [(kind, key) for (kind, key), data in changes.items() if data is None]
+        async with self.pool().connection() as connection:
+            async with connection.transaction():
+                if upserts:
+                    await connection.execute("""
+                        INSERT INTO bot_state (kind, key, data, updated_at)
+                        SELECT kind, key, data, now() FROM unnest($1::text[], $2::text[], $3::bytea[]) AS t(kind, key, data)
+                        ON CONFLICT (kind, key) DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at""",
+                        *map(list, zip(*upserts)))
+                if deletes:
+                    await connection.execute("""
+                        DELETE FROM bot_state WHERE (kind, key) IN (SELECT * FROM unnest($1::text[], $2::text[]))""",
+                        *map(list, zip(*deletes)))
+
+    async def close(self):
+        pass
+
+
+class SqliteStore:
+    durable = True
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS bot_state (
+                    kind TEXT NOT NULL, key TEXT NOT NULL, data BLOB NOT NULL, updated_at REAL NOT NULL,
+                    PRIMARY KEY (kind, key)) WITHOUT ROWID""")
+        return self._connection
+
+    def _load(self, kind):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM bot_state WHERE kind = ? AND updated_at < ?", (kind, time.time() - STATE_TTL))
+            rows = connection.execute("SELECT key, data FROM bot_state WHERE kind = ?", (kind,)).fetchall()
+        return dict(rows)
+
+    def _write(self, changes):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO bot_state (kind, key, data, updated_at) VALUES (?, ?, ?, ?)",
+                    [(kind, key, data, now) for (kind, key), data in changes.items() if data is not None])
+                connection.executemany(
+                    "DELETE FROM bot_state WHERE kind = ? AND key = ?",
+                    [(kind, key) for (kind, key), data in changes.items() if data is None])
+
+    def _close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    async def load(self, kind):
+        return await asyncio.to_thread(self._load, kind)
+
+    async def write(self, changes):
+        await asyncio.to_thread(self._write, changes)
+
+    async def close(self):
+        await asyncio.to_thread(self._close)
+
+
+class StatePersistence(BasePersistence):
+    # Хранятся только user_data и состояния диалогов; bot_data держит задачи и серверы и не сохраняется
+    def __init__(self, store, namespace):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False),
+                         update_interval=STATE_FLUSH_INTERVAL)
+        self.store = store
+        self.namespace = namespace  # оба бота могут хранить состояние в одной базе
+        self._saved = {}  # (kind, key) -> crc32 записанных данных, неизменившиеся данные не пишутся повторно
+        self._pending = {}  # (kind, key) -> данные или None (удалить)
+        self._lock = None
+
+    def _kind(self, name):
+        return f'{self.namespace}:{name}'
+
+    async def _queue(self, kind, key, value):
+        if not self.store.durable:
+            return
+        data = dumps(value) if value is not None and value != {} else None
+        crc = zlib.crc32(data) if data is not None else None
+        if self._saved.get((kind, key)) == crc:
+            stats['unchanged'] += 1
+            return
+        self._pending[(kind, key)] = data
+        await self._write()
+
+    async def _write(self):
+        # PTB вызывает update_* для всех изменившихся пользователей одновременно: первый вызов пишет,
+        # остальные за это время накапливают изменения, и они уходят следующей пачкой
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            changes, self._pending = self._pending, {}
+            if not changes:
+                return
+            try:
+                await self.store.write(changes)
+            except Exception as e:
+                stats['write_errors'] += 1
+                logger.warning(f"Could not save {len(changes)} state entries: {str(e)}")
+                # Повторим при следующей записи, если данные за это время не изменились снова
+                for entry, data in changes.items():
+                    self._pending.setdefault(entry, data)
+                return
+        for entry, data in changes.items():
+            if data is None:
+                self._saved.pop(entry, None)
+                stats['deletes'] += 1
+            else:
+                self._saved[entry] = zlib.crc32(data)
+                stats['writes'] += 1
+
+    async def _load(self, kind):
+        rows = await self.store.load(kind)
+        for key, data in rows.items():
+            self._saved[(kind, key)] = zlib.crc32(bytes(data))
+        return {key: loads(data) for key, data in rows.items()}
+
+    async def get_user_data(self):
+        rows = await self._load(self._kind('user_data'))
+        logger.info(f"Loaded state of {len(rows)} users ({STATE_BACKEND})")
+        return {int(key): UserData(data) for key, data in rows.items()}
+
+    async def get_conversations(self, name):
+        rows = await self._load(self._kind(f'conversation:{name}'))
+        return {tuple(int(part) for part in key.split(',')): data for key, data in rows.items()}
+
+    async def update_conversation(self, name, key, new_state):
+        await self._queue(self._kind(f'conversation:{name}'), ','.join(map(str, key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        # Пустой user_data не хранится
+        await self._queue(self._kind('user_data'), str(user_id), data)
+
+    async def drop_user_data(self, user_id):
+        await self._queue(self._kind('user_data'), str(user_id), None)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        await self._write()
+        await self.store.close()
+
+
+def _store(pool):
+    if STATE_BACKEND == 'memory':
+        return MemoryStore()
+    if STATE_BACKEND == 'sqlite':
+        return SqliteStore(STATE_SQLITE_PATH)
+    if STATE_BACKEND == 'postgres':
+        if pool is None:
+            raise ValueError("STATE_BACKEND=postgres requires a database pool")
+        return PostgresStore(pool)
+    raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND}")
+
+
+def configure(builder, namespace, pool=None):
+    # Диалоги регистрируются с name=... и persistent=True
+    return builder.context_types(ContextTypes(user_data=UserData)).persistence(
+        StatePersistence(_store(pool), namespace))
+
+
+_seen = OrderedDict()  # user_id -> время последнего обновления, от давно неактивных к недавним
+
+
+def _conversation_handlers(application):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                yield handler
+
+
+def _user_index(handler):
+    # Ключ диалога - (chat_id, user_id, message_id) без частей, отключенных per_chat/per_user/per_message.
+    # Без per_user пользователя в ключе нет, и такие диалоги по пользователям не вытесняются
+    if not handler.per_user:
+        return None
+    return 1 if handler.per_chat else 0
+
+
+def _user_keys(handler, predicate):
+    index = _user_index(handler)
+    if index is None:
+        return []
+    return [key for key in handler._conversations if predicate(key[index])]
+
+
+async def _drop_conversations(application, handler, keys):
+    # Публичного способа завершить диалог снаружи в PTB 20.8 нет, поэтому - через _conversations.
+    # Удаление сразу передается в хранилище, иначе диалог вернется из get_conversations после перезапуска
+    for key in keys:
+        handler._conversations.pop(key, None)
+        if handler.persistent and application.persistence is not None:
+            await application.persistence.update_conversation(handler.name, key, None)
+
+
+async def _evict(application, user_id):
+    application.drop_user_data(user_id)
+    # Диалоги пользователя во всех чатах, включая группы
+    for handler in _conversation_handlers(application):
+        await _drop_conversations(application, handler, _user_keys(handler, lambda key_user: key_user == user_id))
+
+
+async def _touch(update, context):
+    user = update.effective_user
+    if user is None:
+        return
+    _seen[user.id] = time.monotonic()
+    _seen.move_to_end(user.id)
+    while len(_seen) > STATE_MAX_USERS:
+        user_id, _ = _seen.popitem(last=False)
+        await _evict(context.application, user_id)
+        stats['evicted_lru'] += 1
+
+
+def install(application):
+    # Вызывается в main() последним: обработчик в группе -1 видит каждое обновление раньше остальных
+    application.add_handler(TypeHandler(Update, _touch), group=-1)
+
+
+async def sweep(application):
+    deadline = time.monotonic() - STATE_TTL
+    while _seen:
+        user_id, seen = next(iter(_seen.items()))
+        if seen > deadline:
+            break
+        del _seen[user_id]
+        await _evict(application, user_id)
+        stats['evicted_idle'] += 1
+    # Данные и диалоги пользователей, которых нет в _seen (например, загруженные без последующих обновлений)
+    for user_id in [user_id for user_id in application.user_data if user_id not in _seen]:
+        application.drop_user_data(user_id)
+    for handler in _conversation_handlers(application):
+        await _drop_conversations(application, handler, _user_keys(handler, lambda key_user: key_user not in _seen))
+
+
+async def run(application):
+    # Загруженные из хранилища пользователи считаются активными с момента запуска
+    now = time.monotonic()
+    for user_id in application.user_data:
+        _seen.setdefault(user_id, now)
+    for handler in _conversation_handlers(application):
+        index = _user_index(handler)
+        if index is not None:
+            for key in handler._conversations:
+                _seen.setdefault(key[index], now)
+    while True:
+        await asyncio.sleep(STATE_SWEEP_INTERVAL)
+        await sweep(application)
+
+
+def get_stats(application):
+    result = dict(stats)
+    result.update(backend=STATE_BACKEND, users=len(_seen), max_users=STATE_MAX_USERS,
+                  user_data=len(application.user_data),
+                  conversations=sum(len(handler._conversations) for handler in _conversation_handlers(application)))
+    return result
@@ -0,0 +1,440 @@
+import re
+import shlex
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Разбор вывода системных команд в записи и компактный вывод для Telegram: только нужные строки,
+# полосы заполнения, сортировка и фильтры (/get_df --over 80%, /get_ps --top 10 --by cpu).
+# Фильтры по возможности передаются в саму команду, чтобы по SSH приходило меньше данных.
+# Команды запускаются с LC_ALL=C: формат чисел и даты не зависит от локали хоста
+
+BAR_WIDTH = 10
+MAX_ROWS = 50
+
+SIZE_REGEX = re.compile(r'^(\d+(?:[.,]\d+)?)([BKMGTPE]?)i?$')
+SIZE_POWERS = {'B': 0, 'K': 1, 'M': 2, 'G': 3, 'T': 4, 'P': 5, 'E': 6}
+USER_REGEX = re.compile(r'^[\w.-]+$')
+# Состояния из языка фильтров ss
+SS_STATES = ('listening', 'all', 'established', 'connected', 'synchronized', 'syn-sent', 'syn-recv',
+             'fin-wait-1', 'fin-wait-2', 'time-wait', 'close-wait', 'last-ack', 'closing', 'closed')
+PS_SORT = {'cpu': '-pcpu', 'mem': '-pmem', 'rss': '-rss', 'pid': 'pid'}
+
+
+def parse_size(token, unit=1024):
+    # '2048' - в единицах unit (df -k выводит КиБ), '1.5G', '1,5Gi', '512B' -> байты
+    match = SIZE_REGEX.match(token)
+    if match is None:
+        raise ValueError(f"not a size: {token}")
+    number = float(match.group(1).replace(',', '.'))
+    if not match.group(2):
+        return number * unit
+    return number * 1024 ** SIZE_POWERS[match.group(2)]
+
+
+def format_bytes(value):
+    for suffix in ('B', 'K', 'M', 'G', 'T'):
+        if abs(value) < 1024 or suffix == 'T':
+            return f'{value:.0f}{suffix}' if suffix == 'B' else f'{value:.1f}{suffix}'
+        value /= 1024
+
+
+def bar(percent):
+    filled = round(min(max(percent, 0.0), 100.0) / 100 * BAR_WIDTH)
+    return '█' * filled + '░' * (BAR_WIDTH - filled)
+
+
+class Filesystem:
+    __slots__ = ('device', 'size', 'used', 'available', 'percent', 'mount')
+
+    def __init__(self, device, size, used, available, percent, mount):
+        self.device = device
+        self.size = size  # байты
+        self.used = used
+        self.available = available
+        self.percent = percent
+        self.mount = mount
+
+
+class Memory:
+    __slots__ = ('total', 'used', 'free', 'shared', 'cache', 'available', 'swap_total', 'swap_used')
+
+    def __init__(self, total, used, free, shared, cache, available, swap_total, swap_used):
+        self.total = total  # байты
+        self.used = used
+        self.free = free
+        self.shared = shared
+        self.cache = cache
+        self.available = available
+        self.swap_total = swap_total
+        self.swap_used = swap_used
+
+    @property
+    def percent(self):
+        return (self.total - self.available) / self.total * 100 if self.total else 0.0
+
+    @property
+    def swap_percent(self):
+        return self.swap_used / self.swap_total * 100 if self.swap_total else 0.0
+
+
+class Socket:
+    __slots__ = ('netid', 'state', 'recv_q', 'send_q', 'local', 'peer')
+
+    def __init__(self, netid, state, recv_q, send_q, local, peer):
+        self.netid = netid
+        self.state = state
+        self.recv_q = recv_q
+        self.send_q = send_q
+        self.local = local
+        self.peer = peer
+
+    @property
+    def port(self):
+        return int(self.local.rpartition(':')[2]) if self.local.rpartition(':')[2].isdigit() else 0
+
+
+class Process:
+    __slots__ = ('pid', 'user', 'cpu', 'mem', 'rss', 'command')
+
+    def __init__(self, pid, user, cpu, mem, rss, command):
+        self.pid = pid
+        self.user = user
+        self.cpu = cpu
+        self.mem = mem
+        self.rss = rss  # байты
+        self.command = command
+
+
+class CpuStat:
+    __slots__ = ('cpu', 'usr', 'nice', 'sys', 'iowait', 'irq', 'soft', 'steal', 'idle')
+
+    def __init__(self, cpu, usr=0.0, nice=0.0, sys=0.0, iowait=0.0, irq=0.0, soft=0.0, steal=0.0, idle=0.0):
+        self.cpu = cpu
+        self.usr = usr
+        self.nice = nice
+        self.sys = sys
+        self.iowait = iowait
+        self.irq = irq
+        self.soft = soft
+        self.steal = steal
+        self.idle = idle
+
+    @property
+    def busy(self):
+        return 100.0 - self.idle - self.iowait
+
+
+def parse_df(text, unit=1024):
+    # Длинное имя устройства df переносит на отдельную строку, поэтому поля набираются до шести.
+    # Псевдо-ФС (df -a) без размера пропускаются
+    lines = text.strip().splitlines()
+    if not lines or not lines[0].startswith('Filesystem'):
+        raise ValueError('not df output')
+    filesystems = []
+    fields = []
+    for line in lines[1:]:
+        fields += line.split()
+        if len(fields) < 6:
+            continue
+        device, size, used, available, percent, mount = fields[:5] + [' '.join(fields[5:])]
+        fields = []
+        if not percent.endswith('%') or size in ('0', '-'):
+            continue
+        filesystems.append(Filesystem(device, parse_size(size, unit), parse_size(used, unit),
+                                      parse_size(available, unit), float(percent[:-1]), mount))
+    return filesystems
+
+
+def parse_free(text, unit=1024):
+    # Колонки берутся из заголовка: у старых версий free нет available, зато есть строка -/+ buffers/cache
+    lines = [line.split() for line in text.strip().splitlines()]
+    header = lines[0]
+    rows = [line for line in lines[1:] if line and line[0].endswith(':')]
+    memory = dict(zip(header, (parse_size(value, unit) for value in rows[0][1:])))
+    available = memory.get('available', memory.get('free'))
+    cache = memory.get('buff/cache', memory.get('buffers', 0.0) + memory.get('cached', 0.0))
+    swap_total = swap_used = 0.0
+    if len(rows) > 1:
+        swap_total = parse_size(rows[-1][1], unit)
+        swap_used = parse_size(rows[-1][2], unit)
+    return Memory(memory['total'], memory['used'], memory.get('free', 0.0), memory.get('shared', 0.0), cache,
+                  available, swap_total, swap_used)
+
+
+def parse_ss(text):
+    # Колонка Netid есть, только если выбрано несколько типов сокетов (-tu)
+    lines = text.strip().splitlines()
+    if not lines or not lines[0].startswith(('Netid', 'State')):
+        raise ValueError('not ss output')
+    with_netid = lines[0].startswith('Netid')
+    sockets = []
+    for line in lines[1:]:
+        fields = line.split()
+        if not with_netid:
+            fields.insert(0, '-')
+        if len(fields) < 6:
+            continue
+        sockets.append(Socket(fields[0], fields[1], int(fields[2]), int(fields[3]), fields[4], fields[5]))
+    return sockets
+
+
+def parse_ps(text):
+    # ps -o pid=,user:32=,pcpu=,pmem=,rss=,comm= - без заголовка, имя команды последним полем
+    processes = []
+    for line in text.strip().splitlines():
+        fields = line.split(None, 5)
+        if len(fields) < 6 or not fields[0].isdigit():
+            continue
+        processes.append(Process(int(fields[0]), fields[1], float(fields[2]), float(fields[3]),
+                                 int(fields[4]) * 1024, fields[5]))
+    if text.strip() and not processes:
+        raise ValueError('not ps output')
+    return processes
+
+
+def parse_mpstat(text):
+    # Колонки выравниваются по правому краю: время в начале строки может занимать одно или два поля (AM/PM).
+    # Если mpstat запускался с интервалом, берутся только строки Average
+    header = None
+    rows = []
+    for line in text.strip().splitlines():
+        fields = line.split()
+        if '%idle' in fields:
+            header = [name.lstrip('%') for name in fields[fields.index('CPU') + 1:]]
+            continue
+        if header is None or len(fields) < len(header) + 1:
+            continue
+        rows.append((fields[0] == 'Average:', fields[-len(header) - 1], [float(value) for value in fields[-len(header):]]))
+    if header is None:
+        raise ValueError('not mpstat output')
+    if any(average for average, cpu, values in rows):
+        rows = [row for row in rows if row[0]]
+    stats = []
+    for average, cpu, values in rows:
+        columns = {name: value for name, value in zip(header, values) if name in CpuStat.__slots__}
+        stats.append(CpuStat(cpu, **columns))
+    return stats
+
+
+def percent_option(value):
+    number = float(value.rstrip('%'))
+    if not 0 <= number <= 100:
+        raise ValueError(f"ожидается процент от 0 до 100, получено: {value}")
+    return number
+
+
+def count_option(value):
+    number = int(value)
+    if not 1 <= number <= MAX_ROWS:
+        raise ValueError(f"ожидается число от 1 до {MAX_ROWS}, получено: {value}")
+    return number
+
+
+def port_option(value):
+    number = int(value)
+    if not 1 <= number <= 65535:
+        raise ValueError(f"ожидается порт от 1 до 65535, получено: {value}")
+    return number
+
+
+def user_option(value):
+    if not USER_REGEX.match(value):
+        raise ValueError(f"недопустимое имя пользователя: {value}")
+    return value
+
+
+def interval_option(value):
+    number = int(value)
+    if not 1 <= number <= 10:
+        raise ValueError(f"ожидается интервал от 1 до 10 секунд, получено: {value}")
+    return number
+
+
+def choice_option(*choices):
+    def parse(value):
+        value = value.lower()
+        if value not in choices:
+            raise ValueError(f"ожидается одно из: {', '.join(choices)}, получено: {value}")
+        return value
+    return parse
+
+
+class View:
+    # Системная команда в компактном виде: build(options) - команда для хоста с фильтрами,
+    # parse(output) - записи, render(records, options) - текст ответа
+    def __init__(self, name, options, build, parse, render):
+        self.name = name
+        self.options = options  # имя параметра -> функция разбора значения
+        self.build = build
+        self.parse = parse
+        self._render = render
+
+    def parse_args(self, args):
+        # Позиционные аргументы (хосты и группы для fleet) и параметры вида --top 10 или --top=10
+        positional = []
+        options = {}
+        args = iter(args)
+        for arg in args:
+            if not arg.startswith('--'):
+                positional.append(arg)
+                continue
+            name, sep, value = arg[2:].partition('=')
+            if name not in self.options:
+                known = ', '.join(f'--{option}' for option in self.options) or 'нет'
+                raise ValueError(f"неизвестный параметр --{name}, доступные: {known}")
+            if not sep:
+                value = next(args, None)
+                if value is None:
+                    raise ValueError(f"не указано значение для --{name}")
+            try:
+                options[name] = self.options[name](value)
+            except ValueError as e:
+                raise ValueError(f"--{name}: {str(e)}")
+        return positional, options
+
+    def command(self, options=None):
+        return self.build(options or {})
+
+    def render(self, output, options=None):
+        # Если вывод не разбирается (другая версия утилиты, сообщение об ошибке), отдаем его как есть
+        try:
+            return self._render(self.parse(output), options or {})
+        except (ValueError, IndexError, KeyError) as e:
+            logger.warning(f"Could not parse {self.name} output, sending it as is: {str(e)}")
+            return output
+
+
+def _limit(rows, options, default=MAX_ROWS):
+    return rows[:options.get('top', default)]
+
+
+def df_command(options):
+    command = 'LC_ALL=C df -P -k -x tmpfs -x devtmpfs -x squashfs'
+    if 'over' in options:
+        command += f" | awk 'NR == 1 || $5 + 0 >= {options['over']:g}'"
+    return command
+
+
+def render_df(filesystems, options):
+    rows = filesystems
+    if 'over' in options:
+        rows = [fs for fs in rows if fs.percent >= options['over']]
+    by = options.get('by', 'use')
+    if by == 'mount':
+        rows = sorted(rows, key=lambda fs: fs.mount)
+    else:
+        key = {'use': 'percent', 'size': 'size', 'avail': 'available'}[by]
+        rows = sorted(rows, key=lambda fs: getattr(fs, key), reverse=True)
+    rows = _limit(rows, options)
+    if not rows:
+        return f"Нет файловых систем с заполнением от {options['over']:g}%" if 'over' in options \
+            else 'Файловые системы не найдены'
+    lines = [f"Диски: {len(rows)} из {len(filesystems)}"]
+    for fs in rows:
+        lines.append(f"{bar(fs.percent)} {fs.percent:3.0f}% {format_bytes(fs.used)}/{format_bytes(fs.size)} {fs.mount}")
+    return '\n'.join(lines)
+
+
+def render_free(memory, options):
+    lines = [f"RAM  {bar(memory.percent)} {memory.percent:3.0f}% "
+             f"{format_bytes(memory.total - memory.available)}/{format_bytes(memory.total)}, "
+             f"доступно {format_bytes(memory.available)}, кэш {format_bytes(memory.cache)}"]
+    if memory.swap_total:
+        lines.append(f"Swap {bar(memory.swap_percent)} {memory.swap_percent:3.0f}% "
+                     f"{format_bytes(memory.swap_used)}/{format_bytes(memory.swap_total)}")
+    else:
+        lines.append('Swap выключен')
+    return '\n'.join(lines)
+
+
+def ss_command(options):
+    state = options.get('state', 'listening')
+    flags = {'listening': '-l', 'all': '-a'}.get(state, '')
+    protocols = {'tcp': '-t', 'udp': '-u'}.get(options.get('proto'), '-tu')
+    command = f'LC_ALL=C ss -n {protocols} {flags}'.rstrip()
+    if state not in ('listening', 'all'):
+        command += f' state {state}'
+    if 'port' in options:
+        command += f" '( sport = :{options['port']} or dport = :{options['port']} )'"
+    # --top применяется в render_ss после сортировки по порту: ss выводит сокеты в своем порядке
+    return command
+
+
+def render_ss(sockets, options):
+    rows = sockets
+    if 'proto' in options:
+        rows = [s for s in rows if s.netid in (options['proto'], '-')]
+    if 'port' in options:
+        rows = [s for s in rows if s.port == options['port'] or s.peer.endswith(f":{options['port']}")]
+    rows = _limit(sorted(rows, key=lambda s: (s.port, s.netid)), options)
+    if not rows:
+        return 'Сокеты не найдены'
+    width = max(len(s.local) for s in rows)
+    lines = [f"Сокеты: {len(rows)} из {len(sockets)}"]
+    for s in rows:
+        netid = s.netid if s.netid != '-' else options.get('proto', '')
+        if s.state in ('LISTEN', 'UNCONN'):
+            lines.append(f"{netid:<3} {s.local}")
+        else:
+            lines.append(f"{netid:<3} {s.local.ljust(width)} → {s.peer} {s.state}")
+    return '\n'.join(lines)
+
+
+def ps_command(options):
+    selector = f"-u {shlex.quote(options['user'])}" if 'user' in options else '-e'
+    return (f"LC_ALL=C ps {selector} -o pid=,user:32=,pcpu=,pmem=,rss=,comm= "
+            f"--sort={PS_SORT[options.get('by', 'cpu')]} | head -n {options.get('top', 10)}")
+
+
+def render_ps(processes, options):
+    by = options.get('by', 'cpu')
+    rows = processes
+    if 'user' in options:
+        rows = [p for p in rows if p.user == options['user']]
+    key = {'cpu': lambda p: -p.cpu, 'mem': lambda p: -p.mem, 'rss': lambda p: -p.rss, 'pid': lambda p: p.pid}[by]
+    rows = _limit(sorted(rows, key=key), options, 10)
+    if not rows:
+        return 'Процессы не найдены'
+    user_width = min(12, max(len(p.user) for p in rows))
+    lines = [f"{'PID':>7} {'USER':<{user_width}} {'CPU%':>5} {'MEM%':>5} {'RSS':>6} COMMAND"]
+    for p in rows:
+        lines.append(f"{p.pid:>7} {p.user[:user_width]:<{user_width}} {p.cpu:5.1f} {p.mem:5.1f} "
+                     f"{format_bytes(p.rss):>6} {p.command}")
+    return '\n'.join(lines)
+
+
+def mpstat_command(options):
+    # Без интервала mpstat показывает средние с момента загрузки, с --interval N - за последние N секунд
+    if 'interval' in options:
+        return f"LC_ALL=C mpstat -P ALL {options['interval']} 1"
+    return 'LC_ALL=C mpstat -P ALL'
+
+
+def render_mpstat(stats, options):
+    total = [s for s in stats if s.cpu == 'all']
+    rows = [s for s in stats if s.cpu != 'all']
+    if 'over' in options:
+        rows = [s for s in rows if s.busy >= options['over']]
+    if 'top' in options:
+        rows = sorted(rows, key=lambda s: s.busy, reverse=True)[:options['top']]
+    lines = []
+    for s in total + rows:
+        lines.append(f"{s.cpu:>3} {bar(s.busy)} {s.busy:5.1f}% usr {s.usr:.0f} sys {s.sys:.0f} "
+                     f"io {s.iowait:.0f} steal {s.steal:.0f}")
+    if not lines:
+        return 'Нет данных mpstat'
+    return '\n'.join(lines)
+
+
+DF = View('df', {'over': percent_option, 'top': count_option, 'by': choice_option('use', 'size', 'avail', 'mount')},
+          df_command, parse_df, render_df)
+FREE = View('free', {}, lambda options: 'LC_ALL=C free -b', lambda text: parse_free(text, unit=1), render_free)
+SS = View('ss', {'state': choice_option(*SS_STATES), 'port': port_option, 'proto': choice_option('tcp', 'udp'),
+                 'top': count_option},
+          ss_command, parse_ss, render_ss)
+PS = View('ps', {'top': count_option, 'by': choice_option(*PS_SORT), 'user': user_option},
+          ps_command, parse_ps, render_ps)
+MPSTAT = View('mpstat', {'over': percent_option, 'top': count_option, 'interval': interval_option},
+              mpstat_command, parse_mpstat, render_mpstat)
@@ -0,0 +1,138 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import hashlib
+import logging
+import httpd
+from telegram import Update
+
+
+logger = logging.getLogger(__name__)
+
+# Если задан WEBHOOK_URL (публичный адрес, на который Telegram или балансировщик шлет обновления),
+# бот принимает обновления встроенным HTTP-сервером вместо long polling.
+# Несколько экземпляров за балансировщиком делят входящий поток между собой
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Секрет, который Telegram передает в X-Telegram-Bot-Api-Secret-Token. По умолчанию выводится из токена бота,
+# поэтому у всех экземпляров он одинаковый без дополнительной настройки
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Обновления, принятые, но еще не обработанные; при переполнении отвечаем 503 и Telegram повторит доставку
+WEBHOOK_QUEUE = int(os.getenv('WEBHOOK_QUEUE', '1000'))
+WEBHOOK_MAX_BODY = int(os.getenv('WEBHOOK_MAX_BODY', str(1024 * 1024)))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+# Регистрировать ли webhook при старте: достаточно одного экземпляра, остальным можно выключить
+WEBHOOK_REGISTER = os.getenv('WEBHOOK_REGISTER', '1') == '1'
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+stats = {'received': 0, 'rejected_secret': 0, 'rejected_full': 0, 'bad_requests': 0}
+
+
+def enabled():
+    return bool(WEBHOOK_URL)
+
+
+def configure(builder):
+    # Без Updater: обновления кладет в очередь приложения наш сервер, а не long polling
+    if not enabled():
+        return builder
+    return builder.updater(None).update_queue(asyncio.Queue(WEBHOOK_QUEUE))
+
+
+def secret_for(token):
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256(f'webhook:{token}'.encode()).hexdigest()
+
+
+class WebhookServer:
+    def __init__(self, application):
+        self.application = application
+        self.secret = secret_for(application.bot.token).encode()
+        self.server = None
+
+    async def _handle(self, request):
+        if request.path == '/healthz':
+            # Для проверок балансировщика: экземпляр жив и очередь не переполнена
+            full = self.application.update_queue.full()
+            return httpd.Response(503 if full else 200, 'full' if full else 'ok')
+        if request.path != WEBHOOK_PATH:
+            return httpd.Response(404, 'Not found')
+        if request.method != 'POST':
+            return httpd.Response(405, 'Method not allowed')
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), self.secret):
+            stats['rejected_secret'] += 1
+            logger.warning("Webhook request with invalid secret token rejected")
+            return httpd.Response(403, 'Forbidden')
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            stats['bad_requests'] += 1
+            logger.warning("Could not parse webhook update", exc_info=True)
+            return httpd.Response(400, 'Bad request')
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            stats['rejected_full'] += 1
+            logger.warning(f"Update queue is full ({self.application.update_queue.maxsize}), asking Telegram to retry")
+            return httpd.Response(503, 'Busy', headers={'Retry-After': '1'})
+        stats['received'] += 1
+        return httpd.Response(200, 'ok')
+
+    async def start(self):
+        self.server = await httpd.start_server(self._handle, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_MAX_BODY)
+        logger.info(f"Listening for webhook updates on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        if WEBHOOK_REGISTER:
+            await self.application.bot.set_webhook(WEBHOOK_URL, secret_token=self.secret.decode(),
+                                                   max_connections=WEBHOOK_MAX_CONNECTIONS,
+                                                   allowed_updates=Update.ALL_TYPES)
+            logger.info(f"Webhook registered at {WEBHOOK_URL}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+async def _run_webhook(application):
+    # Тот же порядок, что у Application.run_polling: initialize, post_init, start ... stop, shutdown
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    server = WebhookServer(application)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await application.start()
+        await stop.wait()
+    finally:
+        # Сначала перестаем принимать, потом дорабатываем то, что уже в очереди
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run(application):
+    # Вместо application.run_polling(): webhook, если задан WEBHOOK_URL, иначе long polling
+    if not enabled():
+        application.run_polling()
+        return
+    # Цикл по умолчанию, как у run_polling: очередь обновлений уже создана и привязана к нему (Python 3.9)
+    asyncio.get_event_loop().run_until_complete(_run_webhook(application))
+
+
+def get_stats():
+    return dict(stats)
@@ -0,0 +1,10 @@
+-- Таблица состояния диалогов (STATE_BACKEND=postgres) для существующей базы (init.sql создает ее только в новой).
+-- Скрипт можно запускать повторно:
+-- psql -U postgres -d <база> -f bot_state.sql
+CREATE TABLE IF NOT EXISTS bot_state (
+    kind VARCHAR(255) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    data BYTEA NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (kind, key)
+);
@@ -0,0 +1,13 @@
+-- Таблица сверток фонового опроса для существующей базы (init.sql создает ее только в новой).
+-- Скрипт можно запускать повторно:
+-- psql -U postgres -d <база> -f host_metrics.sql
+CREATE TABLE IF NOT EXISTS host_metrics (
+    host VARCHAR(255) NOT NULL,
+    metric VARCHAR(255) NOT NULL,
+    bucket TIMESTAMPTZ NOT NULL,
+    min DOUBLE PRECISION NOT NULL,
+    avg DOUBLE PRECISION NOT NULL,
+    max DOUBLE PRECISION NOT NULL,
+    samples INTEGER NOT NULL,
+    PRIMARY KEY (host, metric, bucket)
+);
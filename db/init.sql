@@ -1,18 +1,44 @@
 CREATE USER replication_user WITH REPLICATION ENCRYPTED PASSWORD 'replication_user_password' LOGIN;
 
+-- Значения хранятся в каноническом виде (email в нижнем регистре, телефон в E.164),
+-- уникальный индекс не дает сохранить одно и то же дважды и ищет за O(log n)
 CREATE TABLE email_table (
     id SERIAL PRIMARY KEY,
-    email VARCHAR(255) NOT NULL
+    email VARCHAR(255) NOT NULL,
+    CONSTRAINT email_table_email_key UNIQUE (email),
+    CONSTRAINT email_table_email_canonical CHECK (email = lower(email))
 );
 
 INSERT INTO email_table (email) VALUES ('test1@example.com'), ('test2@example.ru');
 
 CREATE TABLE phone_table (
     id SERIAL PRIMARY KEY,
-    phone_number VARCHAR(20) NOT NULL
+    phone_number VARCHAR(20) NOT NULL,
+    CONSTRAINT phone_table_phone_number_key UNIQUE (phone_number),
+    CONSTRAINT phone_table_phone_number_e164 CHECK (phone_number ~ '^\+[1-9][0-9]{7,14}$')
 );
 
-INSERT INTO phone_table (phone_number) VALUES ('8005553535'), ('1234567890');
+INSERT INTO phone_table (phone_number) VALUES ('+78005553535'), ('+71234567890');
+
+-- Свертки фонового опроса хоста (bot/sampler.py): min/avg/max метрики за интервал SAMPLER_ROLLUP
+CREATE TABLE host_metrics (
+    host VARCHAR(255) NOT NULL,
+    metric VARCHAR(255) NOT NULL,
+    bucket TIMESTAMPTZ NOT NULL,
+    min DOUBLE PRECISION NOT NULL,
+    avg DOUBLE PRECISION NOT NULL,
+    max DOUBLE PRECISION NOT NULL,
+    samples INTEGER NOT NULL,
+    PRIMARY KEY (host, metric, bucket)
+);
+
+CREATE TABLE bot_state (
+    kind VARCHAR(255) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    data BYTEA NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (kind, key)
+);
 
 CREATE TABLE hba ( lines text );
 COPY hba FROM '/var/lib/postgresql/data/pg_hba.conf';
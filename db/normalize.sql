@@ -0,0 +1,51 @@
+-- Перевод существующей базы на канонические значения с уникальными индексами (init.sql делает это
+-- только для новой базы). Скрипт можно запускать повторно:
+-- psql -U postgres -d <база> -f normalize.sql
+BEGIN;
+
+ALTER TABLE email_table DROP CONSTRAINT IF EXISTS email_table_email_key;
+ALTER TABLE email_table DROP CONSTRAINT IF EXISTS email_table_email_canonical;
+ALTER TABLE phone_table DROP CONSTRAINT IF EXISTS phone_table_phone_number_key;
+ALTER TABLE phone_table DROP CONSTRAINT IF EXISTS phone_table_phone_number_e164;
+
+-- Те же правила, что в bot/normalize.py; canonical IS NULL - значение, которое бот не принял бы
+CREATE TEMP TABLE email_canonical ON COMMIT DROP AS
+SELECT id, email, CASE WHEN position('@' IN email) > 0 THEN lower(trim(email)) END AS canonical
+FROM email_table;
+
+CREATE TEMP TABLE phone_canonical ON COMMIT DROP AS
+SELECT id, phone_number, CASE
+        WHEN length(digits) = 10 THEN '+7' || digits
+        WHEN length(digits) = 11 AND left(digits, 1) IN ('7', '8') THEN '+7' || substr(digits, 2)
+        -- Другие коды страны - только в виде +<код><номер>
+        WHEN left(trim(phone_number), 1) = '+' AND length(digits) BETWEEN 8 AND 15 AND left(digits, 1) <> '0'
+            THEN '+' || digits
+    END AS canonical
+FROM (SELECT id, phone_number, regexp_replace(phone_number, '\D', '', 'g') AS digits FROM phone_table) AS d;
+
+-- Нераспознанные значения выводятся перед удалением
+SELECT id, email AS dropped_email FROM email_canonical WHERE canonical IS NULL ORDER BY id;
+SELECT id, phone_number AS dropped_phone_number FROM phone_canonical WHERE canonical IS NULL ORDER BY id;
+DO $$
+BEGIN
+    RAISE NOTICE 'Удаляется нераспознанных email: %, телефонов: %',
+        (SELECT count(*) FROM email_canonical WHERE canonical IS NULL),
+        (SELECT count(*) FROM phone_canonical WHERE canonical IS NULL);
+END $$;
+
+DELETE FROM email_table e USING email_canonical c WHERE e.id = c.id AND c.canonical IS NULL;
+DELETE FROM phone_table p USING phone_canonical c WHERE p.id = c.id AND c.canonical IS NULL;
+UPDATE email_table e SET email = c.canonical FROM email_canonical c WHERE e.id = c.id AND e.email <> c.canonical;
+UPDATE phone_table p SET phone_number = c.canonical
+FROM phone_canonical c WHERE p.id = c.id AND p.phone_number <> c.canonical;
+
+-- Из повторов остается строка с наименьшим id
+DELETE FROM email_table a USING email_table b WHERE a.email = b.email AND a.id > b.id;
+DELETE FROM phone_table a USING phone_table b WHERE a.phone_number = b.phone_number AND a.id > b.id;
+
+ALTER TABLE email_table ADD CONSTRAINT email_table_email_key UNIQUE (email);
+ALTER TABLE email_table ADD CONSTRAINT email_table_email_canonical CHECK (email = lower(email));
+ALTER TABLE phone_table ADD CONSTRAINT phone_table_phone_number_key UNIQUE (phone_number);
+ALTER TABLE phone_table ADD CONSTRAINT phone_table_phone_number_e164 CHECK (phone_number ~ '^\+[1-9][0-9]{7,14}$');
+
+COMMIT;